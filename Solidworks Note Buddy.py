@@ -1,45 +1,76 @@
-import win32com.client
-import os
-import math
-import time
-import json
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, simpledialog, Text, Toplevel
-from PIL import Image, ImageTk, ImageSequence, ImageDraw
-import zipfile
+from PIL import ImageTk
 import io
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from tkinterdnd2 import TkinterDnD, DND_FILES  # Import DnD2
+import queue
+import time
+from frame_cache import FrameCache, fit_size
+from marker_layer import MarkerLayer
+from overview import OverviewPanel
+from atlas import AtlasBuilder
+from pyramid import choose_level
+from backends import SolidWorksBackend
+from sampling import ViewLayout
+from lynx import (
+    LynxArchive, describe_storage, open_frame, open_frame_level, save_lynx_changes, thumbnail_loader,
+    write_animated_webp
+)
+from annotations import MARKER_SPACE, AnnotationStore
+import tracing
+from tracing import span
+
+# The window comes up before anything slow is loaded. Capture, PDF export
+# (ReportLab), note search (sqlite3) and revision compare are imported by
+# the commands that use them, and SolidWorks is attached to in the
+# background once the window is shown. bench.py's startup stage checks
+# the import time against a budget.
 
 
 class ModelAnnotator:
     def __init__(self):
         # Initialize various components
-        self.swApp = win32com.client.Dispatch("SldWorks.Application")
-        self.model = self.swApp.ActiveDoc
-        
-        if not self.model:
-            messagebox.showerror("Error", "No active SolidWorks document found.")
-            exit()
-        
-        self.frame_notes = {}
-        self.frame_markers = {}
+        self.backend = SolidWorksBackend(connect=False)  # attached once the window is up
+
+        self.notes = AnnotationStore()
+        self.note_rows = []  # marker ids in notes_listbox order
+        self.note_row = {}  # marker id -> its row in notes_listbox
         self.current_frame = 0
         self.current_vertical_frame = 0  # Initialize to avoid errors
         self.image_list = []
         self.current_marker = None
-        self.marker_count = 0
         self.h_frames = 0  # Initialize frame counters
         self.v_frames = 0
+        self.layout = ViewLayout(1, 1)  # slider position <-> frame index
         self.current_photo = None
+        self.displayed_frame = None  # (h_index, v_index) currently on the canvas
+        self.prefetch_count = 6
+        self.frame_levels = ()  # pyramid downscale factors available for image_list
+        self.frame_size = None
+        self.refine_delay = 150  # ms after the last slider move before a high quality redraw
+        self.refine_job = None
+        self.render_job = None  # pending after_idle redraw for slider moves
+        self.image_item = None  # persistent canvas item the frames are swapped into
+        self.frame_origin = (0, 0)  # where the (cropped) frames start in the captured viewport
+        self.view = None  # (left, top, scale) of the frame on the canvas
+
+        # Decoded, canvas-sized frames for slider scrubbing
+        self.frame_cache = FrameCache(self.load_frame)
+        self.capture_engine = None
+        self.export_engine = None
+        self.atlas = None  # ThumbnailAtlas of image_list, once built
+        self.atlas_builder = None
+        self.note_index = None  # opened on the first search
+        self.compare_engine = None
+        self.review_markers = set()  # carried from a revision onto a changed region
+        self.marker_tip = None  # (box, text) canvas items of the hover tooltip
 
         self.setup_gui()  # Call setup_gui after initializing attributes
+        self.root.after_idle(self.backend.connect_in_background)
 
     def setup_gui(self):
         # GUI setup code, such as creating Tkinter windows, goes here.
         # Ensure all elements are created and configured in this function.
-        self.root = TkinterDnD.Tk()
+        self.root = tk.Tk()
         self.root.title("3D Model Annotator")
         self.root.geometry("1200x600")
         # Define frames, canvases, sliders, etc.
@@ -49,21 +80,41 @@ class ModelAnnotator:
         # Progress bar update method
         progress = int((current_frame / total_frames) * 100)
         self.progress_bar['value'] = progress
-        self.progress_text.config(text=f"{progress}%")
-        self.root.update_idletasks()
+        self.progress_text.config(text=f"{progress}% ({current_frame}/{total_frames})")
     
 
     def on_slider_change(self, value):
         self.current_frame = int(value)
-        self.show_frame(self.current_frame, self.current_vertical_frame)  # Adjusted to include vertical frame
+        self.request_frame()
         self.frame_counter.config(text=f"Frame: {self.current_frame}/{self.h_frames - 1}")
 
     def on_vertical_slider_change(self, value):
         self.current_vertical_frame = int(value)
-        self.show_frame(self.current_frame, self.current_vertical_frame)
+        self.request_frame()
+
+    def request_frame(self):
+        # Tk calls the slider command for every intermediate value of a drag;
+        # only the latest position is drawn, once the event queue is idle.
+        if self.render_job is None:
+            self.render_job = self.root.after_idle(self.render_requested_frame)
+
+    def render_requested_frame(self):
+        self.render_job = None
+        self.show_frame(self.current_frame, self.current_vertical_frame, fast=True)
+
+    def schedule_refine(self):
+        # Redraw with the high quality filter once the slider settles
+        if self.refine_job is not None:
+            self.root.after_cancel(self.refine_job)
+        self.refine_job = self.root.after(self.refine_delay, self.refine_frame)
+
+    def refine_frame(self):
+        self.refine_job = None
+        if self.displayed_frame is not None:
+            self.show_frame(*self.displayed_frame)
 
     def setup_gui(self):
-        self.root = TkinterDnD.Tk()  # Integrate with DnD2
+        self.root = tk.Tk()
         self.root.title("3D Model Annotator")
         self.root.geometry("1200x600")  # Set window height to 600px
 
@@ -82,6 +133,11 @@ class ModelAnnotator:
         self.canvas = tk.Canvas(self.left_frame, bg="#F0F0F0", highlightthickness=0)
         self.canvas.pack(expand=True, fill="both", padx=10, pady=10)
         self.canvas.bind("<Button-1>", self.add_marker)
+        self.canvas.bind("<Motion>", self.on_canvas_hover)
+        self.canvas.bind("<Leave>", lambda event: self.hide_marker_tip())
+        self.canvas.bind("<Configure>", self.on_canvas_resize)
+        self.marker_layer = MarkerLayer(self.canvas)
+        self.marker_layer.transform = self.frame_to_canvas
 
         # Slider Frame with Note Indicators
         self.slider_frame = tk.Frame(self.left_frame)
@@ -125,6 +181,13 @@ class ModelAnnotator:
         self.notes_frame = tk.Frame(self.right_frame)
         self.notes_frame.pack(side="left", fill="both", expand=True)
 
+        overview_label = tk.Label(self.notes_frame, text="OVERVIEW:", anchor="w", pady=5, font=("Arial", 12, "bold"))
+        overview_label.pack(fill="x")
+
+        # Thumbnail of every view; annotated views are outlined
+        self.overview = OverviewPanel(self.notes_frame, self.on_overview_select)
+        self.overview.pack(fill="x", padx=5)
+
         notes_label = tk.Label(self.notes_frame, text="NOTES:", anchor="w", pady=5, font=("Arial", 12, "bold"))
         notes_label.pack(fill="x")
 
@@ -156,6 +219,13 @@ class ModelAnnotator:
             font=("Arial", 14)
         )
         self.progress_text.pack()
+
+        progress_buttons = tk.Frame(self.progress_frame, bg="#DDDDDD")
+        progress_buttons.pack(pady=(0, 5))
+        self.pause_button = tk.Button(progress_buttons, text="Pause", width=8, command=self.toggle_capture_pause)
+        self.pause_button.pack(side="left", padx=5)
+        tk.Button(progress_buttons, text="Cancel", width=8, command=self.cancel_job).pack(side="left", padx=5)
+
         self.progress_frame.place_forget()
 
     def setup_menu(self):
@@ -164,80 +234,188 @@ class ModelAnnotator:
         file_menu.add_command(label="Process Model", command=self.process_model)
         file_menu.add_command(label="Save as LYNX", command=self.save_lynx)
         file_menu.add_command(label="Open LYNX", command=self.open_lynx)
+        file_menu.add_command(label="Search Notes...", command=self.search_notes)
+        file_menu.add_command(label="Carry Notes From Revision...", command=self.compare_revision)
         file_menu.add_separator()
         file_menu.add_command(label="Save As PDF", command=self.save_as_pdf)
-        file_menu.add_command(label="Close", command=self.root.quit)
+        file_menu.add_command(label="Close", command=self.on_close)
         menu_bar.add_cascade(label="File", menu=file_menu)
+
+        view_menu = tk.Menu(menu_bar, tearoff=0)
+        view_menu.add_command(label="Frame Cache Statistics", command=self.show_cache_stats)
+        view_menu.add_separator()
+        self.trace_var = tk.BooleanVar(value=tracing.is_enabled())
+        view_menu.add_checkbutton(label="Record Trace", variable=self.trace_var, command=self.toggle_trace)
+        view_menu.add_command(label="Export Trace...", command=self.export_trace)
+        menu_bar.add_cascade(label="View", menu=view_menu)
         self.root.config(menu=menu_bar)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_close(self):
+        self.cancel_job()
+        self.root.quit()
 
     def update_rotation_mode(self):
         pass
 
-    def add_marker(self, event):
-        if not self.image_list:
-            return
+    def show_cache_stats(self):
+        stats = self.frame_cache.stats()
+        messagebox.showinfo(
+            "Frame Cache",
+            f"Hits: {stats['hits']}\n"
+            f"Misses: {stats['misses']}\n"
+            f"Hit rate: {stats['hit_rate']:.1%}\n"
+            f"Prefetched: {stats['prefetched']}\n"
+            f"Entries: {stats['entries']}\n"
+            f"Memory: {stats['bytes'] / 2**20:.1f} / {stats['max_bytes'] / 2**20:.0f} MB"
+        )
 
-        x = self.canvas.canvasx(event.x)
-        y = self.canvas.canvasy(event.y)
+    def toggle_trace(self):
+        if self.trace_var.get():
+            tracing.enable()
+        else:
+            tracing.disable()
 
-        self.marker_count += 1
+    def export_trace(self):
+        rows = tracing.summary()
+        if not rows:
+            messagebox.showinfo("Trace", "Nothing has been recorded. Turn on View > Record Trace first.")
+            return
 
-        self.canvas.create_polygon(
-            x-10, y+20,
-            x, y,
-            x+10, y+20,
-            fill="red",
-            tags=f"marker_{self.marker_count}"
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("Chrome trace", "*.json")],
+            title="Export Trace"
         )
+        if not file_path:
+            return
 
-        circle_radius = 10
-        self.canvas.create_oval(
-            x-circle_radius, y+20-circle_radius,
-            x+circle_radius, y+20+circle_radius,
-            fill="white",
-            tags=f"marker_{self.marker_count}"
-        )
+        table = tracing.format_summary(rows)
+        tracing.write_chrome_trace(file_path)
+        with open(file_path.rsplit('.', 1)[0] + '_summary.txt', 'w') as f:
+            f.write(table + '\n')
+        tracing.clear()
+
+        summary_window = Toplevel(self.root)
+        summary_window.title("Trace Summary")
+        summary_text = Text(summary_window, width=90, height=min(30, len(rows) + 2), font=("Courier", 9))
+        summary_text.insert("1.0", table)
+        summary_text.config(state="disabled")
+        summary_text.pack(expand=True, fill="both", padx=10, pady=10)
+
+    def on_canvas_resize(self, event):
+        # Cached frames are scaled to the old canvas size
+        self.frame_cache.clear()
+        if self.displayed_frame is not None:
+            self.show_frame(*self.displayed_frame)
+
+    def frame_to_canvas(self, x, y):
+        # Markers are stored in uncropped frame pixels
+        left, top, scale = self.view
+        return left + (x - self.frame_origin[0]) * scale, top + (y - self.frame_origin[1]) * scale
+
+    def canvas_to_frame(self, x, y):
+        left, top, scale = self.view
+        return (x - left) / scale + self.frame_origin[0], (y - top) / scale + self.frame_origin[1]
 
-        self.canvas.create_text(
-            x, y+20,
-            text=str(self.marker_count),
-            font=("Arial", 8, "bold"),
-            tags=f"marker_{self.marker_count}"
-        )
+    def add_marker(self, event):
+        if not self.image_list or self.view is None:
+            return
 
-        frame_index = self.current_vertical_frame * self.h_frames + self.current_frame
-        if frame_index not in self.frame_markers:
-            self.frame_markers[frame_index] = []
+        canvas_x, canvas_y = self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
+        hit = self.marker_layer.hit(canvas_x, canvas_y)
+        if len(hit) == 1:
+            self.select_note(hit[0])
+            return
+        if hit:
+            # A badge of overlapping markers; pick one of them
+            menu = tk.Menu(self.root, tearoff=0)
+            for marker_id in hit:
+                menu.add_command(label=self.notes.get(marker_id).label,
+                                 command=lambda marker_id=marker_id: self.select_note(marker_id))
+            menu.tk_popup(event.x_root, event.y_root)
+            return
+
+        x, y = self.canvas_to_frame(canvas_x, canvas_y)
 
-        self.frame_markers[frame_index].append((x, y, self.marker_count))
+        frame_index = self.layout.frame_at(self.current_frame, self.current_vertical_frame)
+        note = self.notes.add(frame_index, x, y)
+        # Redrawn as a whole, as the new marker may join or split a badge
+        self.marker_layer.show(self.notes.in_frame(frame_index))
 
-        note_text = f"#{self.marker_count}"
-        self.notes_listbox.insert(tk.END, note_text)
+        self.notes_listbox.insert(tk.END, note.label)
+        self.note_row[note.marker_id] = len(self.note_rows)
+        self.note_rows.append(note.marker_id)
         self.update_note_indicators()
 
-    def on_note_select(self, event):
-        selection = self.notes_listbox.curselection()
-        if selection:
-            note_text = self.notes_listbox.get(selection[0])
-            marker_num = int(note_text.split('-')[0].strip('#').strip())
-            frame_num = next(
-                (frame for frame, markers in self.frame_markers.items()
-                 if any(marker[2] == marker_num for marker in markers)),
-                None
-            )
-            if frame_num is not None:
-                v_index = frame_num // self.h_frames
-                h_index = frame_num % self.h_frames
-                self.slider.set(h_index)
-                self.vertical_slider.set(v_index)
-                self.show_frame(h_index, v_index)
+    def on_canvas_hover(self, event):
+        hit = self.marker_layer.hit(self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+        if not hit:
+            self.hide_marker_tip()
+            return
 
-    def edit_note(self, event):
+        labels = [self.notes.get(marker_id).label for marker_id in hit[:8]]
+        if len(hit) > 8:
+            labels.append(f"... and {len(hit) - 8} more")
+        if self.marker_tip is None:
+            self.marker_tip = (
+                self.canvas.create_rectangle(0, 0, 0, 0, fill="#FFFFE0", outline="#808080"),
+                self.canvas.create_text(0, 0, anchor="nw", font=("Arial", 9), width=300),
+            )
+        box, text = self.marker_tip
+        self.canvas.itemconfigure(text, text="\n".join(labels), state="normal")
+        self.canvas.coords(text, self.canvas.canvasx(event.x) + 14, self.canvas.canvasy(event.y) + 14)
+        left, top, right, bottom = self.canvas.bbox(text)
+        self.canvas.coords(box, left - 4, top - 2, right + 4, bottom + 2)
+        self.canvas.itemconfigure(box, state="normal")
+        self.canvas.tag_raise(box)
+        self.canvas.tag_raise(text)
+
+    def hide_marker_tip(self):
+        if self.marker_tip is not None:
+            for item in self.marker_tip:
+                self.canvas.itemconfigure(item, state="hidden")
+
+    def select_note(self, marker_id):
+        row = self.note_row[marker_id]
+        self.notes_listbox.selection_clear(0, tk.END)
+        self.notes_listbox.selection_set(row)
+        self.notes_listbox.see(row)
+
+    def refresh_notes_list(self):
+        # The listbox is only a view over self.notes
+        self.notes_listbox.delete(0, tk.END)
+        self.note_rows = [note.marker_id for note in self.notes]
+        self.note_row = {marker_id: row for row, marker_id in enumerate(self.note_rows)}
+        self.notes_listbox.insert(tk.END, *[note.label for note in self.notes])
+        for row, marker_id in enumerate(self.note_rows):
+            if marker_id in self.review_markers:
+                self.notes_listbox.itemconfigure(row, fg="red")
+
+    def selected_note(self):
         selection = self.notes_listbox.curselection()
         if not selection:
+            return None, None
+        row = selection[0]
+        return row, self.notes.get(self.note_rows[row])
+
+    def on_note_select(self, event):
+        row, note = self.selected_note()
+        if note is not None:
+            h_index, v_index = self.layout.slot_of(note.frame)
+            self.slider.set(h_index)
+            self.vertical_slider.set(v_index)
+            self.show_frame(h_index, v_index)
+
+    def on_overview_select(self, h_index, v_index):
+        self.slider.set(h_index)
+        self.vertical_slider.set(v_index)
+        self.show_frame(h_index, v_index)
+
+    def edit_note(self, event):
+        row, note = self.selected_note()
+        if note is None:
             return
-        index = selection[0]
-        note_text = self.notes_listbox.get(index)
 
         edit_window = Toplevel(self.root)
         edit_window.title("Edit Note")
@@ -245,55 +423,57 @@ class ModelAnnotator:
 
         tk.Label(edit_window, text="Enter note details:").pack(anchor="w", padx=10)
         details_text = Text(edit_window, width=40, height=10)
+        details_text.insert("1.0", note.text)
         details_text.pack(padx=10, pady=5)
 
         author_frame = tk.Frame(edit_window)
         tk.Label(author_frame, text="Author:").pack(side="left", padx=(10, 5))
         author_entry = tk.Entry(author_frame, width=30)
+        author_entry.insert(0, note.author)
         author_entry.pack(side="left")
         author_frame.pack(anchor="w", pady=(5, 0))
 
         def save_note():
             details = details_text.get("1.0", tk.END).strip()
             author = author_entry.get().strip()
-            updated_text = f"{note_text.split('-')[0]} - {details}"
-            if author:
-                updated_text += f" (Author: {author})"
-            self.notes_listbox.delete(index)
-            self.notes_listbox.insert(index, updated_text)
+            self.notes.update(note.marker_id, details, author)
+            # Editing a note carried from a revision counts as reviewing it
+            self.review_markers.discard(note.marker_id)
+            self.notes_listbox.delete(row)
+            self.notes_listbox.insert(row, note.label)
             edit_window.destroy()
 
         tk.Button(edit_window, text="Save", command=save_note).pack(pady=10)
 
     def delete_note(self, event):
-        selection = self.notes_listbox.curselection()
-        if selection:
-            note_text = self.notes_listbox.get(selection[0])
-            marker_num = int(note_text.split('-')[0].strip('#').strip())
-
-            frame_num = next((frame for frame, markers in self.frame_markers.items()
-                              if any(marker[2] == marker_num for marker in markers)), None)
-            if frame_num is not None:
-                self.frame_markers[frame_num] = [
-                    marker for marker in self.frame_markers[frame_num] if marker[2] != marker_num
-                ]
-                self.canvas.delete(f"marker_{marker_num}")
+        row, note = self.selected_note()
+        if note is None:
+            return
 
-                if not self.frame_markers[frame_num]:
-                    del self.frame_markers[frame_num]
-                    self.update_note_indicators()
+        self.notes.remove(note.marker_id)
+        self.review_markers.discard(note.marker_id)
+        if self.displayed_frame is not None and self.layout.frame_at(*self.displayed_frame) == note.frame:
+            self.marker_layer.show(self.notes.in_frame(note.frame))
+        self.notes_listbox.delete(row)
+        del self.note_rows[row]
+        del self.note_row[note.marker_id]
+        # Only the rows below the deleted one move up
+        for later in range(row, len(self.note_rows)):
+            self.note_row[self.note_rows[later]] = later
 
-            self.notes_listbox.delete(selection[0])
+        if not self.notes.in_frame(note.frame):
+            self.update_note_indicators()
 
     def update_note_indicators(self):
         self.indicator_canvas.delete("all")
         width = self.slider.winfo_width()
+        self.overview.set_annotated(self.notes.frames())
 
         if not self.image_list:
             return
 
-        for frame_num in self.frame_markers.keys():
-            h_index = frame_num % self.h_frames
+        for frame_num in self.notes.frames():
+            h_index = self.layout.slot_of(frame_num)[0]
             x_pos = (h_index / (self.h_frames - 1)) * (width - 20) + 10
             self.indicator_canvas.create_polygon(
                 x_pos-5, 0,
@@ -303,52 +483,144 @@ class ModelAnnotator:
             )
 
     def save_as_pdf(self):
+        from pdf_export import CODECS, LAYOUTS, PdfExportEngine
+
+        if self.export_engine is not None:
+            messagebox.showerror("Error", "A PDF export is already running.")
+            return
+        if not self.notes:
+            messagebox.showerror("Error", "No notes to export.")
+            return
+
         pdf_path = filedialog.asksaveasfilename(defaultextension=".pdf", filetypes=[("PDF files", "*.pdf")])
         if not pdf_path:
             return
 
-        pdf = canvas.Canvas(pdf_path, pagesize=A4)
+        options_window = Toplevel(self.root)
+        options_window.title("PDF Options")
+        options_window.geometry("300x200")
+
+        views_var = tk.IntVar(value=1)
+        codec_var = tk.StringVar(value=CODECS[0])
+        size_var = tk.IntVar(value=1200)
+
+        tk.Label(options_window, text="Views per page:").grid(row=0, column=0, sticky="w", padx=10, pady=5)
+        tk.OptionMenu(options_window, views_var, *LAYOUTS).grid(row=0, column=1, sticky="w")
+        tk.Label(options_window, text="Image compression:").grid(row=1, column=0, sticky="w", padx=10, pady=5)
+        tk.OptionMenu(options_window, codec_var, *CODECS).grid(row=1, column=1, sticky="w")
+        tk.Label(options_window, text="Max image size (px):").grid(row=2, column=0, sticky="w", padx=10, pady=5)
+        tk.Spinbox(options_window, from_=200, to=8000, increment=100, width=8, textvariable=size_var).grid(row=2, column=1, sticky="w")
+
+        def start_export():
+            try:
+                max_size = size_var.get()
+            except tk.TclError:
+                messagebox.showerror("Error", "Max image size must be a number.", parent=options_window)
+                return
+            options_window.destroy()
+
+            self.export_engine = PdfExportEngine(
+                pdf_path, self.image_list, self.notes,
+                views_per_page=views_var.get(),
+                max_size=max_size,
+                codec=codec_var.get(),
+                origin=self.frame_origin
+            )
+            self.pause_button.config(state="disabled")
+            self.update_progress(0, len(self.export_engine.views))
+            self.progress_frame.place(relx=0.5, rely=0.95, anchor="s", relwidth=0.4, relheight=0.15)
+            self.export_engine.start()
+            self.root.after(50, self.poll_export)
 
-        for frame_num, markers in self.frame_markers.items():
-            frame_path = self.image_list[frame_num]
-            img = Image.open(frame_path)
+        tk.Button(options_window, text="Export", command=start_export).grid(row=3, column=0, columnspan=2, pady=15)
 
-            img_draw = ImageDraw.Draw(img)
-            for x, y, marker_num in markers:
-                img_draw.ellipse((x-5, y-5, x+5, y+5), fill="red")
-                img_draw.text((x+10, y), f"#{marker_num}", fill="red")
+    def poll_export(self):
+        engine = self.export_engine
+        if engine is None:
+            return
 
-            img_buffer = io.BytesIO()
-            img.save(img_buffer, format="PNG")
-            img_buffer.seek(0)
+        try:
+            while True:
+                kind, payload = engine.events.get_nowait()
+                if kind == 'progress':
+                    self.update_progress(*payload)
+                else:
+                    self.finish_export(kind, payload)
+                    return
+        except queue.Empty:
+            pass
 
-            img_width, img_height = img.size
-            aspect_ratio = img_width / img_height
-            pdf_width, pdf_height = 300, int(300 / aspect_ratio)
+        self.root.after(50, self.poll_export)
 
-            pdf.drawImage(img_buffer, 50, A4[1] - pdf_height - 100, width=pdf_width, height=pdf_height)
-            pdf.drawString(50, A4[1] - pdf_height - 120, f"Frame {frame_num}")
+    def finish_export(self, kind, payload):
+        self.export_engine = None
+        self.progress_frame.place_forget()
+        self.pause_button.config(state="normal")
 
-            for marker in markers:
-                note_text = self.notes_listbox.get(marker[2] - 1)
-                pdf.drawString(50, A4[1] - pdf_height - 140 - (markers.index(marker) * 15), f"#{marker[2]}: {note_text}")
+        if kind == 'done':
+            messagebox.showinfo("Saved", "PDF saved successfully.")
+        elif kind == 'error':
+            messagebox.showerror("Error", f"Failed to save PDF: {payload}")
 
-            pdf.showPage()
+    def process_model(self):
+        from capture import SAMPLING_MODES, slider_positions
 
-        pdf.save()
-        messagebox.showinfo("Saved", "PDF saved successfully.")
+        if self.capture_engine is not None:
+            messagebox.showerror("Error", "A capture is already running.")
+            return
+
+        # Blocks only if the background attach hasn't finished yet
+        self.root.config(cursor="watch")
+        self.root.update_idletasks()
+        try:
+            has_document = self.backend.use_active_document()
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not connect to SolidWorks: {str(e)}")
+            return
+        finally:
+            self.root.config(cursor="")
+        if not has_document:
+            messagebox.showerror("Error", "No active SolidWorks document found.")
+            return
 
-    def process_model(self):
         output_dir = filedialog.askdirectory(title="Select Output Folder")
         if not output_dir:
             return
 
-        self.image_list = self.rotate_and_capture(output_dir)
-        if self.image_list:
-            self.slider.config(to=self.h_frames - 1)
-            self.vertical_slider.config(to=self.v_frames - 1)
-            self.show_frame(0, 0)
-            self.frame_counter.config(text=f"Frame: 0/{self.h_frames - 1}")
+        options_window = Toplevel(self.root)
+        options_window.title("Capture Options")
+        options_window.geometry("300x170")
+
+        # Sphere views get a slider position each; rotate_and_capture's steps
+        h_frames, v_frames = slider_positions()
+        max_views = h_frames * v_frames
+        sampling_var = tk.StringVar(value=SAMPLING_MODES[0])
+        views_var = tk.IntVar(value=96)
+        refine_var = tk.IntVar(value=0)
+
+        tk.Label(options_window, text="Sampling:").grid(row=0, column=0, sticky="w", padx=10, pady=5)
+        tk.OptionMenu(options_window, sampling_var, *SAMPLING_MODES).grid(row=0, column=1, sticky="w")
+        tk.Label(options_window, text="Views (sphere):").grid(row=1, column=0, sticky="w", padx=10, pady=5)
+        tk.Spinbox(options_window, from_=12, to=max_views, increment=12, width=8, textvariable=views_var).grid(row=1, column=1, sticky="w")
+        tk.Label(options_window, text="Extra detail views:").grid(row=2, column=0, sticky="w", padx=10, pady=5)
+        tk.Spinbox(options_window, from_=0, to=max_views - 12, increment=4, width=8, textvariable=refine_var).grid(row=2, column=1, sticky="w")
+
+        def start_capture():
+            try:
+                view_count = views_var.get()
+                refine = refine_var.get()
+            except tk.TclError:
+                messagebox.showerror("Error", "View counts must be numbers.", parent=options_window)
+                return
+            if sampling_var.get() == 'sphere' and not 0 < view_count + refine <= max_views:
+                messagebox.showerror("Error", f"Views and extra detail views can add up to at most {max_views}, "
+                                     "one per slider position.", parent=options_window)
+                return
+            options_window.destroy()
+            self.set_frame_source([])
+            self.rotate_and_capture(output_dir, sampling=sampling_var.get(), view_count=view_count, refine=refine)
+
+        tk.Button(options_window, text="Capture", command=start_capture).grid(row=3, column=0, columnspan=2, pady=15)
 
     def save_lynx(self):
         if not self.image_list:
@@ -365,22 +637,45 @@ class ModelAnnotator:
             return
 
         try:
-            with zipfile.ZipFile(file_path, 'w', zipfile.ZIP_DEFLATED) as lynx_file:
-                webp_data = self.create_webp()
-                lynx_file.writestr('animation.webp', webp_data)
-
-                data = {
-                    'frame_count': len(self.image_list),
-                    'notes': {i: self.notes_listbox.get(i) for i in range(self.notes_listbox.size())},
-                    'markers': self.frame_markers
-                }
-                lynx_file.writestr('data.json', json.dumps(data))
-
-            messagebox.showinfo("Success", "File saved successfully!")
+            data = {
+                'frame_count': len(self.image_list),
+                'h_frames': self.h_frames,
+                'v_frames': self.v_frames,
+                'views': self.layout.views,
+                'crop': self.crop_box(),
+                'review': sorted(self.review_markers),
+                **self.notes.to_data()
+            }
+            # Frames are streamed into the archive one at a time; re-saving the
+            # open file only appends the annotations
+            stats = save_lynx_changes(file_path, self.image_list, data, atlas=self.atlas)
+            if stats is not None and self.capture_engine is None:
+                self.use_saved_frames(file_path)
+
+            if self.note_index is not None:
+                self.note_index.update_file(file_path)
+
+            if stats is None:
+                messagebox.showinfo("Success", "File saved successfully!")
+            else:
+                messagebox.showinfo("Success", f"File saved successfully!\n\n{describe_storage(stats)}")
 
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save file: {str(e)}")
 
+    def use_saved_frames(self, file_path):
+        # After a full save, read the frames from the saved file, so later
+        # saves of it only journal the annotations
+        frames = self.image_list
+        if isinstance(frames, LynxArchive) and frames.is_file(file_path):
+            return
+        atlas = self.atlas
+        archive = LynxArchive(file_path)
+        self.set_frame_source(archive, archive.levels, self.frame_origin)
+        self.set_atlas(atlas if atlas is not None else archive.atlas())
+        if self.h_frames:
+            self.show_frame(self.current_frame, self.current_vertical_frame)
+
     def open_lynx(self):
         file_path = filedialog.askopenfilename(
             filetypes=[("LYNX files", "*.lynx")],
@@ -390,160 +685,529 @@ class ModelAnnotator:
         if not file_path:
             return
 
+        if self.open_lynx_file(file_path):
+            messagebox.showinfo("Success", "File loaded successfully!")
+
+    def open_lynx_file(self, file_path):
         try:
-            temp_dir = os.path.join(os.path.dirname(file_path), "temp_frames")
-            os.makedirs(temp_dir, exist_ok=True)
+            # Frames stay in the archive and are decoded when shown
+            archive = LynxArchive(file_path)
+            data = archive.data
+
+            self.notes = AnnotationStore.from_data(data)
+            self.review_markers = set(data.get('review', ()))
+            self.refresh_notes_list()
+            if 'h_frames' in data:
+                self.h_frames = data['h_frames']
+                self.v_frames = data['v_frames']
+            elif len(archive) % 24 == 0:
+                # Older files don't record the grid; assume the default 15 degree steps
+                self.h_frames = 24
+                self.v_frames = len(archive) // 24
+            else:
+                self.h_frames = len(archive)
+                self.v_frames = 1
+            self.layout = ViewLayout(self.h_frames, self.v_frames, data.get('views'))
+
+            crop = data.get('crop')
+            self.set_frame_source(archive, archive.levels, crop[:2] if crop else (0, 0))
+            if archive.has_atlas:
+                self.set_atlas(archive.atlas())
+            else:
+                # Files saved before the overview existed
+                self.build_atlas()
+            if data.get('marker_space') != MARKER_SPACE:
+                self.convert_canvas_markers()
 
-            with zipfile.ZipFile(file_path, 'r') as lynx_file:
-                data = json.loads(lynx_file.read('data.json'))
+            self.slider.config(to=self.h_frames - 1)
+            self.vertical_slider.config(to=self.v_frames - 1)
+            self.slider.set(0)
+            self.vertical_slider.set(0)
+            self.show_frame(0, 0)
+            self.frame_counter.config(text=f"Frame: 0/{self.h_frames - 1}")
+            self.update_note_indicators()
+            return True
 
-                self.notes_listbox.delete(0, tk.END)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to load file: {str(e)}")
+            return False
+
+    def search_notes(self):
+        from note_index import NoteIndex, format_hit
+
+        if self.note_index is None:
+            self.note_index = NoteIndex()
+        index = self.note_index
+
+        search_window = Toplevel(self.root)
+        search_window.title("Search Notes")
+        search_window.geometry("700x420")
+
+        query_var = tk.StringVar()
+        top = tk.Frame(search_window)
+        top.pack(fill="x", padx=10, pady=(10, 5))
+        entry = tk.Entry(top, textvariable=query_var)
+        entry.pack(side="left", fill="x", expand=True)
+        tk.Button(top, text="Add Folder...", command=lambda: add_folder()).pack(side="left", padx=(5, 0))
+
+        results = tk.Listbox(search_window)
+        results.pack(expand=True, fill="both", padx=10)
+        status = tk.Label(search_window, anchor="w")
+        status.pack(fill="x", padx=10, pady=5)
+        hits = []
+
+        def describe_index():
+            if not index.roots:
+                return "No folders indexed yet. Use Add Folder... to index the LYNX files in a folder."
+            return f"{len(index)} notes in {index.file_count()} files under {', '.join(index.roots)}"
+
+        def run_search(event=None):
+            query = query_var.get().strip()
+            results.delete(0, tk.END)
+            hits[:] = []
+            if not query:
+                status.config(text=describe_index())
+                return
+            start = time.perf_counter()
+            try:
+                hits[:] = index.search(query)
+            except ValueError as e:
+                status.config(text=str(e))
+                return
+            elapsed = time.perf_counter() - start
+            results.insert(tk.END, *[format_hit(hit) for hit in hits])
+            status.config(text=f"{len(hits)} hits in {elapsed * 1000:.1f} ms")
+
+        def add_folder():
+            folder = filedialog.askdirectory(title="Index LYNX Files In", parent=search_window)
+            if not folder:
+                return
+            search_window.config(cursor="watch")
+            search_window.update_idletasks()
+            try:
+                index.add_root(folder)
+            finally:
+                search_window.config(cursor="")
+            run_search()
+
+        def open_hit(event=None):
+            selection = results.curselection()
+            if selection:
+                self.open_search_hit(hits[selection[0]])
+
+        entry.bind("<KeyRelease>", run_search)
+        entry.bind("<Return>", open_hit)
+        results.bind("<Double-Button-1>", open_hit)
+        entry.focus_set()
+
+        # Files saved or copied since the last search are picked up here
+        search_window.config(cursor="watch")
+        search_window.update_idletasks()
+        try:
+            index.update()
+        finally:
+            search_window.config(cursor="")
+        run_search()
+
+    def open_search_hit(self, hit):
+        # The hit's file stays as it is when it is already open, unsaved notes included
+        frames = self.image_list
+        if not (isinstance(frames, LynxArchive) and frames.is_file(hit.path)):
+            if not self.open_lynx_file(hit.path):
+                return
+
+        note = self.notes.get(hit.marker_id)
+        frame = note.frame if note is not None else hit.frame
+        h_index, v_index = self.layout.slot_of(frame)
+        self.slider.set(h_index)
+        self.vertical_slider.set(v_index)
+        self.show_frame(h_index, v_index)
+        if note is not None:
+            self.select_note(note.marker_id)
+
+    def rotate_and_capture(self, output_dir, h_total_degrees=360, h_step_degrees=15, v_total_degrees=180, v_step_degrees=15, delay=0.05,
+                           sampling='grid', view_count=96, refine=0):
+        from capture import CaptureEngine
+
+        # Capture runs on a worker; frames are picked up by poll_capture
+        self.capture_engine = CaptureEngine(
+            self.backend, output_dir,
+            h_total_degrees=h_total_degrees,
+            h_step_degrees=h_step_degrees,
+            v_total_degrees=v_total_degrees,
+            v_step_degrees=v_step_degrees,
+            delay=delay,
+            sampling=sampling,
+            view_count=view_count,
+            refine=refine
+        )
+        self.h_frames = self.capture_engine.h_frames
+        self.v_frames = self.capture_engine.v_frames
+        self.layout = ViewLayout(self.h_frames, self.v_frames, self.capture_engine.views)
+        self.frame_levels = self.capture_engine.pyramid_levels
+        self.overview.show_message("Overview follows the capture")
+
+        self.slider.config(to=self.h_frames - 1)
+        self.vertical_slider.config(to=self.v_frames - 1)
+        self.slider.set(0)
+        self.vertical_slider.set(0)
+        self.frame_counter.config(text=f"Frame: 0/{self.h_frames - 1}")
+
+        self.pause_button.config(text="Pause")
+        self.update_progress(0, self.capture_engine.total_frames)
+        self.progress_frame.place(relx=0.5, rely=0.95, anchor="s", relwidth=0.4, relheight=0.15)
+
+        self.capture_engine.start()
+        self.root.after(50, self.poll_capture)
+
+    def poll_capture(self):
+        engine = self.capture_engine
+        if engine is None:
+            return
 
-                for note in data['notes'].values():
-                    self.notes_listbox.insert(tk.END, note)
+        try:
+            while True:
+                kind, payload = engine.events.get_nowait()
+                if kind == 'frame':
+                    self.on_frame_captured(*payload)
+                elif kind == 'crop':
+                    self.on_frames_cropped(payload)
+                else:
+                    self.finish_capture(kind, payload)
+                    return
+        except queue.Empty:
+            pass
+
+        self.root.after(50, self.poll_capture)
+
+    def on_frame_captured(self, frame_index, frame_path):
+        engine = self.capture_engine
+        if engine.views is not None and len(engine.views) != len(self.layout.views):
+            # Refined views were added once the base views were in
+            self.layout.set_views(list(engine.views))
+        self.image_list.append(frame_path)
+        self.update_progress(frame_index + 1, self.capture_engine.total_frames)
+        settle = self.capture_engine.settle_seconds.get(frame_index)
+        if settle is not None:
+            self.progress_text.config(text=f"{self.progress_text.cget('text')} - settled in {settle * 1000:.0f} ms")
+
+        # Show the frame if the sliders are already waiting on it
+        requested = self.layout.frame_at(self.current_frame, self.current_vertical_frame)
+        if frame_index == requested:
+            self.show_frame(self.current_frame, self.current_vertical_frame)
+
+    def on_frames_cropped(self, crop):
+        # The frame files were cropped in place; markers keep their position
+        self.frame_origin = tuple(crop[:2])
+        self.frame_size = None
+        self.frame_cache.clear()
+        if self.displayed_frame is not None:
+            self.show_frame(*self.displayed_frame)
+
+    def finish_capture(self, kind, payload):
+        self.capture_engine = None
+        self.progress_frame.place_forget()
+        if self.image_list:
+            self.build_atlas()
 
-                self.frame_markers = {int(k): v for k, v in data.get('markers', {}).items()}
+        if kind == 'error':
+            messagebox.showerror(
+                "Error",
+                f"{payload}\n\nRun Process Model on the same folder to resume from this frame."
+            )
+        elif kind == 'cancelled':
+            messagebox.showinfo("Cancelled", f"Capture cancelled after {len(self.image_list)} frames.")
 
-                webp_data = lynx_file.read('animation.webp')
-                webp_buffer = io.BytesIO(webp_data)
-                animation = Image.open(webp_buffer)
+    def toggle_capture_pause(self):
+        engine = self.capture_engine
+        if engine is None:
+            return
+        if engine.paused:
+            engine.resume()
+            self.pause_button.config(text="Pause")
+        else:
+            engine.pause()
+            self.pause_button.config(text="Resume")
+
+    def cancel_job(self):
+        if self.capture_engine is not None:
+            self.capture_engine.cancel()
+        if self.export_engine is not None:
+            self.export_engine.cancel()
+        if self.compare_engine is not None:
+            self.compare_engine.cancel()
+
+    def compare_revision(self):
+        from revision import CaptureSet, RevisionCompareEngine, open_capture_set
+
+        # The frames on screen are the new revision; markers come from an older file
+        if not self.image_list or self.capture_engine is not None:
+            messagebox.showerror("Error", "Process or open the new revision first.")
+            return
+        if self.compare_engine is not None:
+            messagebox.showerror("Error", "A comparison is already running.")
+            return
 
-                self.image_list = []
-                for i, frame in enumerate(ImageSequence.Iterator(animation)):
-                    frame_path = os.path.join(temp_dir, f"frame_{i:03d}.png")
-                    frame.save(frame_path, "PNG")
-                    self.image_list.append(frame_path)
+        file_path = filedialog.askopenfilename(
+            filetypes=[("LYNX files", "*.lynx")],
+            title="Open Previous Revision"
+        )
+        if not file_path:
+            return
 
-                self.slider.config(to=self.h_frames - 1)
-                self.vertical_slider.config(to=self.v_frames - 1)
-                self.slider.set(0)
-                self.vertical_slider.set(0)
-                self.show_frame(0, 0)
-                self.frame_counter.config(text=f"Frame: 0/{self.h_frames - 1}")
-                self.update_note_indicators()
+        try:
+            old = open_capture_set(file_path)
+            new = CaptureSet(self.image_list, self.frame_origin, self.h_frames, self.v_frames,
+                             self.layout.views, self.notes, sorted(self.review_markers))
+            self.compare_engine = RevisionCompareEngine(old, new)
+        except Exception as e:
+            messagebox.showerror("Error", f"Can't compare: {str(e)}")
+            return
 
-                messagebox.showinfo("Success", "File loaded successfully!")
+        self.pause_button.config(state="disabled")
+        self.update_progress(0, len(self.image_list))
+        self.progress_frame.place(relx=0.5, rely=0.95, anchor="s", relwidth=0.4, relheight=0.15)
+        self.compare_engine.start()
+        self.root.after(50, self.poll_compare)
 
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to load file: {str(e)}")
-        finally:
-            if 'temp_dir' in locals() and os.path.exists(temp_dir):
-                try:
-                    for file in os.listdir(temp_dir):
-                        os.remove(os.path.join(temp_dir, file))
-                    os.rmdir(temp_dir)
-                except:
-                    pass
-
-    def rotate_and_capture(self, output_dir, h_total_degrees=360, h_step_degrees=15, v_total_degrees=180, v_step_degrees=15, delay=0.05):
-        self.model.ShowNamedView2("*Top", 1)
-        self.model.ViewZoomtofit2()
-        time.sleep(delay)
-
-        h_steps = int(h_total_degrees / h_step_degrees)
-        v_steps = int(v_total_degrees / v_step_degrees) + 1
-        self.h_frames = h_steps
-        self.v_frames = v_steps
-
-        self.progress_frame.place(relx=0.5, rely=0.5, anchor="center", relwidth=0.4, relheight=0.1)
-        total_frames = h_steps * v_steps
-        current_frame = 0
-
-        for v_index, v_angle in enumerate(range(0, v_total_degrees + 1, v_step_degrees)):
-            self.model.ActiveView.RotateAboutCenter(math.radians(v_angle), 0)
-            time.sleep(delay)
-
-            for h_index in range(h_steps):
-                try:
-                    self.model.ActiveView.RotateAboutCenter(0, math.radians(h_step_degrees))
-                    time.sleep(delay)
-
-                    frame_path = os.path.join(output_dir, f"frame_{current_frame:03d}.png")
-                    self.model.SaveAs(frame_path)
-                    self.image_list.append(frame_path)
-
-                    current_frame += 1
-                    self.update_progress(current_frame, total_frames)
-                    time.sleep(delay)
-                except Exception as e:
-                    messagebox.showerror("Error", f"Failed to capture frame {current_frame}: {e}")
-                    self.progress_frame.place_forget()
-                    return None
-
-        self.model.ShowNamedView2("*Top", 1)
-        self.model.ViewZoomtofit2()
+    def poll_compare(self):
+        engine = self.compare_engine
+        if engine is None:
+            return
+
+        try:
+            while True:
+                kind, payload = engine.events.get_nowait()
+                if kind == 'progress':
+                    self.update_progress(*payload)
+                else:
+                    self.finish_compare(kind, payload)
+                    return
+        except queue.Empty:
+            pass
+
+        self.root.after(50, self.poll_compare)
+
+    def finish_compare(self, kind, payload):
+        old_frames = self.compare_engine.old.frames
+        if isinstance(old_frames, LynxArchive):
+            old_frames.close()
+        self.compare_engine = None
         self.progress_frame.place_forget()
-        return self.image_list
+        self.pause_button.config(state="normal")
+
+        if kind == 'error':
+            messagebox.showerror("Error", f"Comparison failed: {payload}")
+            return
+        if kind != 'done':
+            return
+
+        from revision import carry_notes
+
+        self.review_markers.update(carry_notes(payload, self.notes))
+        self.refresh_notes_list()
+        self.update_note_indicators()
+        if self.displayed_frame is not None:
+            self.show_frame(*self.displayed_frame)
+        self.show_revision_summary(payload)
+
+    def show_revision_summary(self, result):
+        changed = result.changed_frames()
+        summary_window = Toplevel(self.root)
+        summary_window.title("Revision Changes")
+        summary_window.geometry("420x360")
+
+        tk.Label(
+            summary_window, justify="left", anchor="w",
+            text=f"{len(changed)} of {len(result.diffs)} views changed.\n"
+                 f"{len(result.notes) - len(result.review)} notes carried over; "
+                 f"{len(result.review)} sit on changed areas and are shown in red for review.\n\n"
+                 f"Most changed views (double-click to show):"
+        ).pack(fill="x", padx=10, pady=(10, 5))
+
+        views_listbox = tk.Listbox(summary_window)
+        views_listbox.pack(expand=True, fill="both", padx=10, pady=(0, 10))
+        views_listbox.insert(tk.END, *[f"Frame {frame}: {result.diffs[frame].score:.1%} changed" for frame in changed])
+
+        def show_view(event):
+            selection = views_listbox.curselection()
+            if selection:
+                self.on_overview_select(*self.layout.slot_of(changed[selection[0]]))
+
+        views_listbox.bind("<Double-Button-1>", show_view)
+
+    def build_atlas(self):
+        # Thumbnails for the overview are built off the Tk thread
+        if self.atlas_builder is not None:
+            self.atlas_builder.cancel()
+        self.overview.show_message("Building overview...")
+        self.atlas_builder = AtlasBuilder(len(self.image_list), thumbnail_loader(self.image_list, self.frame_levels))
+        self.atlas_builder.start()
+        self.root.after(50, self.poll_atlas, self.atlas_builder)
+
+    def poll_atlas(self, builder):
+        if builder is not self.atlas_builder:
+            return  # superseded by another build
+        try:
+            kind, payload = builder.events.get_nowait()
+        except queue.Empty:
+            self.root.after(50, self.poll_atlas, builder)
+            return
+
+        self.atlas_builder = None
+        if kind == 'done':
+            self.set_atlas(payload)
+        elif kind == 'error':
+            self.overview.show_message("Overview unavailable")
+
+    def set_atlas(self, atlas):
+        self.atlas = atlas
+        self.overview.set_source(atlas, self.layout)
+        self.overview.set_annotated(self.notes.frames())
+        if self.displayed_frame is not None:
+            self.overview.set_current(*self.displayed_frame)
 
     def create_webp(self):
         if not self.image_list:
             return None
 
-        frames = [Image.open(f).convert("RGBA") for f in self.image_list]
         webp_buffer = io.BytesIO()
-        frames[0].save(
-            webp_buffer,
-            format='WEBP',
-            save_all=True,
-            append_images=frames[1:],
-            duration=100,
-            loop=0
-        )
+        write_animated_webp(self.image_list, webp_buffer, duration=100)
         return webp_buffer.getvalue()
 
-    def show_frame(self, h_index, v_index):
-        frame_index = v_index * self.h_frames + h_index
+    def set_frame_source(self, frames, levels=(), origin=(0, 0)):
+        # frames is a list of captured frame paths or an open LynxArchive;
+        # levels are the pyramid downscale factors stored alongside them and
+        # origin is where the frames were cropped from the captured viewport
+        if isinstance(self.image_list, LynxArchive) and self.image_list is not frames:
+            self.image_list.close()
+        self.image_list = frames
+        self.atlas = None
+        if self.atlas_builder is not None:
+            self.atlas_builder.cancel()
+            self.atlas_builder = None
+        self.overview.show_message("")
+        self.frame_levels = tuple(levels)
+        self.frame_origin = tuple(origin)
+        self.frame_size = None
+        self.frame_cache.clear()
+        self.displayed_frame = None
+        self.view = None
+
+    def crop_box(self):
+        if self.frame_origin == (0, 0):
+            return None
+        width, height = self.source_frame_size()
+        left, top = self.frame_origin
+        return [left, top, left + width, top + height]
+
+    def source_frame_size(self):
+        # Full resolution size of the frames as stored
+        if self.frame_size is None:
+            frames = self.image_list
+            if isinstance(frames, LynxArchive):
+                self.frame_size = frames.frame_size
+            else:
+                with open_frame(frames[0]) as img:
+                    self.frame_size = img.size
+        return self.frame_size
+
+    def convert_canvas_markers(self):
+        # Older files store where markers were clicked on the canvas. Map them
+        # as they would sit over the frame on the canvas as it is now.
+        frame_size = self.source_frame_size()
+        canvas_size = (self.canvas.winfo_width(), self.canvas.winfo_height())
+        width, height = fit_size(frame_size, canvas_size)
+        left = canvas_size[0] // 2 - width // 2
+        top = canvas_size[1] // 2 - height // 2
+        scale = width / frame_size[0]
+        for note in self.notes:
+            note.x = (note.x - left) / scale + self.frame_origin[0]
+            note.y = (note.y - top) / scale + self.frame_origin[1]
+
+    def load_frame(self, frame_index, canvas_size, fast=False):
+        # Open the pyramid level closest to what the canvas needs
+        frames = self.image_list
+        if not self.frame_levels:
+            return open_frame(frames[frame_index])
+
+        frame_size = self.source_frame_size()
+        target_size = fit_size(frame_size, canvas_size)
+        factor = choose_level(frame_size, target_size, self.frame_levels, fast)
+        return open_frame_level(frames, frame_index, factor)
+
+    def prefetch_neighbours(self, h_index, v_index, canvas_size):
+        # Queue frames ahead of the slider in the direction it is moving
+        if self.displayed_frame is None:
+            dh, dv = 1, 0
+        else:
+            dh = h_index - self.displayed_frame[0]
+            dv = v_index - self.displayed_frame[1]
+
+        indices = []
+        for step in range(1, self.prefetch_count + 1):
+            if dv:
+                v = v_index + step * (1 if dv > 0 else -1)
+                if not 0 <= v < self.v_frames:
+                    break
+                indices.append(self.layout.frame_at(h_index, v))
+            else:
+                # The horizontal sweep covers a full turn, so wrap around
+                h = (h_index + step * (1 if dh >= 0 else -1)) % self.h_frames
+                indices.append(self.layout.frame_at(h, v_index))
+
+        # Sampled views repeat across neighbouring slider positions
+        indices = [i for i in dict.fromkeys(indices) if i < len(self.image_list)]
+        self.frame_cache.prefetch(indices, canvas_size)
+
+    def show_frame(self, h_index, v_index, fast=False):
+        with span('show_frame', h=h_index, v=v_index, fast=fast):
+            self._show_frame(h_index, v_index, fast)
+
+    def _show_frame(self, h_index, v_index, fast):
+        frame_index = self.layout.frame_at(h_index, v_index)
         if self.image_list:
             if 0 <= frame_index < len(self.image_list):
-                self.canvas.delete("all")
-
-                img = Image.open(self.image_list[frame_index])
                 canvas_width = self.canvas.winfo_width()
                 canvas_height = self.canvas.winfo_height()
-
-                img_ratio = img.size[0] / img.size[1]
-                canvas_ratio = canvas_width / canvas_height
-
-                if img_ratio > canvas_ratio:
-                    new_width = canvas_width
-                    new_height = int(canvas_width / img_ratio)
-                else:
-                    new_height = canvas_height
-                    new_width = int(canvas_height * img_ratio)
-
-                img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                self.current_photo = ImageTk.PhotoImage(img)
-                self.canvas.create_image(
-                    canvas_width // 2,
-                    canvas_height // 2,
-                    image=self.current_photo,
-                    anchor="center"
+                if canvas_width <= 1 or canvas_height <= 1:
+                    # Not mapped yet; <Configure> redraws once it has a size
+                    self.displayed_frame = (h_index, v_index)
+                    return
+                canvas_size = (canvas_width, canvas_height)
+
+                img = self.frame_cache.get(frame_index, canvas_size, fast)
+                self.prefetch_neighbours(h_index, v_index, canvas_size)
+                self.displayed_frame = (h_index, v_index)
+                self.overview.set_current(h_index, v_index)
+                if fast and not self.frame_cache.has(frame_index, canvas_size):
+                    self.schedule_refine()
+
+                with span('show_frame.photo'):
+                    self.draw_image(img, canvas_width // 2, canvas_height // 2)
+                self.view = (
+                    canvas_width // 2 - img.size[0] // 2,
+                    canvas_height // 2 - img.size[1] // 2,
+                    img.size[0] / self.source_frame_size()[0],
                 )
-
-                if frame_index in self.frame_markers:
-                    for x, y, marker_num in self.frame_markers[frame_index]:
-                        self.canvas.create_polygon(
-                            x-10, y+20,
-                            x, y,
-                            x+10, y+20,
-                            fill="red",
-                            tags=f"marker_{marker_num}"
-                        )
-
-                        circle_radius = 10
-                        self.canvas.create_oval(
-                            x-circle_radius, y+20-circle_radius,
-                            x+circle_radius, y+20+circle_radius,
-                            fill="white",
-                            tags=f"marker_{marker_num}"
-                        )
-
-                        self.canvas.create_text(
-                            x, y+20,
-                            text=str(marker_num),
-                            font=("Arial", 8, "bold"),
-                            tags=f"marker_{marker_num}"
-                        )
+                with span('show_frame.markers'):
+                    self.hide_marker_tip()
+                    self.marker_layer.show(self.notes.in_frame(frame_index))
+
+    def draw_image(self, img, x, y):
+        # The image item lives for the whole session; only its pixels change
+        photo = self.current_photo
+        if photo is not None and (photo.width(), photo.height()) == img.size:
+            photo.paste(img)
+        else:
+            self.current_photo = photo = ImageTk.PhotoImage(img)
+
+        if self.image_item is None:
+            self.image_item = self.canvas.create_image(x, y, image=photo, anchor="center")
+            self.canvas.tag_lower(self.image_item)
+        else:
+            self.canvas.itemconfigure(self.image_item, image=photo)
+            self.canvas.coords(self.image_item, x, y)
 
 if __name__ == "__main__":
     app = ModelAnnotator()
@@ -0,0 +1,123 @@
+import re
+
+
+LEGACY_NOTE = re.compile(r"#(\d+)(?:\s*-\s*(.*?))?(?:\s*\(Author: (.*)\))?\s*$", re.DOTALL)
+
+# Marker positions are pixels of the uncropped captured frame. Files without
+# 'marker_space' hold the canvas positions markers were clicked at.
+MARKER_SPACE = 'frame'
+
+
+class Note:
+    __slots__ = ('marker_id', 'frame', 'x', 'y', 'text', 'author')
+
+    def __init__(self, marker_id, frame, x, y, text="", author=""):
+        self.marker_id = marker_id
+        self.frame = frame
+        self.x = x
+        self.y = y
+        self.text = text
+        self.author = author
+
+    @property
+    def label(self):
+        # Listbox/PDF text, in the format notes have always been shown in
+        label = f"#{self.marker_id}"
+        if self.text:
+            label += f" - {self.text}"
+        if self.author:
+            label += f" (Author: {self.author})"
+        return label
+
+    def to_record(self):
+        return [self.marker_id, self.frame, self.x, self.y, self.text, self.author]
+
+
+class AnnotationStore:
+    # Notes indexed by marker id and by frame. Every lookup, insert and
+    # delete is a dict operation, so cost doesn't grow with the note count.
+
+    def __init__(self):
+        self._by_id = {}
+        self._by_frame = {}
+        self.next_id = 1
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(self._by_id.values())
+
+    def __contains__(self, marker_id):
+        return marker_id in self._by_id
+
+    def get(self, marker_id):
+        return self._by_id.get(marker_id)
+
+    def add(self, frame, x, y, text="", author="", marker_id=None):
+        if marker_id is None:
+            marker_id = self.next_id
+        note = Note(marker_id, frame, x, y, text, author)
+        self._by_id[marker_id] = note
+        self._by_frame.setdefault(frame, {})[marker_id] = note
+        self.next_id = max(self.next_id, marker_id + 1)
+        return note
+
+    def update(self, marker_id, text, author):
+        note = self._by_id[marker_id]
+        note.text = text
+        note.author = author
+        return note
+
+    def remove(self, marker_id):
+        note = self._by_id.pop(marker_id)
+        frame_notes = self._by_frame[note.frame]
+        del frame_notes[marker_id]
+        if not frame_notes:
+            del self._by_frame[note.frame]
+        return note
+
+    def in_frame(self, frame):
+        return self._by_frame.get(frame, {}).values()
+
+    def frames(self):
+        return self._by_frame.keys()
+
+    def clear(self):
+        self._by_id.clear()
+        self._by_frame.clear()
+        self.next_id = 1
+
+    def to_data(self):
+        # 'annotations' holds the typed records. 'notes' and 'markers' keep
+        # the original data.json layout for older readers.
+        return {
+            'marker_space': MARKER_SPACE,
+            'annotations': [note.to_record() for note in self],
+            'notes': {row: note.label for row, note in enumerate(self)},
+            'markers': {
+                frame: [(note.x, note.y, note.marker_id) for note in notes.values()]
+                for frame, notes in self._by_frame.items()
+            },
+        }
+
+    @classmethod
+    def from_data(cls, data):
+        store = cls()
+        if 'annotations' in data:
+            for marker_id, frame, x, y, text, author in data['annotations']:
+                store.add(frame, x, y, text, author, marker_id=marker_id)
+            return store
+
+        # Older files only have listbox labels and per-frame marker tuples
+        details = {}
+        for label in data.get('notes', {}).values():
+            match = LEGACY_NOTE.match(label.strip())
+            if match:
+                details[int(match.group(1))] = (match.group(2) or "", match.group(3) or "")
+
+        for frame, markers in data.get('markers', {}).items():
+            for x, y, marker_id in markers:
+                text, author = details.get(marker_id, ("", ""))
+                store.add(int(frame), x, y, text, author, marker_id=marker_id)
+        return store
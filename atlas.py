@@ -0,0 +1,131 @@
+import io
+import math
+import queue
+import threading
+
+from PIL import Image
+
+from frame_cache import fit_size
+from tracing import span
+
+
+# Thumbnails of every frame packed into one image (a sprite sheet), so an
+# overview of thousands of views is one decode and one resize rather than a
+# file read per view. Frame i sits in cell i, row by row, `columns` cells
+# wide; each thumbnail is fitted and centred in its cell. LYNX files store
+# the sheet as 'atlas.webp' with this layout under 'atlas' in data.json.
+
+ATLAS_CELL = (64, 48)
+ATLAS_COLUMNS = 64
+ATLAS_QUALITY = 75
+ATLAS_BACKGROUND = (240, 240, 240)
+WEBP_MAX_SIDE = 16383
+
+
+class ThumbnailAtlas:
+    # The sheet image plus its layout; build() makes one from any frames
+
+    def __init__(self, image, count, cell=ATLAS_CELL, columns=ATLAS_COLUMNS, encoded=None):
+        self.image = image
+        self.count = count
+        self.cell = tuple(cell)
+        self.columns = columns
+        self._encoded = encoded  # bytes it was read from; saved again as is
+
+    def __len__(self):
+        return self.count
+
+    @classmethod
+    def build(cls, count, load, cell=ATLAS_CELL, columns=ATLAS_COLUMNS, cancelled=None):
+        # load(index) returns a PIL image of frame index at any resolution.
+        # Returns None if the cancelled event is set part way.
+        columns = max(1, min(columns, count))
+        rows = max(1, math.ceil(count / columns))
+        cell_width, cell_height = cell
+        # Very long sequences get smaller cells to stay within WebP's limit
+        while rows * cell_height > WEBP_MAX_SIDE and cell_height > 1:
+            cell_width, cell_height = max(1, cell_width // 2), max(1, cell_height // 2)
+
+        image = Image.new("RGB", (columns * cell_width, rows * cell_height), ATLAS_BACKGROUND)
+        size = None
+        for index in range(count):
+            if cancelled is not None and cancelled.is_set():
+                return None
+            with span('atlas.thumbnail', frame=index):
+                img = load(index)
+                if size is None:
+                    # Every frame of a capture has the same size
+                    size = fit_size(img.size, (cell_width, cell_height))
+                thumb = img.convert("RGB").resize(size, Image.BILINEAR, reducing_gap=2.0)
+            row, column = divmod(index, columns)
+            image.paste(thumb, (
+                column * cell_width + (cell_width - size[0]) // 2,
+                row * cell_height + (cell_height - size[1]) // 2,
+            ))
+        return cls(image, count, (cell_width, cell_height), columns)
+
+    @classmethod
+    def from_bytes(cls, data, layout):
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        return cls(image.convert("RGB"), layout['count'], layout['cell'], layout['columns'], encoded=data)
+
+    def to_bytes(self):
+        if self._encoded is None:
+            buffer = io.BytesIO()
+            with span('atlas.encode'):
+                self.image.save(buffer, format="WEBP", quality=ATLAS_QUALITY, method=4)
+            self._encoded = buffer.getvalue()
+        return self._encoded
+
+    @property
+    def layout(self):
+        return {'count': self.count, 'cell': list(self.cell), 'columns': self.columns}
+
+    def box(self, index):
+        row, column = divmod(index, self.columns)
+        width, height = self.cell
+        return column * width, row * height, (column + 1) * width, (row + 1) * height
+
+    def thumbnail(self, index):
+        return self.image.crop(self.box(index))
+
+    def scaled(self, cell):
+        # The same atlas with every cell resized to `cell`; one resize of the
+        # sheet instead of one per thumbnail
+        if tuple(cell) == self.cell:
+            return self
+        rows = math.ceil(self.count / self.columns)
+        image = self.image.resize((self.columns * cell[0], rows * cell[1]), Image.BILINEAR, reducing_gap=2.0)
+        return ThumbnailAtlas(image, self.count, cell, self.columns)
+
+
+class AtlasBuilder:
+    # Builds a ThumbnailAtlas on a worker thread. Events mirror CaptureEngine:
+    #   ('done', atlas) / ('cancelled', None) / ('error', message)
+
+    def __init__(self, count, load):
+        self.count = count
+        self.load = load
+        self.events = queue.Queue()
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def _run(self):
+        try:
+            with span('atlas.build', frames=self.count):
+                atlas = ThumbnailAtlas.build(self.count, self.load, cancelled=self._cancel)
+        except Exception as e:
+            self.events.put(('error', str(e)))
+        else:
+            if atlas is None:
+                self.events.put(('cancelled', None))
+            else:
+                self.events.put(('done', atlas))
@@ -0,0 +1,349 @@
+import hashlib
+import math
+import os
+import threading
+import time
+
+from PIL import Image, ImageDraw
+
+
+# CAD backends drive the view that gets captured. CaptureEngine only uses:
+#   prepare()                      on the thread that created the backend
+#   attach() / detach()            on the thread that runs the capture
+#   show_named_view(name), zoom_to_fit(), rotate(x_radians, y_radians),
+#   save_image(path), model_state(), grab_view()
+# Batch mode additionally uses open_model(path) and close_model().
+#
+# grab_view() returns a small image of the view as it is drawn right
+# now, used to tell when a redraw has finished, or None if the backend can't
+# grab one.
+
+GRAB_SIZE = (160, 120)
+# PrintWindow flags: the client area only, and GPU-drawn content too
+PW_CLIENTONLY = 0x1
+PW_RENDERFULLCONTENT = 0x2
+
+
+class SolidWorksBackend:
+    # With connect=False nothing touches COM until `app` is first used.
+    # connect_in_background() then attaches to a SolidWorks that is already
+    # running on a worker thread (importing pywin32 and the attach are the
+    # slow part) and marshals the application to the thread that uses it,
+    # as prepare()/attach() do for the document. If none was running, the
+    # first use starts SolidWorks.
+    MODEL_EXTENSIONS = ('.sldprt', '.sldasm')
+
+    def __init__(self, connect=True):
+        self._app = None
+        self._app_stream = None
+        self._connector = None
+        self._com_initialized = False
+        self.model = None
+        self._stream = None
+        self._thread_model = None
+        if connect:
+            self._initialize_com()
+            self._app = self._dispatch()
+
+    @staticmethod
+    def _dispatch():
+        import win32com.client
+        return win32com.client.Dispatch("SldWorks.Application")
+
+    def connect_in_background(self):
+        self._connector = threading.Thread(target=self._connect, daemon=True)
+        self._connector.start()
+
+    def _connect(self):
+        try:
+            import pythoncom
+            import win32com.client
+        except ImportError:
+            return  # no pywin32; use reports it
+        pythoncom.CoInitialize()
+        try:
+            app = win32com.client.GetActiveObject("SldWorks.Application")
+            self._app_stream = pythoncom.CoMarshalInterThreadInterfaceInStream(
+                pythoncom.IID_IDispatch, app._oleobj_
+            )
+            # The stream holds its own reference to SolidWorks, so this
+            # thread's proxy can go with its apartment
+            del app
+        except Exception:
+            self._app_stream = None  # not running; use starts it
+        finally:
+            pythoncom.CoUninitialize()
+
+    def _initialize_com(self):
+        # pywin32 initializes COM on the thread that first imports it,
+        # which may be the connector; the thread that uses `app` and the
+        # document needs it too. Once is enough: it lasts as long as the
+        # thread, i.e. the viewer.
+        if not self._com_initialized:
+            import pythoncom
+            pythoncom.CoInitialize()
+            self._com_initialized = True
+
+    @property
+    def app(self):
+        if self._app is None:
+            if self._connector is not None:
+                self._connector.join()
+                self._connector = None
+            self._initialize_com()
+            if self._app_stream is not None:
+                import pythoncom
+                import win32com.client
+
+                self._app = win32com.client.Dispatch(
+                    pythoncom.CoGetInterfaceAndReleaseStream(self._app_stream, pythoncom.IID_IDispatch)
+                )
+                self._app_stream = None
+            else:
+                self._app = self._dispatch()
+        return self._app
+
+    def use_active_document(self):
+        self.model = self.app.ActiveDoc
+        return bool(self.model)
+
+    def open_model(self, path):
+        import pythoncom
+        import win32com.client
+
+        doc_type = 2 if path.lower().endswith('.sldasm') else 1  # swDocASSEMBLY / swDocPART
+        errors = win32com.client.VARIANT(pythoncom.VT_BYREF | pythoncom.VT_I4, 0)
+        warnings = win32com.client.VARIANT(pythoncom.VT_BYREF | pythoncom.VT_I4, 0)
+        self.model = self.app.OpenDoc6(path, doc_type, 1, "", errors, warnings)  # swOpenDocOptions_Silent
+        if not self.model:
+            raise RuntimeError(f"SolidWorks could not open {path} (error {errors.value})")
+
+    def close_model(self):
+        if self.model:
+            self.app.CloseDoc(self.model.GetTitle())
+        self.model = None
+
+    def prepare(self):
+        # COM objects are apartment bound, so the document is marshalled to
+        # the capture thread instead of sharing the proxy directly.
+        import pythoncom
+        self._initialize_com()
+        self._stream = pythoncom.CoMarshalInterThreadInterfaceInStream(
+            pythoncom.IID_IDispatch, self.model._oleobj_
+        )
+
+    def attach(self):
+        import pythoncom
+        import win32com.client
+
+        pythoncom.CoInitialize()
+        if self._stream is not None:
+            self._thread_model = win32com.client.Dispatch(
+                pythoncom.CoGetInterfaceAndReleaseStream(self._stream, pythoncom.IID_IDispatch)
+            )
+            self._stream = None
+
+    def detach(self):
+        import pythoncom
+        self._thread_model = None
+        pythoncom.CoUninitialize()
+
+    @property
+    def doc(self):
+        return self._thread_model if self._thread_model is not None else self.model
+
+    def show_named_view(self, name):
+        self.doc.ShowNamedView2(name, 1)
+
+    def zoom_to_fit(self):
+        self.doc.ViewZoomtofit2()
+
+    def rotate(self, x_radians, y_radians):
+        self.doc.ActiveView.RotateAboutCenter(x_radians, y_radians)
+
+    def save_image(self, path):
+        self.doc.SaveAs(path)
+
+    def grab_view(self):
+        # The view's own pixels via PrintWindow, so windows covering it (Note
+        # Buddy's progress bar included) don't count as redraws, and only the
+        # view is copied rather than the whole desktop. None, i.e. the fixed
+        # delay, if that fails.
+        try:
+            import ctypes
+            import win32gui
+            import win32ui
+
+            hwnd = self.doc.ActiveView.GetViewHWndx64()
+            left, top, right, bottom = win32gui.GetClientRect(hwnd)
+            width, height = right - left, bottom - top
+            if width <= 0 or height <= 0:
+                return None
+            window_dc = win32gui.GetWindowDC(hwnd)
+            source_dc = win32ui.CreateDCFromHandle(window_dc)
+            memory_dc = source_dc.CreateCompatibleDC()
+            bitmap = win32ui.CreateBitmap()
+            try:
+                bitmap.CreateCompatibleBitmap(source_dc, width, height)
+                memory_dc.SelectObject(bitmap)
+                flags = PW_CLIENTONLY | PW_RENDERFULLCONTENT
+                if not ctypes.windll.user32.PrintWindow(hwnd, memory_dc.GetSafeHdc(), flags):
+                    return None
+                img = Image.frombuffer("RGB", (width, height), bitmap.GetBitmapBits(True), "raw", "BGRX", 0, 1)
+            finally:
+                win32gui.DeleteObject(bitmap.GetHandle())
+                memory_dc.DeleteDC()
+                source_dc.DeleteDC()
+                win32gui.ReleaseDC(hwnd, window_dc)
+        except Exception:
+            return None
+        img.thumbnail(GRAB_SIZE)
+        return img
+
+    def model_state(self):
+        # The update stamp changes whenever the model is rebuilt. Documents
+        # that were never saved have no path and can't be told apart.
+        path = self.doc.GetPathName()
+        if not path:
+            return None
+        return [path, self.doc.GetUpdateStamp()]
+
+
+def _matmul(a, b):
+    return [[sum(a[i][k] * b[k][j] for k in range(3)) for j in range(3)] for i in range(3)]
+
+
+def _rotation_x(angle):
+    c, s = math.cos(angle), math.sin(angle)
+    return [[1, 0, 0], [0, c, -s], [0, s, c]]
+
+
+def _rotation_y(angle):
+    c, s = math.cos(angle), math.sin(angle)
+    return [[c, 0, s], [0, 1, 0], [-s, 0, c]]
+
+
+def _box(x0, y0, z0, x1, y1, z1):
+    vertices = [(x, y, z) for x in (x0, x1) for y in (y0, y1) for z in (z0, z1)]
+    faces = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+    return vertices, faces
+
+
+class SyntheticBackend:
+    # Stand-in for SolidWorks that renders shaded box models with PIL, so
+    # capture and export run headless (CI, Linux, benchmarks). Any file can
+    # be a "model": its content hash picks the part's proportions.
+    # redraw_seconds simulates a slow viewport: until that long after a view
+    # change, only part of the faces have been drawn.
+
+    MODEL_EXTENSIONS = ()
+    BACKGROUND = (235, 235, 235)
+    NAMED_VIEWS = {
+        "*Front": (0, 0),
+        "*Top": (math.pi / 2, 0),
+        "*Right": (0, -math.pi / 2),
+    }
+
+    def __init__(self, size=(800, 600), seed=b"", redraw_seconds=0.0):
+        self.size = size
+        self.redraw_seconds = redraw_seconds
+        self._changed_at = 0.0
+        self.zoom = 1.0
+        self.orientation = [[1, 0, 0], [0, 1, 0], [0, 0, 1]]
+        self.set_shape(seed)
+
+    def set_shape(self, seed):
+        digest = hashlib.sha256(seed).digest()
+        width, depth, height = (0.5 + digest[i] / 255 for i in range(3))
+        vertices, faces = _box(-width, -height, -depth, width, height, depth)
+
+        # A boss on one face so the part isn't symmetric
+        bw, bh, bd = (0.15 + digest[i] / 1020 for i in range(3, 6))
+        boss_vertices, boss_faces = _box(width, -bh, -bd, width + 0.2 + digest[6] / 512, bh, bd)
+        offset = len(vertices)
+        self.vertices = vertices + boss_vertices
+        self.faces = faces + [tuple(i + offset for i in face) for face in boss_faces]
+        self.colour = (90 + digest[7] % 100, 110 + digest[8] % 100, 150 + digest[9] % 100)
+
+    def use_active_document(self):
+        return True
+
+    def open_model(self, path):
+        with open(path, 'rb') as f:
+            self.set_shape(f.read())
+        self.zoom = 1.0
+        self.show_named_view("*Top")
+
+    def close_model(self):
+        pass
+
+    def prepare(self):
+        pass
+
+    def attach(self):
+        pass
+
+    def detach(self):
+        pass
+
+    def show_named_view(self, name):
+        x_angle, y_angle = self.NAMED_VIEWS.get(name, (0, 0))
+        self.orientation = _matmul(_rotation_y(y_angle), _rotation_x(x_angle))
+        self._changed_at = time.perf_counter()
+
+    def zoom_to_fit(self):
+        radius = max(math.sqrt(sum(c * c for c in v)) for v in self.vertices)
+        self.zoom = 0.9 / radius
+        self._changed_at = time.perf_counter()
+
+    def rotate(self, x_radians, y_radians):
+        self.orientation = _matmul(_rotation_y(y_radians), _matmul(_rotation_x(x_radians), self.orientation))
+        self._changed_at = time.perf_counter()
+
+    def render(self, size=None):
+        width, height = size or self.size
+        scale = min(width, height) / 2 * self.zoom
+        points = []
+        for vertex in self.vertices:
+            x, y, z = (sum(self.orientation[i][k] * vertex[k] for k in range(3)) for i in range(3))
+            points.append((width / 2 + x * scale, height / 2 - y * scale, z))
+
+        img = Image.new("RGB", (width, height), self.BACKGROUND)
+        img_draw = ImageDraw.Draw(img)
+        # Painter's algorithm: draw back faces first, shade by facing ratio
+        shaded = []
+        for face in self.faces:
+            corners = [points[i] for i in face]
+            (x0, y0, _), (x1, y1, _), (x2, y2, _) = corners[:3]
+            facing = ((x1 - x0) * (y2 - y0) - (y1 - y0) * (x2 - x0)) / (scale * scale)
+            depth = sum(c[2] for c in corners) / len(corners)
+            shaded.append((depth, facing, corners))
+
+        shaded.sort(key=lambda item: item[0])
+        if self.redraw_seconds:
+            drawn = (time.perf_counter() - self._changed_at) / self.redraw_seconds
+            shaded = shaded[:int(len(shaded) * min(1.0, drawn))]
+        for depth, facing, corners in shaded:
+            light = 0.45 + 0.55 * min(1.0, abs(facing))
+            fill = tuple(int(channel * light) for channel in self.colour)
+            img_draw.polygon([(x, y) for x, y, _ in corners], fill=fill, outline=(40, 40, 40))
+        return img
+
+    def grab_view(self):
+        return self.render(GRAB_SIZE)
+
+    def model_state(self):
+        digest = hashlib.sha256(repr((self.vertices, self.faces, self.colour, self.size)).encode())
+        return digest.hexdigest()
+
+    def save_image(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.render().save(path)
+
+
+BACKENDS = {
+    'solidworks': SolidWorksBackend,
+    'synthetic': SyntheticBackend,
+}
@@ -0,0 +1,146 @@
+import argparse
+import fnmatch
+import os
+import sys
+import time
+
+from annotations import AnnotationStore
+from backends import BACKENDS
+from capture import SAMPLING_MODES, CaptureEngine, slider_positions
+from lynx import describe_storage, save_lynx_file
+from pdf_export import CODECS, LAYOUTS, PdfExportEngine
+
+
+# Headless capture/export: turns a directory of models into LYNX files (and
+# optionally PDF contact sheets) without Tk. Use --backend synthetic to run
+# without SolidWorks, e.g. in CI.
+
+
+def find_models(model_dir, backend_class, pattern=None):
+    models = []
+    for name in sorted(os.listdir(model_dir)):
+        path = os.path.join(model_dir, name)
+        if not os.path.isfile(path):
+            continue
+        if pattern is not None:
+            if fnmatch.fnmatch(name.lower(), pattern.lower()):
+                models.append(path)
+        elif not backend_class.MODEL_EXTENSIONS or name.lower().endswith(backend_class.MODEL_EXTENSIONS):
+            models.append(path)
+    return models
+
+
+def process_model(backend, model_path, output_dir, args):
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    frames_dir = os.path.join(output_dir, f"{stem}_frames")
+    os.makedirs(frames_dir, exist_ok=True)
+
+    backend.open_model(model_path)
+    try:
+        engine = CaptureEngine(
+            backend, frames_dir,
+            h_step_degrees=args.h_step,
+            v_step_degrees=args.v_step,
+            delay=args.delay,
+            resume=not args.no_resume,
+            trim=not args.no_trim,
+            adaptive=not args.fixed_delay,
+            settle_timeout=args.settle_timeout,
+            sampling=args.sampling,
+            view_count=args.views,
+            refine=args.refine
+        )
+        engine.run()
+        waits = engine.wait_stats()
+        if waits['frames']:
+            print(f"  settle wait: {waits['mean_ms']:.0f} ms mean, {waits['max_ms']:.0f} ms max, "
+                  f"{waits['total_s']:.1f}s total, {waits['timeouts']} timeouts")
+    finally:
+        backend.close_model()
+
+    notes = AnnotationStore()
+    outputs = []
+    if not args.no_lynx:
+        lynx_path = os.path.join(output_dir, f"{stem}.lynx")
+        data = {
+            'h_frames': engine.h_frames,
+            'v_frames': engine.v_frames,
+            'views': engine.views,
+            'model': os.path.abspath(model_path),
+            'crop': engine.crop,
+            **notes.to_data()
+        }
+        stats = save_lynx_file(lynx_path, engine.frames, data)
+        print(f"  {lynx_path}: {describe_storage(stats)}")
+        outputs.append(lynx_path)
+
+    if args.pdf:
+        pdf_path = os.path.join(output_dir, f"{stem}.pdf")
+        PdfExportEngine(
+            pdf_path, engine.frames, notes,
+            views_per_page=args.views_per_page,
+            max_size=args.max_size,
+            codec=args.codec,
+            include_all=True,
+            origin=engine.crop[:2] if engine.crop else (0, 0)
+        ).export()
+        outputs.append(pdf_path)
+
+    return len(engine.frames), outputs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch capture models into LYNX and PDF files.")
+    parser.add_argument("model_dir", help="directory containing the models to process")
+    parser.add_argument("output_dir", help="directory for frames, LYNX and PDF output")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="solidworks")
+    parser.add_argument("--pattern", help="file name pattern for models (default: backend's model extensions)")
+    parser.add_argument("--h-step", type=int, default=15, help="horizontal step in degrees")
+    parser.add_argument("--v-step", type=int, default=15, help="vertical step in degrees")
+    parser.add_argument("--sampling", choices=SAMPLING_MODES, default="grid",
+                        help="grid: one frame per step; sphere: --views directions spread evenly")
+    parser.add_argument("--views", type=int, default=96, help="number of sphere views (with --refine, at most one per slider position)")
+    parser.add_argument("--refine", type=int, default=0, help="extra sphere views where neighbours differ most")
+    parser.add_argument("--delay", type=float, default=0.05,
+                        help="seconds to wait for each redraw when the view can't be watched")
+    parser.add_argument("--fixed-delay", action="store_true", help="always wait --delay instead of watching the view")
+    parser.add_argument("--settle-timeout", type=float, default=2.0, help="longest wait for a redraw in seconds")
+    parser.add_argument("--no-resume", action="store_true", help="recapture frames already on disk")
+    parser.add_argument("--no-trim", action="store_true", help="keep the full viewport in every frame")
+    parser.add_argument("--no-lynx", action="store_true", help="don't write LYNX files")
+    parser.add_argument("--pdf", action="store_true", help="also write a PDF of every view")
+    parser.add_argument("--views-per-page", type=int, choices=LAYOUTS, default=6)
+    parser.add_argument("--codec", choices=CODECS, default="jpeg")
+    parser.add_argument("--max-size", type=int, default=1200, help="longest side of PDF images in pixels")
+    args = parser.parse_args(argv)
+    if args.sampling == 'sphere':
+        h_frames, v_frames = slider_positions(h_step_degrees=args.h_step, v_step_degrees=args.v_step)
+        if not 0 < args.views + args.refine <= h_frames * v_frames:
+            parser.error(f"--views plus --refine must be 1 to {h_frames * v_frames} with these steps "
+                         "(one view per slider position)")
+
+    backend_class = BACKENDS[args.backend]
+    models = find_models(args.model_dir, backend_class, args.pattern)
+    if not models:
+        print(f"No models found in {args.model_dir}", file=sys.stderr)
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    backend = backend_class()
+    failures = 0
+    for index, model_path in enumerate(models, 1):
+        start = time.perf_counter()
+        try:
+            frame_count, outputs = process_model(backend, model_path, args.output_dir, args)
+        except Exception as e:
+            failures += 1
+            print(f"[{index}/{len(models)}] {model_path}: FAILED: {e}", file=sys.stderr)
+            continue
+        elapsed = time.perf_counter() - start
+        print(f"[{index}/{len(models)}] {model_path}: {frame_count} frames in {elapsed:.1f}s -> {', '.join(outputs)}")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
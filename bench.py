@@ -0,0 +1,441 @@
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import PIL
+import PIL.Image
+
+from annotations import AnnotationStore
+from backends import SyntheticBackend
+from capture import MANIFEST_NAME, CaptureEngine
+from frame_cache import FrameCache, fit_size
+from pyramid import PYRAMID_LEVELS, choose_level
+from lynx import FORMAT_KEYS, LynxArchive, build_frame_atlas, open_frame, open_frame_level, save_lynx_changes, save_lynx_file, write_animated_webp
+from pdf_export import PdfExportEngine
+from tracing import TRACE_ENV
+
+
+# Reproducible timings for the hot paths, using the synthetic backend so no
+# SolidWorks or display is needed. Each stage runs in its own interpreter so
+# its peak RSS is isolated; results are printed (or written) as JSON:
+#
+#   python bench.py --frames 312 --size 1280x960 --marker-density 0.5 -o bench.json
+#
+# With NOTEBUDDY_TRACE=trace.json set, each stage writes trace_<stage>.json.
+
+STAGES = ('startup', 'capture', 'show_frame', 'create_webp', 'save_lynx', 'open_lynx', 'save_as_pdf')
+# Stages that read files written by earlier ones
+DEPENDS = {'open_lynx': ('save_lynx',)}
+# Stages that don't need the captured frames
+STANDALONE = ('startup',)
+
+# The viewer must come up within this budget without loading any of the
+# modules it defers to the commands that use them. test_startup.py and
+# --check-budget hold it to that.
+STARTUP_BUDGET_MS = 250
+LAZY_MODULES = ('reportlab', 'sqlite3', 'win32com', 'capture', 'pdf_export', 'note_index', 'revision')
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Solidworks Note Buddy.py')
+
+# Run in a fresh interpreter, since this one has already imported the app's
+# modules. Startup runs until the window is first drawn; without a display
+# only the import is timed. Deferred modules are checked before the event
+# loop runs, as the first idle callback starts the background SolidWorks
+# attach, which may load pywin32.
+STARTUP_PROBE = '''
+import importlib.util, json, sys, time
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('note_buddy', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+import_ms = (time.perf_counter() - start) * 1000
+try:
+    app = module.ModelAnnotator()
+except module.tk.TclError:
+    app = None
+loaded = [name for name in sys.argv[2:] if name in sys.modules]
+window_ms = None
+if app is not None:
+    app.root.update()
+    window_ms = (time.perf_counter() - start) * 1000
+    app.root.destroy()
+print(json.dumps({'import_ms': import_ms, 'window_ms': window_ms, 'loaded': loaded}))
+'''
+
+
+def peak_rss_mb():
+    if resource is None:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 2**20
+        except (ImportError, AttributeError):
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def frame_paths(workdir):
+    frames_dir = os.path.join(workdir, 'frames')
+    # Skip the pyramid level files written next to each frame
+    names = sorted(name for name in os.listdir(frames_dir) if re.fullmatch(r'frame_\d+\.png', name))
+    return [os.path.join(frames_dir, name) for name in names]
+
+
+def capture_crop(workdir):
+    # The box the captured frames cover in the viewport, as the manifest's
+    # 'crop' would be, or None when they weren't trimmed
+    with open(os.path.join(workdir, 'frames', MANIFEST_NAME)) as f:
+        crop = json.load(f).get('crop')
+    return tuple(crop) if crop is not None else None
+
+
+def make_notes(args, workdir):
+    # Markers are in viewport pixels, so they fall inside the trimmed frames
+    # offset by the crop origin
+    paths = frame_paths(workdir)
+    with open_frame(paths[0]) as img:
+        width, height = img.size
+    left, top = (capture_crop(workdir) or (0, 0))[:2]
+    rng = random.Random(args.seed)
+    notes = AnnotationStore()
+    for _ in range(round(args.marker_density * len(paths))):
+        notes.add(rng.randrange(len(paths)), left + rng.uniform(0, width), top + rng.uniform(0, height),
+                  text="Benchmark note")
+    return notes
+
+
+def startup_probe():
+    # One run of STARTUP_PROBE: import_ms, window_ms (None without a display)
+    # and the deferred modules that were loaded
+    completed = subprocess.run(
+        [sys.executable, '-c', STARTUP_PROBE, APP_SCRIPT, *LAZY_MODULES],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(APP_SCRIPT)
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def startup_ms(run):
+    return run['window_ms'] if run['window_ms'] is not None else run['import_ms']
+
+
+def stage_startup(args, workdir):
+    # Best of a few runs, so a cold disk cache doesn't decide it
+    best = min((startup_probe() for _ in range(3)), key=startup_ms)
+    return {
+        'startup_ms': startup_ms(best),
+        'import_ms': best['import_ms'],
+        'window_ms': best['window_ms'],
+        'budget_ms': STARTUP_BUDGET_MS,
+        'loaded_lazy_modules': best['loaded'],
+    }
+
+
+def startup_failures(result):
+    failures = []
+    if result['startup_ms'] > STARTUP_BUDGET_MS:
+        failures.append(f"startup took {result['startup_ms']:.0f} ms (budget {STARTUP_BUDGET_MS} ms)")
+    if result['loaded_lazy_modules']:
+        failures.append(f"startup imported {', '.join(result['loaded_lazy_modules'])}")
+    return failures
+
+
+def stage_capture(args, workdir):
+    frames_dir = os.path.join(workdir, 'frames')
+    os.makedirs(frames_dir, exist_ok=True)
+    backend = SyntheticBackend(size=args.size, seed=str(args.seed).encode(), redraw_seconds=args.redraw)
+    # One ring of --frames views; the half step keeps int() from rounding down
+    h_step = 360 / args.frames
+    engine = CaptureEngine(
+        backend, frames_dir,
+        h_total_degrees=360 + h_step / 2, h_step_degrees=h_step,
+        v_total_degrees=0, v_step_degrees=15,
+        delay=args.delay, adaptive=not args.fixed_delay
+    )
+    start = time.perf_counter()
+    engine.run()
+    elapsed = time.perf_counter() - start
+    return {
+        'frames': len(engine.frames),
+        'seconds': elapsed,
+        'frames_per_second': len(engine.frames) / elapsed,
+        'settle': engine.wait_stats(),
+    }
+
+
+def stage_show_frame(args, workdir):
+    paths = frame_paths(workdir)
+    with open_frame(paths[0]) as img:
+        full_size = img.size
+
+    def load(frame_index, canvas_size, fast):
+        factor = choose_level(full_size, fit_size(full_size, canvas_size), PYRAMID_LEVELS, fast)
+        return open_frame_level(paths, frame_index, factor)
+
+    cache = FrameCache(load)
+    canvas_size = args.canvas
+
+    # Scrub forward then back through the frames, prefetching like the viewer
+    sequence = list(range(len(paths))) + list(range(len(paths) - 1, -1, -1))
+    samples = []
+    previous = None
+    for frame_index in sequence:
+        start = time.perf_counter()
+        cache.get(frame_index, canvas_size, fast=True)
+        samples.append(time.perf_counter() - start)
+
+        step = 1 if previous is None or frame_index >= previous else -1
+        cache.prefetch([(frame_index + step * k) % len(paths) for k in range(1, 7)], canvas_size)
+        previous = frame_index
+        time.sleep(args.scrub_interval)
+
+    # High quality redraw once the slider settles
+    settled = []
+    for frame_index in range(0, len(paths), max(1, len(paths) // 16)):
+        start = time.perf_counter()
+        cache.get(frame_index, canvas_size)
+        settled.append(time.perf_counter() - start)
+
+    return {
+        'samples': len(samples),
+        'p50_ms': percentile(samples, 0.5) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'max_ms': max(samples) * 1000,
+        'settled_p50_ms': percentile(settled, 0.5) * 1000,
+        'cache': cache.stats(),
+    }
+
+
+def stage_create_webp(args, workdir):
+    paths = frame_paths(workdir)
+    start = time.perf_counter()
+    buffer = io.BytesIO()
+    write_animated_webp(paths, buffer)
+    elapsed = time.perf_counter() - start
+    return {'seconds': elapsed, 'bytes': buffer.tell()}
+
+
+def stage_save_lynx(args, workdir):
+    paths = frame_paths(workdir)
+    notes = make_notes(args, workdir)
+    crop = capture_crop(workdir)
+    data = {'h_frames': len(paths), 'v_frames': 1, 'crop': list(crop) if crop else None, **notes.to_data()}
+    lynx_path = os.path.join(workdir, 'bench.lynx')
+
+    start = time.perf_counter()
+    atlas = build_frame_atlas(paths)
+    atlas_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stats = save_lynx_file(lynx_path, paths, data, atlas=atlas)
+    elapsed = time.perf_counter() - start
+
+    # Re-saving the open file after editing one note only journals the notes
+    archive = LynxArchive(lynx_path)
+    note = next(iter(notes), None)
+    if note is not None:
+        notes.update(note.marker_id, "Edited benchmark note", "bench")
+    data = dict(archive.data, **notes.to_data())
+    start = time.perf_counter()
+    save_lynx_changes(lynx_path, archive, data)
+    annotation_elapsed = time.perf_counter() - start
+    archive.close()
+
+    # A v1 file for the open_lynx comparison
+    v1_path = os.path.join(workdir, 'bench_v1.lynx')
+    with zipfile.ZipFile(v1_path, 'w', zipfile.ZIP_DEFLATED) as lynx_file:
+        with lynx_file.open('animation.webp', 'w', force_zip64=True) as webp_entry:
+            write_animated_webp(paths, webp_entry)
+        lynx_file.writestr('data.json', json.dumps({k: v for k, v in data.items() if k not in FORMAT_KEYS}))
+
+    return {
+        'seconds': elapsed,
+        'bytes': os.path.getsize(lynx_path),
+        'storage': stats,
+        'annotation_save_ms': annotation_elapsed * 1000,
+        'atlas_build_ms': atlas_elapsed * 1000,
+    }
+
+
+def stage_open_lynx(args, workdir):
+    # Load the image plugins first so neither format pays for them
+    warm_up = io.BytesIO()
+    PIL.Image.new("RGB", (8, 8)).save(warm_up, format='WEBP')
+    PIL.Image.open(warm_up).load()
+
+    results = {}
+    for name in ('bench.lynx', 'bench_v1.lynx'):
+        start = time.perf_counter()
+        archive = LynxArchive(os.path.join(workdir, name))
+        archive[0].load()
+        first_frame = time.perf_counter() - start
+        label = f'v{archive.version}'
+
+        start = time.perf_counter()
+        archive[len(archive) - 1].load()
+        last_frame = time.perf_counter() - start
+        results[label] = {
+            'time_to_first_frame_ms': first_frame * 1000,
+            'last_frame_ms': last_frame * 1000,
+        }
+        if archive.has_atlas:
+            start = time.perf_counter()
+            archive.atlas()
+            results[label]['atlas_load_ms'] = (time.perf_counter() - start) * 1000
+        archive.close()
+    return results
+
+
+def stage_save_as_pdf(args, workdir):
+    paths = frame_paths(workdir)
+    notes = make_notes(args, workdir)
+    origin = (capture_crop(workdir) or (0, 0))[:2]
+    engine = PdfExportEngine(os.path.join(workdir, 'bench.pdf'), paths, notes, workers=args.workers, origin=origin)
+
+    start = time.perf_counter()
+    engine.export()
+    elapsed = time.perf_counter() - start
+    pages = len(engine.views)
+    return {
+        'views': pages,
+        'markers': len(notes),
+        'seconds': elapsed,
+        'pages_per_second': pages / elapsed if elapsed else None,
+        'bytes': os.path.getsize(engine.pdf_path),
+    }
+
+
+def run_stage(name, args, workdir):
+    # Called in the child interpreter
+    result = globals()[f'stage_{name}'](args, workdir)
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def size_arg(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark capture, viewing, LYNX and PDF hot paths.")
+    parser.add_argument("--frames", type=int, default=312, help="number of frames to capture")
+    parser.add_argument("--size", type=size_arg, default=(1280, 960), help="capture resolution, WxH")
+    parser.add_argument("--canvas", type=size_arg, default=(900, 600), help="viewer canvas size, WxH")
+    parser.add_argument("--marker-density", type=float, default=0.5, help="average markers per frame")
+    parser.add_argument("--delay", type=float, default=0.0, help="fixed capture redraw delay in seconds")
+    parser.add_argument("--fixed-delay", action="store_true", help="wait --delay instead of watching the view settle")
+    parser.add_argument("--redraw", type=float, default=0.0, help="simulated viewport redraw time in seconds")
+    parser.add_argument("--scrub-interval", type=float, default=0.01, help="seconds between slider ticks")
+    parser.add_argument("--workers", type=int, default=None, help="PDF render processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("-o", "--output", help="write JSON here instead of stdout")
+    parser.add_argument("--check-budget", action="store_true",
+                        help=f"exit non-zero if startup exceeds {STARTUP_BUDGET_MS} ms or loads deferred modules")
+    parser.add_argument("--stage", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = parse_args(argv)
+
+    if args.stage:
+        print(json.dumps(run_stage(args.stage, args, args.workdir)))
+        return 0
+
+    workdir = tempfile.mkdtemp(prefix='notebuddy_bench_')
+    results = {}
+    try:
+        # Every other stage reads the frames captured by capture
+        needed = set(args.stages)
+        if needed - set(STANDALONE):
+            needed.add('capture')
+        for name in args.stages:
+            needed.update(DEPENDS.get(name, ()))
+        for name in [s for s in STAGES if s in needed]:
+            env = dict(os.environ)
+            if env.get(TRACE_ENV):
+                trace_root = 'notebuddy_trace' if env[TRACE_ENV] == '1' else os.path.splitext(env[TRACE_ENV])[0]
+                env[TRACE_ENV] = f'{trace_root}_{name}.json'
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), *argv, '--stage', name, '--workdir', workdir],
+                capture_output=True, text=True, env=env
+            )
+            if completed.returncode:
+                results[name] = {'error': completed.stderr.strip().splitlines()[-1:]}
+                if name == 'capture':
+                    break
+                continue
+            if name in args.stages:
+                results[name] = json.loads(completed.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pillow': PIL.__version__,
+            'cpu_count': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'params': {
+            'frames': args.frames,
+            'size': list(args.size),
+            'canvas': list(args.canvas),
+            'marker_density': args.marker_density,
+            'delay': args.delay,
+            'fixed_delay': args.fixed_delay,
+            'redraw': args.redraw,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.check_budget:
+        startup = results.get('startup')
+        if startup is None:
+            failures = ["startup stage was not run"]
+        elif 'error' in startup:
+            failures = [f"startup failed: {' '.join(startup['error'])}"]
+        else:
+            failures = startup_failures(startup)
+        for failure in failures:
+            print(failure, file=sys.stderr)
+        if failures:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
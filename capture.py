@@ -0,0 +1,450 @@
+import hashlib
+import json
+import math
+import os
+import queue
+import threading
+import time
+
+from PIL import Image, ImageChops
+
+from pyramid import PYRAMID_LEVELS, level_path, write_level_files
+from sampling import refinement_views, sphere_views
+from tracing import span
+from trim import content_bbox, crop_frame_file, pad_bbox, union_bbox
+
+
+# Every capture keeps a manifest in its output directory, rewritten after
+# each frame: the capture settings, the backend's model state and, per frame,
+# its angles, file name and SHA-256. A capture into a directory with a
+# matching manifest reuses every frame up to the first missing or corrupt
+# one and only captures the rest.
+#
+# With trim, each frame's part bounding box is recorded as it is captured and
+# the finished sequence is cropped to their union; the manifest's 'crop' is
+# that box in viewport pixels. A cropped capture is only reused whole.
+#
+# After each rotation the engine waits for the view to settle: it grabs
+# small images of the view from the backend every settle_poll seconds until
+# settle_stable successive grabs match, giving up after settle_timeout.
+# Backends that can't grab the view fall back to the fixed delay.
+SETTLE_TOLERANCE = 6
+
+SAMPLING_MODES = ('grid', 'sphere')
+REFINE_THUMBNAIL = (64, 48)
+MANIFEST_NAME = 'capture_manifest.json'
+MANIFEST_VERSION = 1
+
+
+def slider_positions(h_total_degrees=360, h_step_degrees=15, v_total_degrees=180, v_step_degrees=15):
+    # (h_frames, v_frames) of the slider grid for these steps
+    return int(h_total_degrees / h_step_degrees), int(v_total_degrees / v_step_degrees) + 1
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CaptureCancelled(Exception):
+    pass
+
+
+class CaptureEngine:
+    # Drives a CAD backend's rotate/save loop, either on a worker thread
+    # (start) or synchronously (run).
+    #
+    # The Tk thread owns the engine and polls `events` from root.after.
+    # Events are (kind, payload) tuples:
+    #   ('frame', (frame_index, frame_path))  a frame has been written to disk
+    #   ('crop', (left, top, right, bottom))  every frame was cropped to this box
+    #   ('done', None)                        every frame was captured
+    #   ('cancelled', None)                   cancel() stopped the capture
+    #   ('error', message)                    SolidWorks raised during capture
+    # Frames arrive in frame_index order: v_index * h_frames + h_index for the
+    # grid, or the order of `views` ((elevation, azimuth) per frame) with
+    # sphere sampling. Refined views are appended to `views` and
+    # total_frames once the base views are captured.
+    # With resume, frames reused from an earlier run are reported as 'frame'
+    # events too, before any new ones; `reused` counts them.
+    # settle_seconds maps each captured frame to the time spent waiting for
+    # its view to settle.
+
+    def __init__(self, backend, output_dir, h_total_degrees=360, h_step_degrees=15,
+                 v_total_degrees=180, v_step_degrees=15, delay=0.05,
+                 pyramid_levels=PYRAMID_LEVELS, resume=True, trim=True,
+                 adaptive=True, settle_timeout=2.0, settle_poll=0.02, settle_stable=2,
+                 sampling='grid', view_count=96, refine=0):
+        if sampling not in SAMPLING_MODES:
+            raise ValueError(f"Unknown sampling mode: {sampling}")
+        h_frames, v_frames = slider_positions(h_total_degrees, h_step_degrees, v_total_degrees, v_step_degrees)
+        if sampling == 'sphere' and not 0 < view_count + refine <= h_frames * v_frames:
+            raise ValueError(f"Sphere captures take 1 to {h_frames * v_frames} views in all with these steps, "
+                             f"one per slider position; got {view_count + refine}")
+        self.backend = backend
+        self.output_dir = output_dir
+        self.h_total_degrees = h_total_degrees
+        self.h_step_degrees = h_step_degrees
+        self.v_total_degrees = v_total_degrees
+        self.v_step_degrees = v_step_degrees
+        self.delay = delay
+        self.adaptive = adaptive
+        self.settle_timeout = settle_timeout
+        self.settle_poll = settle_poll
+        self.settle_stable = settle_stable
+        self.settle_seconds = {}
+        self.settle_timeouts = 0
+        self.pyramid_levels = tuple(pyramid_levels)
+        self.resume = resume
+        self.trim = trim
+        self.crop = None
+        self.manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+
+        self.sampling = sampling
+        self.view_count = view_count
+        self.refine = refine
+
+        # The sliders keep the grid's dimensions in either mode
+        self.h_frames = h_frames
+        self.v_frames = v_frames
+        if sampling == 'sphere':
+            self.views = sphere_views(view_count)
+            self.total_frames = view_count + refine
+        else:
+            self.views = None
+            self.total_frames = self.h_frames * self.v_frames
+        self.frames = []
+        self.manifest = []
+        self.reused = 0
+
+        self.events = queue.Queue()
+        self._cancel = threading.Event()
+        self._resume = threading.Event()
+        self._resume.set()
+        self._thread = None
+        self.backend.prepare()
+
+    @property
+    def paused(self):
+        return not self._resume.is_set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def pause(self):
+        self._resume.clear()
+
+    def resume(self):
+        self._resume.set()
+
+    def cancel(self):
+        self._cancel.set()
+        self._resume.set()
+
+    def _wait(self, seconds):
+        # Interruptible replacement for time.sleep
+        with span('capture.wait', seconds=seconds):
+            cancelled = self._cancel.wait(seconds)
+        if cancelled:
+            raise CaptureCancelled()
+
+    def _settle(self):
+        # Returns how long the view took to stop changing
+        start = time.perf_counter()
+        previous = self.backend.grab_view() if self.adaptive else None
+        if previous is None:
+            self._wait(self.delay)
+            return time.perf_counter() - start
+
+        with span('capture.settle'):
+            stable = 0
+            while stable < self.settle_stable:
+                if time.perf_counter() - start >= self.settle_timeout:
+                    self.settle_timeouts += 1
+                    break
+                self._wait(self.settle_poll)
+                current = self.backend.grab_view()
+                if current is None:
+                    self._wait(self.delay)
+                    break
+                if _same_view(previous, current):
+                    stable += 1
+                else:
+                    stable = 0
+                previous = current
+        return time.perf_counter() - start
+
+    def wait_stats(self):
+        waits = list(self.settle_seconds.values())
+        return {
+            'frames': len(waits),
+            'mean_ms': sum(waits) / len(waits) * 1000 if waits else 0.0,
+            'max_ms': max(waits) * 1000 if waits else 0.0,
+            'total_s': sum(waits),
+            'timeouts': self.settle_timeouts,
+        }
+
+    def _checkpoint(self):
+        # Pausing holds the view where it is; rotations are relative, so the
+        # sequence continues correctly as long as the view isn't moved meanwhile.
+        self._resume.wait()
+        if self._cancel.is_set():
+            raise CaptureCancelled()
+
+    def _run(self):
+        try:
+            self.run()
+        except CaptureCancelled:
+            self.events.put(('cancelled', None))
+        except Exception as e:
+            self.events.put(('error', str(e)))
+        else:
+            self.events.put(('done', None))
+
+    def run(self):
+        self.backend.attach()
+        try:
+            self._capture()
+        except CaptureCancelled:
+            self._reset_view()
+            raise
+        finally:
+            self.backend.detach()
+
+    def _reset_view(self):
+        try:
+            self.backend.show_named_view("*Top")
+            self.backend.zoom_to_fit()
+        except Exception:
+            pass
+
+    @property
+    def settings(self):
+        return {
+            'h_total_degrees': self.h_total_degrees,
+            'h_step_degrees': self.h_step_degrees,
+            'v_total_degrees': self.v_total_degrees,
+            'v_step_degrees': self.v_step_degrees,
+            'pyramid_levels': list(self.pyramid_levels),
+            'trim': self.trim,
+            'sampling': self.sampling,
+            'view_count': self.view_count if self.sampling == 'sphere' else None,
+            'refine': self.refine if self.sampling == 'sphere' else None,
+        }
+
+    def _reusable_frames(self, model_state):
+        # Manifest entries whose frames are intact, up to the first that isn't.
+        # A None model state means the backend can't tell, so nothing is reused.
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return [], None, None
+        if (model_state is None or manifest.get('version') != MANIFEST_VERSION
+                or manifest.get('settings') != self.settings
+                or manifest.get('model_state') != model_state):
+            return [], None, None
+
+        valid = []
+        for frame_index, entry in enumerate(manifest.get('frames', [])):
+            self._checkpoint()
+            frame_path = os.path.join(self.output_dir, entry.get('file', ''))
+            if entry.get('index') != frame_index or not os.path.isfile(frame_path):
+                break
+            if file_digest(frame_path) != entry.get('sha256'):
+                break
+            missing = [f for f in self.pyramid_levels if not os.path.exists(level_path(frame_path, f))]
+            if missing:
+                try:
+                    write_level_files(frame_path, missing)
+                except Exception:
+                    break
+            valid.append(entry)
+
+        crop = manifest.get('crop')
+        if crop is not None and len(valid) < self.total_frames:
+            # New frames would come out uncropped next to cropped ones
+            return [], None, None
+        return valid, crop, manifest.get('refined_views')
+
+    def _write_manifest(self, model_state):
+        # Replaced atomically so an interrupted capture leaves a readable manifest
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'settings': self.settings,
+            'model_state': model_state,
+            'crop': self.crop,
+            'refined_views': self.views[self.view_count:] if self.views and len(self.views) > self.view_count else None,
+            'frames': self.manifest,
+        }
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(temp_path, self.manifest_path)
+
+    def _capture(self):
+        backend = self.backend
+        model_state = backend.model_state()
+        reusable, crop, refined = self._reusable_frames(model_state) if self.resume else ([], None, None)
+        self.reused = len(reusable)
+
+        for entry in reusable:
+            frame_path = os.path.join(self.output_dir, entry['file'])
+            self.manifest.append(entry)
+            self.frames.append(frame_path)
+            self.events.put(('frame', (entry['index'], frame_path)))
+        if self.sampling == 'sphere' and refined is not None and self.reused >= self.view_count:
+            # The refined views depend on the base frames, which were all reused
+            self.views.extend(tuple(view) for view in refined)
+            self.total_frames = len(self.views)
+        if self.reused == self.total_frames:
+            if crop is not None:
+                self.crop = tuple(crop)
+                self.events.put(('crop', self.crop))
+            elif self.trim:
+                self._crop_frames(model_state)
+            return
+
+        backend.show_named_view("*Top")
+        backend.zoom_to_fit()
+        self._settle()
+
+        if self.sampling == 'sphere':
+            self._capture_sphere(model_state)
+        else:
+            self._capture_grid(model_state)
+
+        self._reset_view()
+        if self.trim:
+            self._crop_frames(model_state)
+
+    def _capture_grid(self, model_state):
+        backend = self.backend
+        current_frame = 0
+        for v_index, v_angle in enumerate(range(0, self.v_total_degrees + 1, self.v_step_degrees)):
+            self._checkpoint()
+            with span('capture.rotate'):
+                backend.rotate(math.radians(v_angle), 0)
+            if current_frame + self.h_frames > self.reused:
+                self._settle()
+
+            for h_index in range(self.h_frames):
+                self._checkpoint()
+                if current_frame < self.reused:
+                    # Already on disk; only replay the rotation to keep the view in step
+                    with span('capture.rotate'):
+                        backend.rotate(0, math.radians(self.h_step_degrees))
+                    current_frame += 1
+                    continue
+
+                self._capture_frame(
+                    current_frame, model_state,
+                    lambda: backend.rotate(0, math.radians(self.h_step_degrees)),
+                    h_index=h_index,
+                    v_index=v_index,
+                    h_degrees=(h_index + 1) * self.h_step_degrees,
+                    v_degrees=v_angle
+                )
+                current_frame += 1
+
+    def _capture_sphere(self, model_state):
+        # Views are absolute, so each starts from the top view and nothing
+        # needs replaying for reused frames
+        def move_to(elevation, azimuth):
+            def move():
+                self.backend.show_named_view("*Top")
+                self.backend.rotate(math.radians(elevation), 0)
+                self.backend.rotate(0, math.radians(azimuth))
+            return move
+
+        for frame_index in range(self.reused, self.view_count):
+            self._checkpoint()
+            view = self.views[frame_index]
+            self._capture_frame(frame_index, model_state, move_to(*view), view=view)
+
+        if self.refine and len(self.views) == self.view_count:
+            thumbnails = []
+            for frame_path in self.frames[:self.view_count]:
+                self._checkpoint()
+                with Image.open(frame_path) as img:
+                    thumbnail = img.convert("L")
+                thumbnail.thumbnail(REFINE_THUMBNAIL)
+                thumbnails.append(thumbnail)
+            with span('capture.refine'):
+                self.views.extend(refinement_views(self.views, thumbnails, self.refine))
+            self.total_frames = len(self.views)
+
+        for frame_index in range(max(self.reused, self.view_count), len(self.views)):
+            self._checkpoint()
+            view = self.views[frame_index]
+            self._capture_frame(frame_index, model_state, move_to(*view), view=view)
+
+    def _capture_frame(self, frame_index, model_state, move, **placement):
+        # move() turns the view to the frame; placement is stored in the manifest
+        try:
+            with span('capture.rotate'):
+                move()
+            self.settle_seconds[frame_index] = self._settle()
+
+            file_name = f"frame_{frame_index:03d}.png"
+            frame_path = os.path.join(self.output_dir, file_name)
+            with span('capture.save_image', frame=frame_index):
+                self.backend.save_image(frame_path)
+            with span('capture.post_process', frame=frame_index), Image.open(frame_path) as img:
+                img.load()
+                bbox = content_bbox(img) if self.trim else None
+                if self.pyramid_levels:
+                    write_level_files(frame_path, self.pyramid_levels, img)
+        except CaptureCancelled:
+            raise
+        except Exception as e:
+            raise RuntimeError(f"Failed to capture frame {frame_index}: {e}")
+
+        self.manifest.append({
+            'index': frame_index,
+            **placement,
+            'file': file_name,
+            'sha256': file_digest(frame_path),
+            'bbox': bbox,
+            'settle_seconds': round(self.settle_seconds[frame_index], 4),
+        })
+        with span('capture.manifest'):
+            self._write_manifest(model_state)
+        self.frames.append(frame_path)
+        self.events.put(('frame', (frame_index, frame_path)))
+        if not self.adaptive:
+            self._wait(self.delay)
+
+    def _crop_frames(self, model_state):
+        with Image.open(self.frames[0]) as img:
+            size = img.size
+        bbox = union_bbox(entry.get('bbox') for entry in self.manifest)
+        if bbox is None:
+            return
+        crop = pad_bbox(bbox, size)
+        if crop == (0, 0) + size:
+            return
+
+        for entry, frame_path in zip(self.manifest, self.frames):
+            self._checkpoint()
+            with span('capture.crop', frame=entry['index']):
+                cropped = crop_frame_file(frame_path, crop)
+                if self.pyramid_levels:
+                    write_level_files(frame_path, self.pyramid_levels, cropped)
+                entry['sha256'] = file_digest(frame_path)
+        self.crop = crop
+        self._write_manifest(model_state)
+        self.events.put(('crop', crop))
+
+
+def _same_view(a, b, tolerance=SETTLE_TOLERANCE):
+    if a.size != b.size:
+        return False
+    extrema = ImageChops.difference(a, b).getextrema()
+    if isinstance(extrema[0], int):
+        extrema = (extrema,)
+    return max(high for _, high in extrema) <= tolerance
@@ -0,0 +1,156 @@
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from tracing import span
+
+
+def fit_size(image_size, canvas_size):
+    # Largest size with the image's aspect ratio that fits inside the canvas
+    img_width, img_height = image_size
+    canvas_width, canvas_height = canvas_size
+    img_ratio = img_width / img_height
+    canvas_ratio = canvas_width / canvas_height
+
+    if img_ratio > canvas_ratio:
+        new_width = canvas_width
+        new_height = int(canvas_width / img_ratio)
+    else:
+        new_height = canvas_height
+        new_width = int(canvas_height * img_ratio)
+    return max(new_width, 1), max(new_height, 1)
+
+
+def image_nbytes(img):
+    return img.size[0] * img.size[1] * len(img.getbands())
+
+
+class FrameCache:
+    # Bounded LRU of decoded frames already scaled to the canvas.
+    # Entries are keyed by (frame_index, canvas_size, fast) and evicted once
+    # the decoded pixel data exceeds max_bytes. fast entries are scaled with a
+    # cheap filter for use mid-drag; a high quality entry for the same frame
+    # satisfies fast lookups too. A single daemon thread fills the cache ahead
+    # of the slider; each prefetch() call replaces the pending work so only the
+    # latest drag direction is followed.
+
+    def __init__(self, loader, max_bytes=256 * 1024 * 1024):
+        # loader(frame_index, canvas_size, fast) returns a PIL image of the
+        # frame at any resolution, ideally the pyramid level nearest the canvas
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._pending = []
+        self._generation = 0
+        self._wakeup = threading.Condition(self._lock)
+        self._worker = None
+
+    def get(self, frame_index, canvas_size, fast=False):
+        keys = [(frame_index, canvas_size, False)]
+        if fast:
+            keys.append((frame_index, canvas_size, True))
+        with self._lock:
+            for key in keys:
+                img = self._entries.get(key)
+                if img is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return img
+            self.misses += 1
+            generation = self._generation
+
+        key = keys[-1]
+        img = self._render(*key)
+        self._store(key, img, generation)
+        return img
+
+    def has(self, frame_index, canvas_size, fast=False):
+        with self._lock:
+            return ((frame_index, canvas_size, False) in self._entries
+                    or fast and (frame_index, canvas_size, True) in self._entries)
+
+    def prefetch(self, frame_indices, canvas_size, fast=True):
+        with self._lock:
+            self._pending = [(i, canvas_size, fast) for i in frame_indices
+                             if (i, canvas_size, False) not in self._entries
+                             and (i, canvas_size, fast) not in self._entries]
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._prefetch_loop, daemon=True)
+                self._worker.start()
+            self._wakeup.notify()
+
+    def clear(self):
+        # Called on canvas resize and whenever the frame source changes
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._pending = []
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'prefetched': self.prefetched,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def _render(self, frame_index, canvas_size, fast):
+        with span('frame.decode', frame=frame_index):
+            img = self.loader(frame_index, canvas_size, fast)
+            img.load()
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA")
+        new_size = fit_size(img.size, canvas_size)
+        if new_size != img.size:
+            resample = Image.Resampling.BILINEAR if fast else Image.Resampling.LANCZOS
+            with span('frame.resize', frame=frame_index, fast=fast):
+                img = img.resize(new_size, resample)
+        return img
+
+    def _store(self, key, img, generation):
+        size = image_nbytes(img)
+        with self._lock:
+            # Drop results computed against a cache that has since been cleared
+            if generation != self._generation or key in self._entries:
+                return
+            self._entries[key] = img
+            self._bytes += size
+            if not key[2]:
+                # The high quality render supersedes the mid-drag one
+                fast_img = self._entries.pop(key[:2] + (True,), None)
+                if fast_img is not None:
+                    self._bytes -= image_nbytes(fast_img)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= image_nbytes(evicted)
+
+    def _prefetch_loop(self):
+        while True:
+            with self._lock:
+                while not self._pending:
+                    self._wakeup.wait()
+                key = self._pending.pop(0)
+                generation = self._generation
+                if key in self._entries or key[:2] + (False,) in self._entries:
+                    continue
+
+            try:
+                img = self._render(*key)
+            except Exception:
+                continue
+            self._store(key, img, generation)
+            with self._lock:
+                self.prefetched += 1
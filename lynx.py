@@ -0,0 +1,723 @@
+import hashlib
+import io
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from collections import namedtuple
+
+from PIL import Image, ImageChops
+
+from atlas import ThumbnailAtlas
+from pyramid import PYRAMID_LEVELS, level_path
+from tracing import span
+
+
+# LYNX files are zip archives holding data.json plus the captured frames.
+#
+# v1 stores the frames as one animated WebP ('animation.webp'); reaching a
+# frame means decoding the animation up to it.
+#
+# v2 ('version': 2 in data.json) stores every frame as a standalone WebP
+# image, back to back, in an uncompressed 'frames.bin' entry. 'frames.idx'
+# holds frame_count + 1 little-endian uint64 offsets into frames.bin, so any
+# frame can be sliced straight out of a memory-mapped archive and decoded on
+# its own. Pyramid levels listed in data.json's 'pyramid' (downscale factors)
+# are stored the same way as 'levels/<factor>x.bin' and 'levels/<factor>x.idx'.
+#
+# v3 keeps the same entries, but each .idx holds one RECORD per frame:
+# payload offset and length in the .bin, base frame index, kind and a
+# bounding box. A keyframe's payload is the whole image. A delta's payload is
+# only the region (bbox) that differs from keyframe `base`, pasted over it on
+# decode. Frames identical to an earlier one repeat its record and share its
+# payload.
+#
+# Annotation-only saves don't rewrite the frames. They append a
+# 'journal/<n>.json' entry holding the current annotation data, which
+# overrides data.json when the file is opened; after JOURNAL_LIMIT entries
+# the next save rewrites the archive and folds the journal into data.json.
+# Each entry is written after the zip's central directory, followed by a
+# complete new one, so the previous directory stays intact: an append that
+# never finished leaves a file that opens as it was before it.
+#
+# Files written since v3 also carry 'atlas.webp', thumbnails of every frame
+# in one image, with its layout under 'atlas' in data.json (see atlas.py).
+# Readers that don't know it ignore it; files without it get one built.
+
+LYNX_VERSION = 3
+FRAME_QUALITY = 80
+
+RECORD = struct.Struct('<QIiB4I')
+KEYFRAME = 0
+DELTA = 1
+NO_BBOX = (0, 0, 0, 0)
+FrameRecord = namedtuple('FrameRecord', 'offset length base kind bbox')
+
+# A keyframe at least this often so deltas stay small and close to their base
+KEYFRAME_INTERVAL = 8
+# Largest per-channel difference treated as unchanged (capture noise)
+DELTA_TOLERANCE = 4
+# Frames whose changed region covers more than this fraction become keyframes
+DELTA_MAX_AREA = 0.5
+
+JOURNAL_PREFIX = 'journal/'
+JOURNAL_LIMIT = 32
+END_RECORD = struct.Struct('<4s4H2LH')  # zip end of central directory record
+END_SIGNATURE = b'PK\x05\x06'
+ATLAS_ENTRY = 'atlas.webp'
+# Describe the stored frames, so journal entries never override them
+FORMAT_KEYS = ('version', 'frame_count', 'pyramid', 'atlas')
+
+WEBP_FRAME_CHUNKS = (b'ALPH', b'VP8 ', b'VP8L')
+VP8X_ALPHA = 0x10
+VP8X_ANIMATION = 0x02
+ANMF_NO_BLEND = 0x02
+
+
+def _uint24(value):
+    return struct.pack('<I', value)[:3]
+
+
+def _chunk(fourcc, payload):
+    padding = b'\0' if len(payload) & 1 else b''
+    return fourcc + struct.pack('<I', len(payload)) + payload + padding
+
+
+def _webp_chunks(data):
+    if data[:4] != b'RIFF' or data[8:12] != b'WEBP':
+        raise ValueError("Not a WebP image")
+    pos = 12
+    while pos + 8 <= len(data):
+        fourcc = data[pos:pos + 4]
+        size = struct.unpack('<I', data[pos + 4:pos + 8])[0]
+        yield fourcc, data[pos + 8:pos + 8 + size]
+        pos += 8 + size + (size & 1)
+
+
+def encode_webp_frame(img, quality=80):
+    # Returns the image's ALPH/VP8/VP8L chunks ready to wrap in an ANMF chunk
+    buffer = io.BytesIO()
+    img.save(buffer, format='WEBP', quality=quality)
+    return b''.join(
+        _chunk(fourcc, payload)
+        for fourcc, payload in _webp_chunks(buffer.getvalue())
+        if fourcc in WEBP_FRAME_CHUNKS
+    )
+
+
+def open_frame(frame):
+    # Frame sources hold either paths/file objects or already decoded images
+    if isinstance(frame, Image.Image):
+        return frame
+    return Image.open(frame)
+
+
+def open_frame_level(frames, index, factor):
+    # Opens a pyramid level of frames[index], or the full frame if it has none
+    if isinstance(frames, LynxArchive):
+        return frames.level(index, factor)
+    frame = frames[index]
+    if factor != 1 and isinstance(frame, str):
+        path = level_path(frame, factor)
+        if os.path.exists(path):
+            return Image.open(path)
+    return open_frame(frame)
+
+
+def write_animated_webp(frame_paths, out, duration=100, quality=FRAME_QUALITY):
+    # Frames are encoded one at a time into a temporary spool and the
+    # RIFF/VP8X/ANIM/ANMF container is assembled around them, so only one
+    # decoded frame is ever resident no matter how many frames are saved.
+    width = height = 0
+    body_size = 0
+    frame_count = 0
+
+    with tempfile.TemporaryFile() as spool:
+        for frame_path in frame_paths:
+            with span('webp.decode'), open_frame(frame_path) as img:
+                frame = img.convert("RGBA")
+            frame_width, frame_height = frame.size
+            with span('webp.encode'):
+                frame_data = encode_webp_frame(frame, quality)
+            del frame
+
+            anmf = _chunk(b'ANMF', (
+                _uint24(0) + _uint24(0)
+                + _uint24(frame_width - 1) + _uint24(frame_height - 1)
+                + _uint24(duration) + bytes([ANMF_NO_BLEND])
+                + frame_data
+            ))
+            spool.write(anmf)
+            body_size += len(anmf)
+            width = max(width, frame_width)
+            height = max(height, frame_height)
+            frame_count += 1
+
+        if not frame_count:
+            raise ValueError("No frames to encode")
+
+        vp8x = _chunk(b'VP8X', bytes([VP8X_ALPHA | VP8X_ANIMATION, 0, 0, 0])
+                      + _uint24(width - 1) + _uint24(height - 1))
+        anim = _chunk(b'ANIM', struct.pack('<IH', 0, 0))  # background, loop forever
+        riff_size = 4 + len(vp8x) + len(anim) + body_size
+
+        out.write(b'RIFF' + struct.pack('<I', riff_size) + b'WEBP' + vp8x + anim)
+        spool.seek(0)
+        shutil.copyfileobj(spool, out, 1024 * 1024)
+
+    return frame_count
+
+
+def _encode_frame(img, quality=FRAME_QUALITY):
+    buffer = io.BytesIO()
+    with span('lynx.encode', size=img.size):
+        img.save(buffer, format='WEBP', quality=quality)
+    return buffer.getvalue()
+
+
+def changed_bbox(reference, img, tolerance=DELTA_TOLERANCE):
+    # Bounding box of the pixels where any channel differs by more than
+    # tolerance, or None if the images match within it
+    with span('image.diff'):
+        diff = ImageChops.difference(reference, img)
+        bands = diff.split()
+        diff = bands[0]
+        for band in bands[1:]:
+            diff = ImageChops.lighter(diff, band)
+        if tolerance:
+            diff = diff.point(lambda value: 255 if value > tolerance else 0)
+        return diff.getbbox()
+
+
+class FrameStoreWriter:
+    # Streams one frame store (the full frames or one pyramid level) to out.
+    #
+    # Frames whose pixels match an earlier frame reuse its record, so they
+    # cost no payload at all. Other frames are compared with the last
+    # keyframe: if only a small region changed, just that region is encoded
+    # as a delta against it. Deltas always point at a keyframe, never at
+    # another delta, so any frame decodes from at most two payloads.
+
+    def __init__(self, out, quality=FRAME_QUALITY, keyframe_interval=KEYFRAME_INTERVAL,
+                 tolerance=DELTA_TOLERANCE, max_delta_area=DELTA_MAX_AREA):
+        self.out = out
+        self.quality = quality
+        self.keyframe_interval = keyframe_interval
+        self.tolerance = tolerance
+        self.max_delta_area = max_delta_area
+        self.records = []
+        self.offset = 0
+        self.keyframes = 0
+        self.deltas = 0
+        self.duplicates = 0
+        self.keyframe_bytes = 0
+        self._by_content = {}
+        self._key = None  # (frame index, RGBA image) of the last keyframe
+
+    def add_image(self, img):
+        index = len(self.records)
+        digest = hashlib.blake2b(img.tobytes(), digest_size=16)
+        digest.update(f'{img.mode}{img.size}'.encode())
+        content = ('image', digest.digest())
+        if self._reuse(content):
+            return
+
+        if self._key is not None and index - self._key[0] < self.keyframe_interval \
+                and self._key[1].size == img.size:
+            key_index, key_img = self._key
+            bbox = changed_bbox(key_img, img, self.tolerance)
+            if bbox is None:
+                # Identical within tolerance: show the keyframe itself
+                self.records.append(self.records[key_index])
+                self._by_content[content] = self.records[key_index]
+                self.duplicates += 1
+                return
+            area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+            if area <= self.max_delta_area * img.size[0] * img.size[1]:
+                payload = _encode_frame(img.crop(bbox), self.quality)
+                self._write(content, payload, key_index, DELTA, bbox)
+                self.deltas += 1
+                return
+
+        payload = _encode_frame(img, self.quality)
+        self._write(content, payload, index, KEYFRAME, NO_BBOX)
+        self._key = (index, img)
+        self.keyframes += 1
+        self.keyframe_bytes += len(payload)
+
+    def add_record(self, record, payload):
+        # Copies a record from another v2+ store with the same frame numbering
+        content = ('record', record.kind, record.base, record.bbox, hashlib.blake2b(payload, digest_size=16).digest())
+        if self._reuse(content):
+            return
+        self._write(content, payload, record.base, record.kind, record.bbox)
+        if record.kind == DELTA:
+            self.deltas += 1
+        else:
+            self.keyframes += 1
+            self.keyframe_bytes += len(payload)
+
+    def _reuse(self, content):
+        record = self._by_content.get(content)
+        if record is None:
+            return False
+        self.records.append(record)
+        self.duplicates += 1
+        return True
+
+    def _write(self, content, payload, base, kind, bbox):
+        record = FrameRecord(self.offset, len(payload), base, kind, tuple(bbox))
+        self.out.write(payload)
+        self.offset += len(payload)
+        self.records.append(record)
+        self._by_content[content] = record
+
+    def index(self):
+        return b''.join(RECORD.pack(r.offset, r.length, r.base, r.kind, *r.bbox) for r in self.records)
+
+    def stats(self):
+        return {
+            'frames': len(self.records),
+            'keyframes': self.keyframes,
+            'deltas': self.deltas,
+            'duplicates': self.duplicates,
+            'bytes': self.offset,
+            'keyframe_bytes': self.keyframe_bytes,
+        }
+
+
+def frame_sources(frames, index, levels):
+    # Per downscale factor, either (record, payload) to copy from a v2+
+    # archive or a decoded RGBA image to encode. Level files written at
+    # capture time are used when present.
+    sources = {}
+    if isinstance(frames, LynxArchive) and frames.version >= 2:
+        for factor in (1, *levels):
+            if factor == 1 or factor in frames.levels:
+                sources[factor] = (frames.record(index, factor), frames.raw_frame(index, factor))
+
+    full = None
+    for factor in (1, *levels):
+        if factor in sources:
+            continue
+        frame = frames[index]
+        if factor != 1 and isinstance(frame, str) and os.path.exists(level_path(frame, factor)):
+            with Image.open(level_path(frame, factor)) as img:
+                sources[factor] = img.convert("RGBA")
+            continue
+
+        if full is None:
+            with open_frame(frame) as img:
+                full = img.convert("RGBA")
+        sources[factor] = full if factor == 1 else full.reduce(factor)
+    return sources
+
+
+def write_frame_store(frames, outputs, levels=(), quality=FRAME_QUALITY):
+    # Streams every frame into outputs[factor]; returns the writer per factor
+    writers = {factor: FrameStoreWriter(out, quality) for factor, out in outputs.items()}
+    for index in range(len(frames)):
+        with span('lynx.decode', frame=index):
+            sources = frame_sources(frames, index, levels)
+        for factor, source in sources.items():
+            if isinstance(source, tuple):
+                writers[factor].add_record(*source)
+            else:
+                writers[factor].add_image(source)
+    return writers
+
+
+def thumbnail_loader(frames, levels=PYRAMID_LEVELS):
+    # load(index) for ThumbnailAtlas.build: the smallest pyramid level there is
+    if isinstance(frames, LynxArchive):
+        levels = frames.levels
+    factor = max(levels, default=1)
+    return lambda index: open_frame_level(frames, index, factor)
+
+
+def build_frame_atlas(frames, levels=PYRAMID_LEVELS):
+    with span('atlas.build', frames=len(frames)):
+        return ThumbnailAtlas.build(len(frames), thumbnail_loader(frames, levels))
+
+
+def _stored_info(name):
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    return info
+
+
+def save_lynx_file(file_path, frames, data, levels=PYRAMID_LEVELS, atlas=None):
+    # Write next to the target and swap in, so a failed save keeps the old file.
+    # atlas is the frames' ThumbnailAtlas if the caller has one; otherwise it
+    # is taken from the archive being re-saved or built from the frames.
+    # Returns storage statistics for the full-resolution frames.
+    with span('lynx.save', frames=len(frames)):
+        return _save_lynx_file(file_path, frames, data, levels, atlas)
+
+
+def _save_lynx_file(file_path, frames, data, levels, atlas):
+    temp_path = file_path + '.tmp'
+    levels = tuple(sorted(set(levels) - {1}))
+    if atlas is None or len(atlas) != len(frames):
+        if isinstance(frames, LynxArchive) and frames.has_atlas:
+            atlas = frames.atlas()
+        else:
+            atlas = build_frame_atlas(frames, levels)
+    data = dict(data, version=LYNX_VERSION, frame_count=len(frames), pyramid=list(levels), atlas=atlas.layout)
+    # Levels are spooled to disk while the full frames stream into the zip
+    spools = {factor: tempfile.TemporaryFile() for factor in levels}
+    try:
+        with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as lynx_file:
+            # Frames are stored uncompressed so they can be memory-mapped
+            with lynx_file.open(_stored_info('frames.bin'), 'w', force_zip64=True) as frame_entry:
+                writers = write_frame_store(frames, {1: frame_entry, **spools}, levels)
+            lynx_file.writestr(_stored_info('frames.idx'), writers[1].index())
+
+            for factor, spool in spools.items():
+                spool.seek(0)
+                with lynx_file.open(_stored_info(f'levels/{factor}x.bin'), 'w', force_zip64=True) as level_entry:
+                    shutil.copyfileobj(spool, level_entry, 1024 * 1024)
+                lynx_file.writestr(_stored_info(f'levels/{factor}x.idx'), writers[factor].index())
+
+            lynx_file.writestr(_stored_info(ATLAS_ENTRY), atlas.to_bytes())
+            lynx_file.writestr('data.json', json.dumps(data))
+
+        # The archive being saved may be the one the frames are read from
+        reopen = isinstance(frames, LynxArchive) and frames.is_file(file_path)
+        if reopen:
+            frames.close()
+        os.replace(temp_path, file_path)
+        if reopen:
+            frames.reopen()
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        for spool in spools.values():
+            spool.close()
+
+    stats = writers[1].stats()
+    stats['file_bytes'] = os.path.getsize(file_path)
+    # What the same frames would take stored one standalone image each,
+    # estimated from the average keyframe
+    if stats['keyframes']:
+        stats['standalone_bytes'] = round(stats['keyframe_bytes'] / stats['keyframes'] * stats['frames'])
+    else:
+        stats['standalone_bytes'] = stats['bytes']
+    return stats
+
+
+def save_lynx_changes(file_path, frames, data, levels=PYRAMID_LEVELS, atlas=None):
+    # Saves data to file_path, journaling it when frames were opened from that
+    # very file so only the annotations are written. Returns the storage
+    # statistics of a full save, or None when the save was journaled.
+    if isinstance(frames, LynxArchive) and frames.can_journal(file_path):
+        frames.append_journal(data)
+        return None
+    return save_lynx_file(file_path, frames, data, levels, atlas)
+
+
+def describe_storage(stats):
+    saved = stats['standalone_bytes'] - stats['bytes']
+    percent = saved / stats['standalone_bytes'] if stats['standalone_bytes'] else 0.0
+    return (f"{stats['frames']} frames: {stats['keyframes']} keyframes, {stats['deltas']} deltas, "
+            f"{stats['duplicates']} duplicates; {stats['file_bytes'] / 2**20:.1f} MB on disk, "
+            f"about {saved / 2**20:.1f} MB ({percent:.0%}) saved")
+
+
+def _read_data(lynx_file):
+    # data.json with the latest journal entry applied, and the journal length
+    data = json.loads(lynx_file.read('data.json'))
+    journal = sorted(name for name in lynx_file.namelist() if name.startswith(JOURNAL_PREFIX))
+    if journal:
+        data.update(json.loads(lynx_file.read(journal[-1])))
+    return data, len(journal)
+
+
+class _FilePrefix:
+    # The first `size` bytes of a file as a file of their own, so zipfile
+    # ignores whatever an unfinished journal append left after them.
+    # Writes extend it.
+
+    def __init__(self, f, size):
+        self._f = f
+        self.size = size
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_END:
+            offset += self.size
+        elif whence == os.SEEK_CUR:
+            offset += self._f.tell()
+        return self._f.seek(offset)
+
+    def tell(self):
+        return self._f.tell()
+
+    def read(self, n=-1):
+        remaining = max(0, self.size - self._f.tell())
+        return self._f.read(remaining if n is None or n < 0 else min(n, remaining))
+
+    def write(self, b):
+        written = self._f.write(b)
+        self.size = max(self.size, self._f.tell())
+        return written
+
+    def truncate(self):
+        self.size = self._f.tell()
+        return self._f.truncate()
+
+    def flush(self):
+        self._f.flush()
+
+    def seekable(self):
+        return True
+
+
+def _end_records(f, chunk_size=1024 * 1024):
+    # Offsets of everything that looks like an end of central directory
+    # record, last first
+    end = f.seek(0, os.SEEK_END)
+    while end > 0:
+        start = max(0, end - chunk_size)
+        f.seek(start)
+        # Overlaps the next chunk so a signature across the boundary is found
+        chunk = f.read(end - start + len(END_SIGNATURE) - 1)
+        pos = chunk.rfind(END_SIGNATURE)
+        while pos >= 0:
+            if start + pos < end:
+                yield start + pos
+            pos = chunk.rfind(END_SIGNATURE, 0, pos)
+        end = start
+
+
+def _archive_end(f, offset):
+    # Where the end of central directory record at offset ends, or None if
+    # there is none
+    f.seek(offset)
+    record = f.read(END_RECORD.size)
+    if len(record) < END_RECORD.size or not record.startswith(END_SIGNATURE):
+        return None
+    return offset + END_RECORD.size + END_RECORD.unpack(record)[-1]
+
+
+def _open_archive(f):
+    # (ZipFile, data, journal length, end of the archive) for the LYNX file
+    # open as f. If the last journal append never finished, zipfile may not
+    # find the end of the archive, or find one whose entries don't read
+    # back; the directory before it is then used.
+    try:
+        lynx_file = zipfile.ZipFile(f)
+        data, journal_length = _read_data(lynx_file)
+        f.seek(lynx_file.start_dir)
+        directory = f.read()
+        end = _archive_end(f, lynx_file.start_dir + directory.find(END_SIGNATURE))
+        if end is not None:
+            return lynx_file, data, journal_length, end
+    except (zipfile.BadZipFile, zlib.error, KeyError, ValueError):
+        pass
+    for offset in _end_records(f):
+        end = _archive_end(f, offset)
+        if end is None:
+            continue
+        try:
+            lynx_file = zipfile.ZipFile(_FilePrefix(f, end))
+            data, journal_length = _read_data(lynx_file)
+        except (zipfile.BadZipFile, zlib.error, KeyError, ValueError, struct.error):
+            continue
+        return lynx_file, data, journal_length, end
+    raise zipfile.BadZipFile(f"{getattr(f, 'name', 'file')} is not a LYNX file")
+
+
+def read_lynx_data(file_path):
+    # The annotations and layout of a LYNX file without touching its frames
+    with open(file_path, 'rb') as f:
+        lynx_file, data, _, _ = _open_archive(f)
+        lynx_file.close()
+        return data
+
+
+class LynxArchive:
+    # Read-only view of a LYNX file that decodes frames on demand.
+    #
+    # Behaves as a sequence of frames: len() is the frame count and indexing
+    # returns a lazily decoded PIL image, so it can stand in for the list of
+    # captured frame paths.
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._lock = threading.Lock()
+        self._file = None
+        self._mmap = None
+        self._animation = None
+        self._keyframes = {}  # factor -> (frame index, decoded keyframe)
+        self.reopen()
+
+    def reopen(self):
+        self._keyframes = {}
+        with open(self.file_path, 'rb') as f:
+            lynx_file, self.data, self.journal_length, self._archive_end = _open_archive(f)
+            with lynx_file:
+                self.version = self.data.get('version', 1)
+
+                if self.version >= 2:
+                    self.levels = tuple(self.data.get('pyramid', ()))
+                    # (data offset in the file, frame records) per downscale factor
+                    self._stores = {1: self._read_store(lynx_file, 'frames.bin', 'frames.idx')}
+                    for factor in self.levels:
+                        self._stores[factor] = self._read_store(
+                            lynx_file, f'levels/{factor}x.bin', f'levels/{factor}x.idx'
+                        )
+                    self._frame_count = len(self._stores[1][1])
+                else:
+                    self.levels = ()
+                    # Only the compressed animation is kept; frames decode on seek
+                    animation = Image.open(io.BytesIO(lynx_file.read('animation.webp')))
+                    self._animation = animation
+                    self._frame_count = getattr(animation, 'n_frames', 1)
+
+        if self.version >= 2 and self._frame_count:
+            self._file = open(self.file_path, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _read_store(self, lynx_file, data_name, index_name):
+        index = lynx_file.read(index_name)
+        if self.version >= 3:
+            records = [FrameRecord(offset, length, base, kind, tuple(bbox))
+                       for offset, length, base, kind, *bbox in RECORD.iter_unpack(index)]
+        else:
+            # v2 indexes are plain offsets and every frame is a keyframe
+            offsets = struct.unpack(f'<{len(index) // 8}Q', index)
+            records = [FrameRecord(start, end - start, i, KEYFRAME, NO_BBOX)
+                       for i, (start, end) in enumerate(zip(offsets, offsets[1:]))]
+        return self._entry_data_offset(lynx_file.getinfo(data_name)), records
+
+    def _entry_data_offset(self, info):
+        if info.compress_type != zipfile.ZIP_STORED:
+            raise ValueError(f"{info.filename} must be stored uncompressed")
+        with open(self.file_path, 'rb') as f:
+            f.seek(info.header_offset)
+            header = f.read(30)
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        return info.header_offset + 30 + name_length + extra_length
+
+    def is_file(self, file_path):
+        return os.path.exists(file_path) and os.path.samefile(file_path, self.file_path)
+
+    def can_journal(self, file_path):
+        return self.version >= 3 and self.journal_length < JOURNAL_LIMIT and self.is_file(file_path)
+
+    def append_journal(self, data):
+        # The entry goes after the archive's end and is synced before the new
+        # central directory is written behind it, so the directory never
+        # lists an entry that isn't on disk. Only the remains of an earlier
+        # unfinished append, if any, are written over.
+        entry = {key: value for key, value in data.items() if key not in FORMAT_KEYS}
+        name = f'{JOURNAL_PREFIX}{self.journal_length + 1:06d}.json'
+        self.close()
+        try:
+            with span('lynx.journal'), open(self.file_path, 'r+b') as f:
+                lynx_file = zipfile.ZipFile(_FilePrefix(f, self._archive_end), 'a', zipfile.ZIP_DEFLATED)
+                lynx_file.start_dir = self._archive_end
+                try:
+                    lynx_file.writestr(name, json.dumps(entry))
+                    f.flush()
+                    os.fsync(f.fileno())
+                finally:
+                    lynx_file.close()
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            self.reopen()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._animation = None
+        self._keyframes = {}
+
+    def __len__(self):
+        return self._frame_count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._frame_count:
+            raise IndexError(index)
+        if self.version >= 2:
+            return self._decode(index, 1)
+
+        # The v1 animation decoder is stateful, so seeks are serialised
+        with self._lock:
+            self._animation.seek(index)
+            return self._animation.convert("RGBA")
+
+    def __iter__(self):
+        for index in range(self._frame_count):
+            yield self[index]
+
+    def level(self, index, factor):
+        # Falls back to the full frame when the archive has no such level
+        if factor == 1 or factor not in self.levels:
+            return self[index]
+        return self._decode(index, factor)
+
+    @property
+    def frame_size(self):
+        if self.version >= 2:
+            return self._decode(0, 1).size
+        return self._animation.size
+
+    @property
+    def has_atlas(self):
+        layout = self.data.get('atlas')
+        return layout is not None and layout['count'] == self._frame_count
+
+    def atlas(self):
+        with open(self.file_path, 'rb') as f, zipfile.ZipFile(_FilePrefix(f, self._archive_end)) as lynx_file:
+            encoded = lynx_file.read(ATLAS_ENTRY)
+        with span('atlas.decode'):
+            return ThumbnailAtlas.from_bytes(encoded, self.data['atlas'])
+
+    def record(self, index, factor=1):
+        if self.version < 2:
+            raise ValueError("v1 archives have no per-frame payloads")
+        return self._stores[factor][1][index]
+
+    def raw_frame(self, index, factor=1):
+        # The stored payload: a whole frame, or the changed region of a delta
+        data_start = self._stores[factor][0]
+        record = self.record(index, factor)
+        start = data_start + record.offset
+        return self._mmap[start:start + record.length]
+
+    def _decode(self, index, factor):
+        record = self.record(index, factor)
+        img = Image.open(io.BytesIO(self.raw_frame(index, factor)))
+        if record.kind != DELTA:
+            return img
+
+        frame = self._keyframe(record.base, factor).copy()
+        frame.paste(img, record.bbox[:2])
+        return frame
+
+    def _keyframe(self, index, factor):
+        # Scrubbing stays within one keyframe interval most of the time, so
+        # the last keyframe decoded per level is kept
+        with self._lock:
+            cached = self._keyframes.get(factor)
+        if cached is not None and cached[0] == index:
+            return cached[1]
+        img = Image.open(io.BytesIO(self.raw_frame(index, factor)))
+        img.load()
+        with self._lock:
+            self._keyframes[factor] = (index, img)
+        return img
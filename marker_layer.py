@@ -0,0 +1,170 @@
+MARKER_TAG = "marker"
+
+
+class MarkerLayer:
+    # Canvas items for the markers of the frame on screen.
+    #
+    # Each marker is a pin, a circle and its number (three canvas items).
+    # Markers that would overlap at the current scale are drawn as one badge
+    # with their count instead (a circle and a number); they separate again
+    # once the frame is drawn large enough to tell them apart.
+    #
+    # show() diffs what is already drawn against the new frame's notes:
+    # glyphs that stay are left alone, glyphs that leave are hidden and kept
+    # for reuse, and new glyphs reuse hidden items before creating any.
+    # Switching between frames therefore costs item moves, not item churn.
+    # transform maps a note's stored position to canvas coordinates.
+    #
+    # Every glyph drawn is also entered in a grid of HIT_CELL pixel cells, so
+    # hit() finds what is under the pointer from a few dict lookups rather
+    # than asking the canvas about every item.
+
+    CIRCLE_RADIUS = 10
+    PIN_HEIGHT = 20
+    CLUSTER_DISTANCE = 2 * CIRCLE_RADIUS + 4  # closer circles overlap
+    HIT_CELL = 32
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self._drawn = {}  # key -> ((x, y), items, marker ids)
+        self._spare = {'marker': [], 'badge': []}
+        self._hit_grid = {}  # (column, row) -> [(x, y, radius, marker ids)]
+        self.transform = lambda x, y: (x, y)
+
+    def __len__(self):
+        return len(self._drawn)
+
+    def show(self, notes):
+        wanted = {}
+        for group in self._cluster(notes):
+            if len(group) == 1:
+                note, position = group[0]
+                wanted[note.marker_id] = (position, note)
+            else:
+                ids = tuple(sorted(note.marker_id for note, _ in group))
+                x = sum(position[0] for _, position in group) / len(group)
+                y = sum(position[1] for _, position in group) / len(group)
+                wanted[ids] = ((x, y), None)
+
+        for key in [key for key in self._drawn if key not in wanted]:
+            self.remove(key)
+        for key, (position, note) in wanted.items():
+            drawn = self._drawn.get(key)
+            if drawn is None or drawn[0] != position:
+                if note is not None:
+                    self._draw_marker(note, position)
+                else:
+                    self._draw_badge(key, position)
+        self._index()
+
+    def _cluster(self, notes):
+        # Greedy grouping: each marker not yet grouped takes every ungrouped
+        # marker within CLUSTER_DISTANCE of it, found through a grid of cells
+        # that size
+        distance = self.CLUSTER_DISTANCE
+        placed = [(note, self.transform(note.x, note.y)) for note in notes]
+        cells = {}
+        for i, (_, (x, y)) in enumerate(placed):
+            cells.setdefault((int(x // distance), int(y // distance)), []).append(i)
+
+        grouped = set()
+        groups = []
+        for i, (_, (x, y)) in enumerate(placed):
+            if i in grouped:
+                continue
+            column, row = int(x // distance), int(y // distance)
+            group = []
+            for dc in (-1, 0, 1):
+                for dr in (-1, 0, 1):
+                    for j in cells.get((column + dc, row + dr), ()):
+                        if j in grouped:
+                            continue
+                        px, py = placed[j][1]
+                        if (px - x) ** 2 + (py - y) ** 2 < distance * distance:
+                            grouped.add(j)
+                            group.append(placed[j])
+            groups.append(group)
+        return groups
+
+    def _index(self):
+        cell = self.HIT_CELL
+        self._hit_grid = {}
+        for key, ((x, y), items, ids) in self._drawn.items():
+            if len(ids) == 1:
+                # Marker circles hang below the point they mark
+                hit = (x, y + self.PIN_HEIGHT, self.CIRCLE_RADIUS + 2, ids)
+            else:
+                hit = (x, y, self._badge_radius(len(ids)) + 2, ids)
+            self._hit_grid.setdefault((int(hit[0] // cell), int(hit[1] // cell)), []).append(hit)
+
+    def hit(self, x, y):
+        # Marker ids of the glyph under canvas point (x, y), nearest first
+        # when glyphs touch; empty if there is none
+        cell = self.HIT_CELL
+        column, row = int(x // cell), int(y // cell)
+        best = None
+        for dc in (-1, 0, 1):
+            for dr in (-1, 0, 1):
+                for hx, hy, radius, ids in self._hit_grid.get((column + dc, row + dr), ()):
+                    d2 = (hx - x) ** 2 + (hy - y) ** 2
+                    if d2 <= radius * radius and (best is None or d2 < best[0]):
+                        best = (d2, ids)
+        return best[1] if best is not None else ()
+
+    def _draw_marker(self, note, position):
+        items = self._take('marker', note.marker_id)
+        pin, circle, label = items
+        x, y = position
+        r = self.CIRCLE_RADIUS
+        self.canvas.coords(pin, x-10, y+20, x, y, x+10, y+20)
+        self.canvas.coords(circle, x-r, y+20-r, x+r, y+20+r)
+        self.canvas.coords(label, x, y+20)
+        self.canvas.itemconfigure(label, text=str(note.marker_id))
+        for item in items:
+            self.canvas.itemconfigure(item, state="normal")
+        self._drawn[note.marker_id] = (position, items, (note.marker_id,))
+
+    def _badge_radius(self, count):
+        return self.CIRCLE_RADIUS + min(8, 2 * len(str(count)) + count // 10)
+
+    def _draw_badge(self, ids, position):
+        items = self._take('badge', ids)
+        circle, label = items
+        x, y = position
+        r = self._badge_radius(len(ids))
+        self.canvas.coords(circle, x-r, y-r, x+r, y+r)
+        self.canvas.coords(label, x, y)
+        self.canvas.itemconfigure(label, text=str(len(ids)))
+        for item in items:
+            self.canvas.itemconfigure(item, state="normal")
+        self._drawn[ids] = (position, items, ids)
+
+    def _take(self, kind, key):
+        # Items for a glyph: its own if drawn already, else spare, else new
+        drawn = self._drawn.pop(key, None)
+        if drawn is not None:
+            return drawn[1]
+        if self._spare[kind]:
+            return self._spare[kind].pop()
+        return self._create_marker() if kind == 'marker' else self._create_badge()
+
+    def remove(self, key):
+        # key is a marker id, or the tuple of ids a badge stands for
+        drawn = self._drawn.pop(key, None)
+        if drawn is None:
+            return
+        items = drawn[1]
+        for item in items:
+            self.canvas.itemconfigure(item, state="hidden")
+        self._spare['marker' if len(items) == 3 else 'badge'].append(items)
+
+    def _create_marker(self):
+        pin = self.canvas.create_polygon(0, 0, 0, 0, 0, 0, fill="red", tags=MARKER_TAG)
+        circle = self.canvas.create_oval(0, 0, 0, 0, fill="white", tags=MARKER_TAG)
+        label = self.canvas.create_text(0, 0, font=("Arial", 8, "bold"), tags=MARKER_TAG)
+        return pin, circle, label
+
+    def _create_badge(self):
+        circle = self.canvas.create_oval(0, 0, 0, 0, fill="red", outline="white", width=2, tags=MARKER_TAG)
+        label = self.canvas.create_text(0, 0, font=("Arial", 9, "bold"), fill="white", tags=MARKER_TAG)
+        return circle, label
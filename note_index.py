@@ -0,0 +1,288 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+import zipfile
+from collections import namedtuple
+
+from annotations import AnnotationStore
+from lynx import read_lynx_data
+from tracing import span
+
+
+# A local SQLite index of the notes in every LYNX file under a set of
+# folders, so a note can be found without opening each file. Only
+# data.json (and its journal) is read from an archive, never the frames.
+#
+# A file is re-read when its size or mtime changes, and its notes are only
+# replaced when a hash of the annotation data changes too, so touching or
+# copying a file costs one small read. Note text and authors are searched
+# through an FTS5 table kept in step with the notes table.
+#
+#   python note_index.py index reviews/ archive/
+#   python note_index.py search "bearing author:kim"
+#
+# Search terms match word prefixes. author:<name> matches authors only,
+# #<n> a marker number and frame:<n> a frame number.
+
+INDEX_ENV = 'NOTEBUDDY_INDEX'
+DEFAULT_INDEX_PATH = os.path.join(os.path.expanduser('~'), '.notebuddy', 'note_index.sqlite')
+SEARCH_LIMIT = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS roots (path TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id),
+    marker_id INTEGER NOT NULL,
+    frame INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    author TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notes_file ON notes(file_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+    text, author, content='notes', content_rowid='id', prefix='2 3'
+);
+"""
+
+SearchHit = namedtuple('SearchHit', 'path marker_id frame text author')
+
+TOKEN = re.compile(r'(\w+):("[^"]*"|\S+)|#(\d+)|("[^"]*"|\S+)')
+
+
+def annotation_digest(data):
+    # Hash of what the index holds for a file, independent of key order
+    records = AnnotationStore.from_data(data).to_data()['annotations']
+    return hashlib.sha256(json.dumps(sorted(records, key=repr)).encode()).hexdigest()
+
+
+def _under(file_path, roots):
+    return any(file_path.startswith(os.path.join(root, '')) for root in roots)
+
+
+def _fts_term(word):
+    word = word.strip('"').replace('"', '""')
+    return f'"{word}"*' if word else None
+
+
+def parse_query(query):
+    # (FTS5 match expression or None, SQL conditions, their parameters)
+    terms, conditions, params = [], [], []
+    for key, value, marker, word in TOKEN.findall(query):
+        if marker:
+            conditions.append('notes.marker_id = ?')
+            params.append(int(marker))
+        elif key == 'frame' and value.isdigit():
+            conditions.append('notes.frame = ?')
+            params.append(int(value))
+        elif key == 'author':
+            term = _fts_term(value)
+            if term:
+                terms.append(f'author : {term}')
+        else:
+            term = _fts_term(word or f'{key}:{value}')
+            if term:
+                terms.append(term)
+    return (' '.join(terms) or None), conditions, params
+
+
+class NoteIndex:
+    # The index database; update() brings it in step with the files on disk
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.environ.get(INDEX_ENV) or DEFAULT_INDEX_PATH
+        if self.db_path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self.db = sqlite3.connect(self.db_path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    @property
+    def roots(self):
+        return [row[0] for row in self.db.execute('SELECT path FROM roots ORDER BY path')]
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM notes').fetchone()[0]
+
+    def file_count(self):
+        return self.db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def add_root(self, root):
+        with self.db:
+            self.db.execute('INSERT OR IGNORE INTO roots VALUES (?)', (os.path.abspath(root),))
+        return self.update([root])
+
+    def update(self, roots=None):
+        # Brings the index in step with the LYNX files under roots (default:
+        # every folder indexed so far). Returns counts of what was done.
+        roots = [os.path.abspath(root) for root in (self.roots if roots is None else roots)]
+        counts = {'files': 0, 'reindexed': 0, 'removed': 0, 'failed': 0}
+        with span('index.update', roots=len(roots)), self.db:
+            seen = set()
+            for root in roots:
+                for file_path in self._lynx_files(root):
+                    seen.add(file_path)
+                    counts['files'] += 1
+                    result = self._update_file(file_path)
+                    if result is not None:
+                        counts[result] += 1
+
+            for file_id, file_path in self.db.execute('SELECT id, path FROM files').fetchall():
+                if _under(file_path, roots) and file_path not in seen:
+                    self._remove_file(file_id)
+                    counts['removed'] += 1
+        return counts
+
+    def update_file(self, file_path):
+        # Re-reads one file, e.g. right after it was saved; files outside the
+        # indexed folders are left out
+        file_path = os.path.abspath(file_path)
+        if not _under(file_path, self.roots):
+            return None
+        with self.db:
+            return self._update_file(file_path)
+
+    def _lynx_files(self, root):
+        for dir_path, _, file_names in os.walk(root):
+            for name in file_names:
+                if name.lower().endswith('.lynx'):
+                    yield os.path.join(dir_path, name)
+
+    def _update_file(self, file_path):
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return 'failed'
+        row = self.db.execute('SELECT id, size, mtime_ns, digest FROM files WHERE path = ?', (file_path,)).fetchone()
+        if row is not None and row[1:3] == (stat.st_size, stat.st_mtime_ns):
+            return None
+
+        try:
+            with span('index.read', path=file_path):
+                data = read_lynx_data(file_path)
+                digest = annotation_digest(data)
+        except (OSError, ValueError, KeyError, TypeError, zipfile.BadZipFile):
+            return 'failed'
+
+        if row is not None and row[3] == digest:
+            self.db.execute('UPDATE files SET size = ?, mtime_ns = ? WHERE id = ?',
+                            (stat.st_size, stat.st_mtime_ns, row[0]))
+            return None
+
+        if row is not None:
+            self._remove_file(row[0])
+        file_id = self.db.execute(
+            'INSERT INTO files (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)',
+            (file_path, stat.st_size, stat.st_mtime_ns, digest)
+        ).lastrowid
+        for note in AnnotationStore.from_data(data):
+            note_id = self.db.execute(
+                'INSERT INTO notes (file_id, marker_id, frame, text, author) VALUES (?, ?, ?, ?, ?)',
+                (file_id, note.marker_id, note.frame, note.text, note.author)
+            ).lastrowid
+            self.db.execute('INSERT INTO notes_fts (rowid, text, author) VALUES (?, ?, ?)',
+                            (note_id, note.text, note.author))
+        return 'reindexed'
+
+    def _remove_file(self, file_id):
+        # External content FTS tables are told which rows go, with their text
+        for note_id, text, author in self.db.execute(
+                'SELECT id, text, author FROM notes WHERE file_id = ?', (file_id,)).fetchall():
+            self.db.execute("INSERT INTO notes_fts (notes_fts, rowid, text, author) VALUES ('delete', ?, ?, ?)",
+                            (note_id, text, author))
+        self.db.execute('DELETE FROM notes WHERE file_id = ?', (file_id,))
+        self.db.execute('DELETE FROM files WHERE id = ?', (file_id,))
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        match, conditions, params = parse_query(query)
+        if match is None and not conditions:
+            return []
+        sql = ('SELECT files.path, notes.marker_id, notes.frame, notes.text, notes.author '
+               'FROM notes JOIN files ON files.id = notes.file_id')
+        if match is not None:
+            sql += ' JOIN notes_fts ON notes_fts.rowid = notes.id'
+            conditions = ['notes_fts MATCH ?', *conditions]
+            params = [match, *params]
+        sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY ' + ('notes_fts.rank, ' if match is not None else '') + 'files.path, notes.marker_id'
+        sql += ' LIMIT ?'
+        with span('index.search', query=query):
+            try:
+                rows = self.db.execute(sql, (*params, limit)).fetchall()
+            except sqlite3.OperationalError as e:
+                raise ValueError(f"Invalid search: {query}") from e
+        return [SearchHit(*row) for row in rows]
+
+
+def format_hit(hit):
+    label = f"#{hit.marker_id} (frame {hit.frame})"
+    if hit.text:
+        label += f" - {hit.text}"
+    if hit.author:
+        label += f" (Author: {hit.author})"
+    return f"{hit.path}: {label}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index and search notes across LYNX files.")
+    parser.add_argument("--db", help=f"index file (default: ${INDEX_ENV} or {DEFAULT_INDEX_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index_parser = commands.add_parser("index", help="add folders to the index and bring it up to date")
+    index_parser.add_argument("roots", nargs="*", help="folders to index (default: those indexed before)")
+
+    search_parser = commands.add_parser("search", help="search the indexed notes")
+    search_parser.add_argument("query", nargs="+")
+    search_parser.add_argument("--limit", type=int, default=SEARCH_LIMIT)
+    search_parser.add_argument("--no-update", action="store_true", help="don't check for changed files first")
+    search_parser.add_argument("--json", action="store_true", help="print hits as JSON lines")
+    args = parser.parse_args(argv)
+
+    with NoteIndex(args.db) as index:
+        if args.command == "index":
+            start = time.perf_counter()
+            counts = {'files': 0, 'reindexed': 0, 'removed': 0, 'failed': 0}
+            if args.roots:
+                for root in args.roots:
+                    for key, value in index.add_root(root).items():
+                        counts[key] += value
+            else:
+                counts = index.update()
+            print(f"{counts['files']} files ({counts['reindexed']} re-read, {counts['removed']} removed, "
+                  f"{counts['failed']} unreadable), {len(index)} notes in {time.perf_counter() - start:.2f}s")
+            return 1 if counts['failed'] else 0
+
+        if not args.no_update:
+            index.update()
+        start = time.perf_counter()
+        hits = index.search(" ".join(args.query), args.limit)
+        elapsed = time.perf_counter() - start
+        for hit in hits:
+            print(json.dumps(hit._asdict()) if args.json else format_hit(hit))
+        if not args.json:
+            print(f"{len(hits)} hits in {elapsed * 1000:.1f} ms", file=sys.stderr)
+        return 0 if hits else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+import tkinter as tk
+
+from PIL import Image, ImageDraw, ImageTk
+
+from tracing import span
+
+
+class OverviewPanel:
+    # Every slider position at once, laid out like the sliders: columns are
+    # horizontal steps and rows vertical ones, each showing the thumbnail of
+    # the frame there. Clicking (or dragging over) a cell calls
+    # on_select(h_index, v_index).
+    #
+    # The thumbnails come from one ThumbnailAtlas, resized once and composed
+    # into a single image when the panel is resized or the frames change.
+    # Annotated frames are outlined in that image too, so the canvas holds
+    # one image item and one rectangle for the current view however many
+    # frames there are.
+
+    HIGHLIGHT = (0, 0, 255)
+    CURRENT = "red"
+    BACKGROUND = (240, 240, 240)
+
+    def __init__(self, parent, on_select, height=160, bg="#F0F0F0"):
+        self.on_select = on_select
+        self.canvas = tk.Canvas(parent, height=height, bg=bg, highlightthickness=0)
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.canvas.bind("<B1-Motion>", self._on_click)
+        self.canvas.bind("<Configure>", self._on_resize)
+
+        self.atlas = None
+        self.layout = None
+        self.annotated = frozenset()
+        self.current = None  # (h_index, v_index)
+
+        self._base = None  # composed thumbnails, without highlights
+        self._slot_frames = []  # frame index per slot, row by row
+        self._origin = (0, 0)
+        self._cell = None
+        self._photo = None
+        self._image_item = self.canvas.create_image(0, 0, anchor="nw")
+        self._current_item = self.canvas.create_rectangle(0, 0, 0, 0, outline=self.CURRENT, width=2, state="hidden")
+        self._message_item = self.canvas.create_text(0, 0, fill="#808080", state="hidden")
+
+    def pack(self, **kwargs):
+        self.canvas.pack(**kwargs)
+
+    def set_source(self, atlas, layout):
+        # atlas None shows message text instead, e.g. while it is being built
+        self.atlas = atlas
+        self.layout = layout
+        self._compose()
+
+    def show_message(self, text):
+        self.atlas = None
+        self._base = None
+        self._cell = None
+        self._photo = None
+        self.canvas.itemconfigure(self._image_item, image="")
+        self.canvas.itemconfigure(self._current_item, state="hidden")
+        self.canvas.coords(self._message_item, self.canvas.winfo_width() // 2, self.canvas.winfo_height() // 2)
+        self.canvas.itemconfigure(self._message_item, text=text, state="normal" if text else "hidden")
+
+    def set_annotated(self, frames):
+        frames = frozenset(frames)
+        if frames != self.annotated:
+            self.annotated = frames
+            self._render()
+
+    def set_current(self, h_index, v_index):
+        self.current = (h_index, v_index)
+        self._place_current()
+
+    def _on_resize(self, event):
+        if self.atlas is not None:
+            self._compose()
+        elif self.canvas.itemcget(self._message_item, "state") == "normal":
+            self.canvas.coords(self._message_item, event.width // 2, event.height // 2)
+
+    def _compose(self):
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if self.atlas is None or self.layout is None or width <= 1 or height <= 1:
+            return
+        self.canvas.itemconfigure(self._message_item, state="hidden")
+        h_frames, v_frames = self.layout.h_frames, self.layout.v_frames
+
+        # Largest cell with the thumbnails' aspect ratio that fits every slot
+        atlas_width, atlas_height = self.atlas.cell
+        cell_width = max(1, min(width // h_frames, height * atlas_width // (atlas_height * v_frames)))
+        cell_height = max(1, cell_width * atlas_height // atlas_width)
+        self._cell = (cell_width, cell_height)
+        self._origin = ((width - cell_width * h_frames) // 2, (height - cell_height * v_frames) // 2)
+
+        with span('overview.compose', slots=h_frames * v_frames):
+            sheet = self.atlas.scaled(self._cell)
+            base = Image.new("RGB", (cell_width * h_frames, cell_height * v_frames), self.BACKGROUND)
+            self._slot_frames = []
+            for v in range(v_frames):
+                for h in range(h_frames):
+                    frame = self.layout.frame_at(h, v)
+                    self._slot_frames.append(frame)
+                    if frame < self.atlas.count:
+                        base.paste(sheet.thumbnail(frame), (h * cell_width, v * cell_height))
+        self._base = base
+        self._render()
+
+    def _render(self):
+        if self._base is None:
+            return
+        with span('overview.render'):
+            img = self._base
+            if self.annotated:
+                img = img.copy()
+                draw = ImageDraw.Draw(img)
+                cell_width, cell_height = self._cell
+                h_frames = self.layout.h_frames
+                for slot, frame in enumerate(self._slot_frames):
+                    if frame in self.annotated:
+                        v, h = divmod(slot, h_frames)
+                        x, y = h * cell_width, v * cell_height
+                        draw.rectangle((x, y, x + cell_width - 1, y + cell_height - 1), outline=self.HIGHLIGHT,
+                                       width=2 if cell_width > 8 else 1)
+            self._photo = ImageTk.PhotoImage(img)
+        self.canvas.itemconfigure(self._image_item, image=self._photo)
+        self.canvas.coords(self._image_item, *self._origin)
+        self._place_current()
+
+    def _place_current(self):
+        if self._cell is None or self.current is None:
+            self.canvas.itemconfigure(self._current_item, state="hidden")
+            return
+        h, v = self.current
+        cell_width, cell_height = self._cell
+        x, y = self._origin[0] + h * cell_width, self._origin[1] + v * cell_height
+        self.canvas.coords(self._current_item, x, y, x + cell_width, y + cell_height)
+        self.canvas.itemconfigure(self._current_item, state="normal")
+        self.canvas.tag_raise(self._current_item)
+
+    def _on_click(self, event):
+        if self._cell is None:
+            return
+        h = (event.x - self._origin[0]) // self._cell[0]
+        v = (event.y - self._origin[1]) // self._cell[1]
+        if 0 <= h < self.layout.h_frames and 0 <= v < self.layout.v_frames and (h, v) != self.current:
+            self.on_select(h, v)
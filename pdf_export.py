@@ -0,0 +1,332 @@
+import gc
+import io
+import math
+import os
+import queue
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from PIL import Image, ImageDraw, PdfParser
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+from lynx import LynxArchive, open_frame
+from tracing import span
+
+
+PAGE_MARGIN = 40
+CELL_GAP = 20
+LINE_HEIGHT = 15
+CODECS = ('jpeg', 'deflate')
+LAYOUTS = (1, 2, 4, 6)
+PAGES_PER_PART = 8
+# ReportLab puts this comment inside the trailer dictionary, where
+# PdfParser doesn't accept it. It comes after everything the parts'
+# offsets point to.
+REPORTLAB_TRAILER_COMMENT = b'% ReportLab generated PDF document -- digest (opensource)\n'
+
+# Archives opened inside pool workers, keyed by path
+_worker_archives = {}
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def frame_ref(frames, frame_index):
+    # Picklable handle for a frame so pool workers can load it themselves
+    if isinstance(frames, LynxArchive):
+        return ('lynx', frames.file_path, frame_index)
+    return frames[frame_index]
+
+
+def load_frame_ref(ref):
+    if isinstance(ref, tuple) and ref[0] == 'lynx':
+        _, file_path, frame_index = ref
+        archive = _worker_archives.get(file_path)
+        if archive is None:
+            archive = _worker_archives[file_path] = LynxArchive(file_path)
+        return archive[frame_index]
+    return open_frame(ref)
+
+
+def render_view(ref, markers, max_size, codec, quality):
+    # Runs in a pool worker: decode, scale, draw markers and encode one view
+    img = load_frame_ref(ref).convert("RGB")
+    scale = min(1.0, max_size / max(img.size))
+    if scale < 1.0:
+        img = img.resize((round(img.size[0] * scale), round(img.size[1] * scale)), Image.Resampling.LANCZOS)
+
+    img_draw = ImageDraw.Draw(img)
+    for marker_num, x, y in markers:
+        x, y = x * scale, y * scale
+        img_draw.ellipse((x-5, y-5, x+5, y+5), fill="red")
+        img_draw.text((x+10, y), f"#{marker_num}", fill="red")
+
+    if codec == 'jpeg':
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=quality, optimize=True)
+        return codec, img.size, buffer.getvalue()
+    # ReportLab flate-compresses raw pixels itself
+    return codec, img.size, img.tobytes()
+
+
+def render_part(part_path, pages, views_per_page, max_size, codec, quality):
+    # Runs in a pool worker: renders a run of pages, each a list of views,
+    # into a PDF of their own
+    pdf = canvas.Canvas(part_path, pagesize=A4)
+    for page in pages:
+        draw_page(pdf, [(view, render_view(view[1], view[2], max_size, codec, quality)) for view in page],
+                  views_per_page)
+    pdf.save()
+    # ReportLab's canvas and document refer to each other, so the part's
+    # images would wait for the cycle collector; free them before the next
+    del pdf
+    gc.collect()
+    return part_path
+
+
+def draw_page(pdf, page, views_per_page):
+    with span('pdf.draw_page', views=len(page)):
+        _draw_page(pdf, page, views_per_page)
+
+
+def _draw_page(pdf, page, views_per_page):
+    page_width, page_height = A4
+    columns = 1 if views_per_page == 1 else 2
+    rows = math.ceil(views_per_page / columns)
+    cell_width = (page_width - 2 * PAGE_MARGIN - (columns - 1) * CELL_GAP) / columns
+    cell_height = (page_height - 2 * PAGE_MARGIN - (rows - 1) * CELL_GAP) / rows
+    # Single views keep the original 300pt-wide layout
+    image_box = (300, cell_height * 0.6) if views_per_page == 1 else (cell_width, cell_height * 0.6)
+
+    overflow = []
+    for slot, ((frame_num, _, _, labels), (codec, size, payload)) in enumerate(page):
+        left = PAGE_MARGIN + (slot % columns) * (cell_width + CELL_GAP)
+        top = page_height - PAGE_MARGIN - (slot // columns) * (cell_height + CELL_GAP)
+        bottom = top - cell_height
+
+        if codec == 'jpeg':
+            image = ImageReader(io.BytesIO(payload))
+        else:
+            image = ImageReader(Image.frombytes("RGB", size, payload))
+
+        scale = min(image_box[0] / size[0], image_box[1] / size[1])
+        draw_width, draw_height = size[0] * scale, size[1] * scale
+        pdf.drawImage(image, left, top - draw_height, width=draw_width, height=draw_height)
+
+        y = top - draw_height - 20
+        pdf.drawString(left, y, f"Frame {frame_num}")
+        y -= 20
+        for row, label in enumerate(labels):
+            if y < bottom:
+                overflow.append((frame_num, labels[row:]))
+                break
+            pdf.drawString(left, y, label)
+            y -= LINE_HEIGHT
+
+    pdf.showPage()
+    if overflow:
+        draw_overflow(pdf, overflow)
+
+
+def draw_overflow(pdf, overflow):
+    # Notes that didn't fit under their view continue on their own pages
+    page_width, page_height = A4
+    y = page_height - PAGE_MARGIN
+    for frame_num, labels in overflow:
+        for line in [f"Frame {frame_num} (continued)"] + labels:
+            if y < PAGE_MARGIN:
+                pdf.showPage()
+                y = page_height - PAGE_MARGIN
+            pdf.drawString(PAGE_MARGIN, y, line)
+            y -= LINE_HEIGHT
+        y -= LINE_HEIGHT
+    pdf.showPage()
+
+
+class PdfWriter:
+    # Concatenates the pages of PDFs written by ReportLab into one file.
+    # Each part's objects are copied as they are, renumbered, straight to
+    # the output, so only the part being copied is held in memory.
+
+    def __init__(self, f):
+        self._out = PdfParser.PdfParser(f=f, mode='wb')
+        self._out.start_writing()
+        self._out.write_header()
+        self._pages_ref = self._new_ref()
+        self._kids = []
+
+    def _new_ref(self):
+        # Reserved now, its offset recorded once it is written
+        return self._out.next_object_id(0)
+
+    def append(self, part_path):
+        with open(part_path, 'rb') as f:
+            part = PdfParser.PdfParser(buf=f.read().replace(REPORTLAB_TRAILER_COMMENT, b''))
+        refs = {}
+        copy = deque()
+
+        def renumbered(value):
+            if isinstance(value, PdfParser.IndirectReference):
+                if value not in refs:
+                    refs[value] = self._new_ref()
+                    copy.append(value)
+                return refs[value]
+            if isinstance(value, PdfParser.PdfDict):
+                return PdfParser.PdfDict({key: renumbered(item) for key, item in value.items()})
+            if isinstance(value, list):
+                return PdfParser.PdfArray(renumbered(item) for item in value)
+            return value
+
+        for page_ref in part.pages:
+            page = part.read_indirect(page_ref)
+            page = renumbered(PdfParser.PdfDict({key: item for key, item in page.items() if key != b'Parent'}))
+            page[b'Parent'] = self._pages_ref
+            self._kids.append(self._out.write_obj(None, page))
+        while copy:
+            ref = copy.popleft()
+            self._write(refs[ref], part.read_indirect(ref), renumbered)
+        part.close()
+
+    def _write(self, ref, value, renumbered):
+        if not isinstance(value, PdfParser.PdfStream):
+            self._out.write_obj(ref, renumbered(value))
+            return
+        # write_obj can't take a stream with its own dictionary
+        f = self._out.f
+        self._out.xref_table[ref.object_id] = (f.tell(), ref.generation)
+        f.write(bytes(PdfParser.IndirectObjectDef(*ref)))
+        f.write(bytes(renumbered(value.dictionary)))
+        f.write(b'stream\n')
+        f.write(value.buf)
+        f.write(b'\nendstream\nendobj\n')
+
+    def close(self):
+        self._out.write_obj(self._pages_ref, Type=PdfParser.PdfName(b'Pages'), Count=len(self._kids), Kids=self._kids)
+        root_ref = self._out.write_obj(None, Type=PdfParser.PdfName(b'Catalog'), Pages=self._pages_ref)
+        self._out.write_xref_and_trailer(root_ref)
+        self._out.close()
+
+
+class PdfExportEngine:
+    # Builds the PDF report on a worker thread.
+    #
+    # ReportLab keeps every image of a document in memory until it is
+    # saved, so no single ReportLab document gets more than PAGES_PER_PART
+    # pages. Pool workers render runs of pages into part PDFs in a temporary
+    # directory, at most a few ahead of the writer, and the writer copies
+    # each part into the report in order and deletes it. Memory stays flat
+    # however many pages the report has. Events mirror CaptureEngine:
+    #   ('progress', (views_done, total_views))
+    #   ('done', pdf_path) / ('cancelled', None) / ('error', message)
+
+    def __init__(self, pdf_path, frames, notes, views_per_page=1, max_size=1200,
+                 codec='jpeg', quality=85, workers=None, include_all=False, origin=(0, 0)):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown image codec: {codec}")
+        self.pdf_path = pdf_path
+        self.views_per_page = views_per_page
+        self.max_size = max_size
+        self.codec = codec
+        self.quality = quality
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+
+        # Snapshot on the Tk thread so later edits don't race the export.
+        # include_all exports every view, not only annotated ones. origin is
+        # where cropped frames start in the uncropped frame markers refer to.
+        ox, oy = origin
+        frame_numbers = range(len(frames)) if include_all else sorted(notes.frames())
+        self.views = []
+        for frame_num in frame_numbers:
+            frame_notes = list(notes.in_frame(frame_num))
+            self.views.append((
+                frame_num,
+                frame_ref(frames, frame_num),
+                [(note.marker_id, note.x - ox, note.y - oy) for note in frame_notes],
+                [note.label for note in frame_notes],
+            ))
+
+        self.events = queue.Queue()
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def _run(self):
+        try:
+            self.export()
+        except ExportCancelled:
+            self.events.put(('cancelled', None))
+        except Exception as e:
+            self.events.put(('error', str(e)))
+        else:
+            self.events.put(('done', self.pdf_path))
+
+    def export(self):
+        pages = [self.views[i:i + self.views_per_page] for i in range(0, len(self.views), self.views_per_page)]
+        if not pages:
+            canvas.Canvas(self.pdf_path, pagesize=A4).save()
+            return
+        try:
+            self._export(pages)
+        except BaseException:
+            # A cancelled or failed export leaves no partial report behind
+            if os.path.exists(self.pdf_path):
+                os.remove(self.pdf_path)
+            raise
+
+    def _export(self, pages):
+        parts = enumerate(pages[i:i + PAGES_PER_PART] for i in range(0, len(pages), PAGES_PER_PART))
+        total = len(self.views)
+        done = 0
+        pending = deque()
+
+        with tempfile.TemporaryDirectory() as part_dir, open(self.pdf_path, 'wb') as f, \
+                ProcessPoolExecutor(max_workers=self.workers) as pool:
+            writer = PdfWriter(f)
+
+            def submit_next():
+                index, part = next(parts, (None, None))
+                if part is not None:
+                    part_path = os.path.join(part_dir, f'part_{index:06d}.pdf')
+                    future = pool.submit(render_part, part_path, part, self.views_per_page,
+                                         self.max_size, self.codec, self.quality)
+                    pending.append((part, future))
+
+            for _ in range(self.workers * 2):
+                submit_next()
+
+            while pending:
+                if self._cancel.is_set():
+                    for _, queued in pending:
+                        queued.cancel()
+                    raise ExportCancelled()
+
+                part, future = pending[0]
+                try:
+                    # Rendering itself runs in the pool; this is the writer waiting on it
+                    with span('pdf.render_wait', frame=part[0][0][0]):
+                        part_path = future.result(timeout=0.1)
+                except TimeoutError:
+                    continue
+
+                pending.popleft()
+                submit_next()
+                with span('pdf.merge', pages=len(part)):
+                    writer.append(part_path)
+                os.remove(part_path)
+
+                done += sum(len(page) for page in part)
+                self.events.put(('progress', (done, total)))
+
+            with span('pdf.save'):
+                writer.close()
@@ -0,0 +1,65 @@
+import math
+import os
+import time
+
+from PIL import Image
+
+
+# Each captured frame is kept at full resolution plus a few pre-scaled
+# levels, identified by their integer downscale factor. The viewer opens
+# whichever level is closest to the canvas instead of always resizing the
+# full capture.
+
+PYRAMID_LEVELS = (2, 4)
+# Windows won't replace a file someone has open; how long to keep trying
+REPLACE_ATTEMPTS = 20
+REPLACE_RETRY_SECONDS = 0.05
+
+
+def level_path(frame_path, factor):
+    root, ext = os.path.splitext(frame_path)
+    return f"{root}_{factor}x{ext}"
+
+
+def save_replacing(img, path, **params):
+    # Writes a temp file next to path and swaps it in, so readers (the viewer
+    # and its prefetch thread) see the old file or the new one, never a half
+    # written one. While a reader has path open on Windows the swap fails;
+    # it is retried for up to a second before giving up.
+    root, ext = os.path.splitext(path)
+    temp_path = f"{root}.tmp{ext}"
+    img.save(temp_path, **params)
+    for attempt in range(REPLACE_ATTEMPTS):
+        try:
+            os.replace(temp_path, path)
+            return
+        except PermissionError:
+            if attempt == REPLACE_ATTEMPTS - 1:
+                os.remove(temp_path)
+                raise
+            time.sleep(REPLACE_RETRY_SECONDS)
+
+
+def build_levels(img, levels=PYRAMID_LEVELS):
+    # Image.reduce is a box filter: cheap, and good enough for integer factors
+    return {factor: img.reduce(factor) for factor in levels}
+
+
+def write_level_files(frame_path, levels=PYRAMID_LEVELS, img=None):
+    # img is the frame already decoded, if the caller has it
+    if img is None:
+        with Image.open(frame_path) as img:
+            img.load()
+            return write_level_files(frame_path, levels, img)
+    for factor, level in build_levels(img, levels).items():
+        save_replacing(level, level_path(frame_path, factor), compress_level=1)
+
+
+def choose_level(full_size, target_size, levels, fast=False):
+    # fast picks the level nearest the target (it may be upscaled slightly);
+    # otherwise pick the smallest level that is still at least the target.
+    scale = max(target_size[0] / full_size[0], target_size[1] / full_size[1])
+    factors = sorted({1, *levels})
+    if fast:
+        return min(factors, key=lambda factor: abs(math.log(scale * factor)))
+    return max((factor for factor in factors if 1 / factor >= scale), default=1)
@@ -0,0 +1,269 @@
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageChops, ImageStat
+
+from annotations import MARKER_SPACE, AnnotationStore
+from capture import MANIFEST_NAME
+from lynx import LynxArchive, open_frame, save_lynx_file
+from sampling import ViewLayout, sphere_views
+from tracing import span
+
+
+# Compares two captures of the same part taken with the same view grid, e.g.
+# before and after a design change, and carries the old capture's markers
+# over to the new one.
+#
+# Each pair of frames is placed in the uncropped frame space markers use
+# (the two captures may be trimmed differently), differenced, and reduced
+# to a coarse map of DIFF_BLOCK pixel blocks that changed.
+#
+# LYNX frames are lossy WebP, so a LYNX compared with the very capture it
+# was saved from (a capture folder, or the capture open in the viewer)
+# differs by codec noise alone, mostly along edges and in colour. The
+# difference is therefore taken in luma at half resolution, which averages
+# the noise away: on detailed 1280x960 frames at the LYNX quality it
+# stays at or below 14 levels, keyframes and deltas alike, where the
+# per-channel difference at full resolution reaches 71 and marks 18% of
+# blocks changed. A view's score is
+# the fraction of its blocks that changed. A marker carries over silently
+# when no changed block lies within MARKER_RADIUS of it, and is flagged for
+# review otherwise. All of it runs in Pillow's C routines; pairs are
+# decoded and compared a chunk at a time on a thread pool, so only the
+# block maps outlive a chunk and memory stays bounded at full resolution.
+#
+#   python revision.py old.lynx new_capture/ -o new.lynx
+
+DIFF_TOLERANCE = 24  # luma difference that counts as changed, well above codec noise (14)
+DIFF_SCALE = 2  # frames are compared at 1/DIFF_SCALE resolution
+DIFF_BLOCK = 8  # in full resolution pixels
+BLOCK_THRESHOLD = 32  # a block changed when more than 1/8 of its pixels did
+MARKER_RADIUS = 24
+# Codec noise alone changes no blocks; this is 4 blocks of a 1280x960 frame
+CHANGED_SCORE = 0.0002
+CHUNK_FRAMES = 8
+
+CaptureSet = namedtuple('CaptureSet', 'frames origin h_frames v_frames views notes review')
+FrameDiff = namedtuple('FrameDiff', 'score blocks origin')
+
+_CHANGED = [255 if value > DIFF_TOLERANCE else 0 for value in range(256)]
+_BLOCK_CHANGED = [255 if value > BLOCK_THRESHOLD else 0 for value in range(256)]
+
+
+def open_capture_set(path):
+    # A LYNX file, or a capture folder holding capture_manifest.json
+    if os.path.isdir(path):
+        with open(os.path.join(path, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        settings = manifest['settings']
+        frames = [os.path.join(path, entry['file']) for entry in manifest['frames']]
+        views = None
+        if settings.get('sampling') == 'sphere':
+            views = sphere_views(settings['view_count']) + [tuple(v) for v in manifest.get('refined_views') or ()]
+        crop = manifest.get('crop')
+        return CaptureSet(
+            frames, tuple(crop[:2]) if crop else (0, 0),
+            int(settings['h_total_degrees'] / settings['h_step_degrees']),
+            int(settings['v_total_degrees'] / settings['v_step_degrees']) + 1,
+            views, AnnotationStore(), [],
+        )
+
+    archive = LynxArchive(path)
+    data = archive.data
+    if data.get('marker_space') != MARKER_SPACE and data.get('annotations', data.get('markers')):
+        archive.close()
+        raise ValueError(f"{path} was saved before markers were stored in frame pixels; "
+                         "open and save it in Note Buddy first")
+    crop = data.get('crop')
+    return CaptureSet(
+        archive, tuple(crop[:2]) if crop else (0, 0),
+        data.get('h_frames', len(archive)), data.get('v_frames', 1),
+        data.get('views'), AnnotationStore.from_data(data), list(data.get('review', ())),
+    )
+
+
+def _views(capture_set):
+    return [tuple(view) for view in capture_set.views] if capture_set.views is not None else None
+
+
+def _placed(img, offset, size):
+    # img at offset on a canvas of size, padded with its background colour
+    img = img.convert("RGB")
+    if offset == (0, 0) and img.size == size:
+        return img
+    canvas = Image.new("RGB", size, img.getpixel((0, 0)))
+    canvas.paste(img, offset)
+    return canvas
+
+
+def frame_difference(old, old_origin, new, new_origin):
+    left, top = min(old_origin[0], new_origin[0]), min(old_origin[1], new_origin[1])
+    right = max(old_origin[0] + old.size[0], new_origin[0] + new.size[0])
+    bottom = max(old_origin[1] + old.size[1], new_origin[1] + new.size[1])
+    size = (right - left, bottom - top)
+    a = _placed(old, (old_origin[0] - left, old_origin[1] - top), size)
+    b = _placed(new, (new_origin[0] - left, new_origin[1] - top), size)
+
+    # Luma difference at reduced size, thresholded, then the share of
+    # changed pixels per block
+    diff = ImageChops.difference(a.convert("L").reduce(DIFF_SCALE), b.convert("L").reduce(DIFF_SCALE))
+    blocks = diff.point(_CHANGED).reduce(DIFF_BLOCK // DIFF_SCALE).point(_BLOCK_CHANGED)
+    score = ImageStat.Stat(blocks).mean[0] / 255
+    return FrameDiff(score, blocks, (left, top))
+
+
+def marker_changed(frame_diff, x, y, radius=MARKER_RADIUS):
+    left, top = frame_diff.origin
+    width, height = frame_diff.blocks.size
+    box = (
+        max(0, int((x - radius - left) // DIFF_BLOCK)),
+        max(0, int((y - radius - top) // DIFF_BLOCK)),
+        min(width, int((x + radius - left) // DIFF_BLOCK) + 1),
+        min(height, int((y + radius - top) // DIFF_BLOCK) + 1),
+    )
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return False  # outside both captures, i.e. on background
+    return frame_diff.blocks.crop(box).getbbox() is not None
+
+
+class RevisionDiff:
+    # Result of a comparison: per-frame FrameDiffs, the old notes carried to
+    # the new capture (marker ids kept) and the ids flagged for review
+
+    def __init__(self, diffs, notes, review):
+        self.diffs = diffs
+        self.notes = notes
+        self.review = review
+
+    def changed_frames(self, threshold=CHANGED_SCORE, limit=None):
+        # Frame indices that changed, most changed first
+        frames = sorted((i for i, diff in enumerate(self.diffs) if diff.score > threshold),
+                        key=lambda i: self.diffs[i].score, reverse=True)
+        return frames[:limit] if limit is not None else frames
+
+
+def carry_notes(result, notes):
+    # Adds the notes carried by a RevisionDiff to notes, e.g. those the new
+    # revision already has. Carried notes keep their numbers unless notes
+    # already uses them. Returns the ids flagged for review as added.
+    review = []
+    for note in result.notes:
+        marker_id = note.marker_id if note.marker_id not in notes else None
+        carried = notes.add(note.frame, note.x, note.y, note.text, note.author, marker_id=marker_id)
+        if note.marker_id in result.review:
+            review.append(carried.marker_id)
+    return review
+
+
+class RevisionCompareEngine:
+    # Compares two CaptureSets on a worker thread. Events mirror CaptureEngine:
+    #   ('progress', (frames_done, total_frames))
+    #   ('done', RevisionDiff) / ('cancelled', None) / ('error', message)
+
+    def __init__(self, old, new, workers=None):
+        if (len(old.frames) != len(new.frames) or (old.h_frames, old.v_frames) != (new.h_frames, new.v_frames)
+                or _views(old) != _views(new)):
+            raise ValueError("The captures were taken with different view grids")
+        self.old = old
+        self.new = new
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.events = queue.Queue()
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def _run(self):
+        try:
+            result = self.compare()
+        except Exception as e:
+            self.events.put(('error', str(e)))
+        else:
+            self.events.put(('cancelled', None) if result is None else ('done', result))
+
+    def _compare_frame(self, index):
+        with span('revision.diff', frame=index):
+            old = open_frame(self.old.frames[index])
+            new = open_frame(self.new.frames[index])
+            return frame_difference(old, self.old.origin, new, self.new.origin)
+
+    def compare(self):
+        # Returns a RevisionDiff, or None if cancelled
+        total = len(self.new.frames)
+        diffs = []
+        with span('revision.compare', frames=total), ThreadPoolExecutor(self.workers) as pool:
+            for start in range(0, total, CHUNK_FRAMES):
+                if self._cancel.is_set():
+                    return None
+                diffs.extend(pool.map(self._compare_frame, range(start, min(start + CHUNK_FRAMES, total))))
+                self.events.put(('progress', (len(diffs), total)))
+
+        notes = AnnotationStore()
+        review = []
+        for note in self.old.notes:
+            notes.add(note.frame, note.x, note.y, note.text, note.author, marker_id=note.marker_id)
+            if note.frame < total and marker_changed(diffs[note.frame], note.x, note.y):
+                review.append(note.marker_id)
+        return RevisionDiff(diffs, notes, review)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two captures and carry markers to the newer one.")
+    parser.add_argument("old", help="LYNX file with the markers to carry over")
+    parser.add_argument("new", help="LYNX file or capture folder of the revised part")
+    parser.add_argument("-o", "--output", help="write the new capture with the carried markers to this LYNX file")
+    parser.add_argument("--top", type=int, default=10, help="number of most changed views to list")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    old = open_capture_set(args.old)
+    new = open_capture_set(args.new)
+    start = time.perf_counter()
+    result = RevisionCompareEngine(old, new, args.workers).compare()
+    elapsed = time.perf_counter() - start
+
+    changed = result.changed_frames()
+    layout = ViewLayout(new.h_frames, new.v_frames, new.views)
+    print(f"{len(new.frames)} views compared in {elapsed:.1f}s; {len(changed)} changed")
+    for frame in changed[:args.top]:
+        h_index, v_index = layout.slot_of(frame)
+        print(f"  frame {frame} (h {h_index}, v {v_index}): {result.diffs[frame].score:.1%} changed")
+    # The new capture's own notes stay as they are
+    notes = new.notes
+    review = carry_notes(result, notes)
+    print(f"{len(result.notes) - len(review)} markers carried over, {len(review)} to review")
+    for marker_id in review:
+        print(f"  review {notes.get(marker_id).label} (frame {notes.get(marker_id).frame})")
+
+    if args.output:
+        crop = None
+        if new.origin != (0, 0):
+            width, height = open_frame(new.frames[0]).size
+            crop = [*new.origin, new.origin[0] + width, new.origin[1] + height]
+        data = {
+            'h_frames': new.h_frames,
+            'v_frames': new.v_frames,
+            'views': new.views,
+            'crop': crop,
+            'review': sorted({*new.review, *review}),
+            **notes.to_data()
+        }
+        save_lynx_file(args.output, new.frames, data)
+        print(f"Saved {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
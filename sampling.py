@@ -0,0 +1,154 @@
+import heapq
+import math
+
+from PIL import ImageChops, ImageStat
+
+
+# The default capture is a latitude/longitude grid: frame v * h_frames + h is
+# v rings down from the top view and h steps around. Sphere sampling instead
+# spreads views evenly over all view directions (a Fibonacci sphere), which
+# needs far fewer captures for the same coverage, and can add views between
+# neighbours that look most different.
+#
+# A view is (elevation, azimuth) in degrees: from the *Top view, rotate
+# elevation about the screen x axis, then azimuth about the screen y axis.
+# The sliders keep their grid meaning (azimuth and elevation steps) and
+# ViewLayout gives every captured view a slider position of its own near its
+# direction, so a sphere capture holds at most one view per position.
+
+GOLDEN_ANGLE = math.pi * (3 - math.sqrt(5))
+# Refined views closer than this to an existing one are skipped
+MIN_VIEW_SEPARATION = math.radians(4)
+# Nearest slider positions considered first when giving each view its own
+CANDIDATE_SLOTS = 16
+
+
+def view_direction(elevation, azimuth):
+    # Unit vector, in model space, of the side of the part facing the camera
+    e, a = math.radians(elevation), math.radians(azimuth)
+    return (-math.sin(a), math.sin(e) * math.cos(a), math.cos(e) * math.cos(a))
+
+
+def direction_view(direction):
+    x, y, z = direction
+    return math.degrees(math.atan2(y, z)), math.degrees(math.asin(max(-1.0, min(1.0, -x))))
+
+
+def _dot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+
+def sphere_views(count):
+    # count directions spread evenly over the sphere, starting at the top view
+    views = []
+    for i in range(count):
+        z = 1 - 2 * (i + 0.5) / count
+        r = math.sqrt(max(0.0, 1 - z * z))
+        phi = i * GOLDEN_ANGLE
+        views.append(direction_view((r * math.cos(phi), r * math.sin(phi), z)))
+    return views
+
+
+def refinement_views(views, thumbnails, count, neighbours=3):
+    # Up to count views halfway between the neighbouring pairs whose
+    # thumbnails differ most, i.e. where the geometry changes fastest
+    directions = [view_direction(*view) for view in views]
+    pairs = set()
+    for i, direction in enumerate(directions):
+        nearest = sorted(range(len(directions)), key=lambda j: -_dot(direction, directions[j]))
+        for j in nearest[1:neighbours + 1]:
+            pairs.add((min(i, j), max(i, j)))
+
+    scored = []
+    for i, j in pairs:
+        if thumbnails[i].size != thumbnails[j].size:
+            continue
+        diff = ImageStat.Stat(ImageChops.difference(thumbnails[i], thumbnails[j])).mean
+        scored.append((sum(diff) / len(diff), i, j))
+    scored.sort(reverse=True)
+
+    added = []
+    min_dot = math.cos(MIN_VIEW_SEPARATION)
+    for _, i, j in scored:
+        if len(added) == count:
+            break
+        mid = [a + b for a, b in zip(directions[i], directions[j])]
+        length = math.sqrt(_dot(mid, mid))
+        if length < 1e-9:
+            continue
+        mid = tuple(c / length for c in mid)
+        if any(_dot(mid, d) > min_dot for d in directions):
+            continue
+        directions.append(mid)
+        added.append(direction_view(mid))
+    return added
+
+
+class ViewLayout:
+    # Maps slider positions (h_index, v_index) to frame indices and back.
+    # Without views it is the capture grid; with views, every slider position
+    # shows the nearest view and every view sits at its nearest position.
+
+    def __init__(self, h_frames, v_frames, views=None):
+        self.h_frames = h_frames
+        self.v_frames = v_frames
+        self.views = None
+        self._frame_at = None
+        self._slot_of = None
+        if views is not None:
+            self.set_views(views)
+
+    def set_views(self, views):
+        self.views = [tuple(view) for view in views]
+        h_step = 360 / self.h_frames
+        v_step = 180 / max(1, self.v_frames - 1)
+        slots = [view_direction(v * v_step, h * h_step)
+                 for v in range(self.v_frames) for h in range(self.h_frames)]
+        directions = [view_direction(*view) for view in self.views]
+        if not directions:
+            self._frame_at = [0] * len(slots)
+            self._slot_of = []
+            return
+
+        # Each view owns one slot, the closest view/slot pairs matched first,
+        # so slot_of() always lands on the view asked for. Only the nearest
+        # CANDIDATE_SLOTS of each view are paired up front; a view that finds
+        # them all taken gets the nearest free slot. Captures keep to one view
+        # per slot; views beyond that (older files) share their nearest slot.
+        pairs = []
+        for i, direction in enumerate(directions):
+            closeness = [_dot(slot, direction) for slot in slots]
+            for s in heapq.nlargest(CANDIDATE_SLOTS, range(len(slots)), key=closeness.__getitem__):
+                pairs.append((-closeness[s], i, s))
+        pairs.sort()
+        owner = [None] * len(slots)
+        self._slot_of = [None] * len(directions)
+        for _, i, s in pairs:
+            if self._slot_of[i] is None and owner[s] is None:
+                owner[s] = i
+                self._slot_of[i] = s
+        for i, direction in enumerate(directions):
+            if self._slot_of[i] is None:
+                free = [s for s in range(len(slots)) if owner[s] is None] or range(len(slots))
+                s = max(free, key=lambda s: _dot(slots[s], direction))
+                if owner[s] is None:
+                    owner[s] = i
+                self._slot_of[i] = s
+
+        # Slots no view owns show their nearest view
+        self._frame_at = [
+            i if i is not None else max(range(len(directions)), key=lambda j: _dot(slot, directions[j]))
+            for slot, i in zip(slots, owner)
+        ]
+
+    def frame_at(self, h_index, v_index):
+        if self._frame_at is None:
+            return v_index * self.h_frames + h_index
+        return self._frame_at[v_index * self.h_frames + h_index]
+
+    def slot_of(self, frame_index):
+        # (h_index, v_index) of the slider position that shows frame_index
+        if self._slot_of is not None:
+            frame_index = self._slot_of[frame_index]
+        v_index, h_index = divmod(frame_index, self.h_frames)
+        return h_index, v_index
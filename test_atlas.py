@@ -0,0 +1,65 @@
+import threading
+import unittest
+
+from PIL import Image, ImageChops, ImageStat
+
+from atlas import ATLAS_BACKGROUND, WEBP_MAX_SIDE, ThumbnailAtlas
+
+
+def colour(index):
+    return (index * 37 % 256, index * 91 % 256, 200)
+
+
+def load(index):
+    return Image.new("RGB", (320, 240), colour(index))
+
+
+class ThumbnailAtlasTest(unittest.TestCase):
+    def test_layout(self):
+        atlas = ThumbnailAtlas.build(10, load, cell=(32, 24), columns=4)
+        self.assertEqual(len(atlas), 10)
+        self.assertEqual(atlas.image.size, (4 * 32, 3 * 24))
+        self.assertEqual(atlas.box(5), (32, 24, 64, 48))
+        self.assertEqual(atlas.layout, {'count': 10, 'cell': [32, 24], 'columns': 4})
+
+    def test_thumbnails_in_frame_order(self):
+        atlas = ThumbnailAtlas.build(10, load, cell=(32, 24), columns=4)
+        for index in range(10):
+            self.assertEqual(atlas.thumbnail(index).getpixel((16, 12)), colour(index))
+
+    def test_thumbnails_keep_aspect(self):
+        atlas = ThumbnailAtlas.build(1, lambda index: Image.new("RGB", (100, 200), (0, 0, 0)), cell=(32, 24))
+        thumbnail = atlas.thumbnail(0)
+        self.assertEqual(thumbnail.getpixel((16, 12)), (0, 0, 0))
+        self.assertEqual(thumbnail.getpixel((0, 12)), ATLAS_BACKGROUND)
+
+    def test_round_trip(self):
+        atlas = ThumbnailAtlas.build(10, load, cell=(32, 24), columns=4)
+        data = atlas.to_bytes()
+        loaded = ThumbnailAtlas.from_bytes(data, atlas.layout)
+        self.assertEqual((len(loaded), loaded.cell, loaded.columns), (10, (32, 24), 4))
+        difference = ImageStat.Stat(ImageChops.difference(atlas.image, loaded.image)).mean
+        self.assertLess(max(difference), 4)
+        # Saved again as read, not re-encoded
+        self.assertIs(loaded.to_bytes(), data)
+
+    def test_scaled(self):
+        atlas = ThumbnailAtlas.build(10, load, cell=(32, 24), columns=4)
+        self.assertIs(atlas.scaled((32, 24)), atlas)
+        scaled = atlas.scaled((16, 12))
+        self.assertEqual(scaled.image.size, (64, 36))
+        self.assertEqual(scaled.thumbnail(7).getpixel((8, 6)), colour(7))
+
+    def test_long_sequences_fit_webp(self):
+        atlas = ThumbnailAtlas.build(400, lambda index: Image.new("RGB", (8, 6)), cell=(64, 48), columns=1)
+        self.assertLessEqual(atlas.image.size[1], WEBP_MAX_SIDE)
+        self.assertEqual(atlas.cell, (32, 24))
+
+    def test_cancelled(self):
+        cancelled = threading.Event()
+        cancelled.set()
+        self.assertIsNone(ThumbnailAtlas.build(10, load, cancelled=cancelled))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+
+from backends import SyntheticBackend
+from capture import MANIFEST_NAME, CaptureEngine
+
+
+class CountingBackend(SyntheticBackend):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.saved = []
+
+    def save_image(self, path):
+        self.saved.append(os.path.basename(path))
+        super().save_image(path)
+
+
+class ManifestResumeTest(unittest.TestCase):
+    # One ring of four views, small and without waits, so each capture is quick
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def capture(self, seed=b"part", **settings):
+        backend = CountingBackend(size=(160, 120), seed=seed)
+        settings = dict(dict(h_step_degrees=90, v_total_degrees=0, delay=0, adaptive=False,
+                             pyramid_levels=(), trim=False), **settings)
+        engine = CaptureEngine(backend, self.directory, **settings)
+        engine.run()
+        return engine, backend
+
+    def manifest(self):
+        with open(os.path.join(self.directory, MANIFEST_NAME)) as f:
+            return json.load(f)
+
+    def test_complete_capture_is_reused(self):
+        first, backend = self.capture()
+        self.assertEqual(len(backend.saved), 4)
+        again, backend = self.capture()
+        self.assertEqual(again.reused, 4)
+        self.assertEqual(backend.saved, [])
+        self.assertEqual(again.frames, first.frames)
+
+    def test_resumes_from_first_bad_frame(self):
+        self.capture()
+        with Image.open(os.path.join(self.directory, "frame_002.png")) as img:
+            damaged = img.convert("RGB")
+        damaged.putpixel((0, 0), (0, 0, 0))
+        damaged.save(os.path.join(self.directory, "frame_002.png"))
+
+        engine, backend = self.capture()
+        self.assertEqual(engine.reused, 2)
+        self.assertEqual(backend.saved, ["frame_002.png", "frame_003.png"])
+        self.assertEqual([entry['index'] for entry in self.manifest()['frames']], [0, 1, 2, 3])
+
+    def test_missing_frame_is_recaptured(self):
+        self.capture()
+        os.remove(os.path.join(self.directory, "frame_003.png"))
+        engine, backend = self.capture()
+        self.assertEqual(engine.reused, 3)
+        self.assertEqual(backend.saved, ["frame_003.png"])
+
+    def test_changed_model_or_settings_start_over(self):
+        self.capture()
+        engine, backend = self.capture(seed=b"revised part")
+        self.assertEqual(engine.reused, 0)
+        self.assertEqual(len(backend.saved), 4)
+
+        engine, backend = self.capture(seed=b"revised part", h_step_degrees=120)
+        self.assertEqual(engine.reused, 0)
+        self.assertEqual(len(backend.saved), 3)
+
+    def test_no_resume(self):
+        self.capture()
+        engine, backend = self.capture(resume=False)
+        self.assertEqual(engine.reused, 0)
+        self.assertEqual(len(backend.saved), 4)
+
+    def test_trimmed_capture_is_reused_whole(self):
+        first, _ = self.capture(trim=True)
+        self.assertIsNotNone(first.crop)
+        self.assertEqual(self.manifest()['crop'], list(first.crop))
+
+        again, backend = self.capture(trim=True)
+        self.assertEqual(again.reused, 4)
+        self.assertEqual(again.crop, first.crop)
+        self.assertEqual(backend.saved, [])
+
+        # Cropped frames can't be resumed next to uncropped new ones
+        os.remove(os.path.join(self.directory, "frame_003.png"))
+        engine, backend = self.capture(trim=True)
+        self.assertEqual(engine.reused, 0)
+        self.assertEqual(len(backend.saved), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
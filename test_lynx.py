@@ -0,0 +1,243 @@
+import io
+import json
+import os
+import random
+import shutil
+import struct
+import tempfile
+import unittest
+import zipfile
+
+from PIL import Image, ImageChops, ImageDraw, ImageStat
+
+from lynx import (
+    DELTA, JOURNAL_LIMIT, JOURNAL_PREFIX, KEYFRAME, LynxArchive, read_lynx_data, save_lynx_changes,
+    save_lynx_file, write_animated_webp
+)
+
+
+def solid_frames(count=5, size=(64, 48)):
+    return [Image.new("RGB", size, (40 * i, 100, 200)) for i in range(count)]
+
+
+def moving_frames(count=6, size=(320, 240)):
+    # A detailed background with a small box moving across it, so frames
+    # after the first store as deltas; the last repeats the first
+    rng = random.Random(3)
+    base = Image.new("RGB", size, (230, 235, 245))
+    draw = ImageDraw.Draw(base)
+    for _ in range(60):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.line((x, y, x + rng.randrange(-60, 60), y + rng.randrange(-60, 60)),
+                  fill=tuple(rng.randrange(256) for _ in range(3)), width=2)
+    frames = []
+    for i in range(count - 1):
+        img = base.copy()
+        ImageDraw.Draw(img).rectangle((20 + 40 * i, 30, 50 + 40 * i, 60), fill=(200, 30, 30))
+        frames.append(img)
+    return frames + [frames[0].copy()]
+
+
+def mean_difference(a, b):
+    return max(ImageStat.Stat(ImageChops.difference(a.convert("RGB"), b.convert("RGB"))).mean)
+
+
+class RoundTripTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.frames = moving_frames()
+        cls.path = os.path.join(cls.directory, "capture.lynx")
+        cls.stats = save_lynx_file(cls.path, cls.frames, {'h_frames': 6, 'v_frames': 1, 'crop': [4, 8, 324, 248]},
+                                   levels=(2, 4))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        self.archive = LynxArchive(self.path)
+
+    def tearDown(self):
+        self.archive.close()
+
+    def test_frames_read_back(self):
+        self.assertEqual(self.archive.version, 3)
+        self.assertEqual(len(self.archive), len(self.frames))
+        self.assertEqual(self.archive.frame_size, self.frames[0].size)
+        for i, (original, stored) in enumerate(zip(self.frames, self.archive)):
+            self.assertLess(mean_difference(original, stored), 6)
+            # The moving box is where this frame has it
+            red, green, _ = stored.convert("RGB").getpixel((35 + 40 * (i % 5), 45))
+            self.assertGreater(red - green, 100)
+
+    def test_keyframes_deltas_and_duplicates(self):
+        self.assertEqual(self.archive.record(0).kind, KEYFRAME)
+        self.assertEqual(self.archive.record(1).kind, DELTA)
+        self.assertEqual(self.archive.record(1).base, 0)
+        self.assertEqual(self.archive.record(5), self.archive.record(0))
+        self.assertEqual(self.stats['duplicates'], 1)
+        self.assertLess(self.stats['bytes'], self.stats['standalone_bytes'])
+
+    def test_levels(self):
+        self.assertEqual(self.archive.levels, (2, 4))
+        self.assertEqual(self.archive.level(3, 2).size, (160, 120))
+        self.assertEqual(self.archive.level(3, 4).size, (80, 60))
+        # A level the archive doesn't have falls back to the full frame
+        self.assertEqual(self.archive.level(3, 8).size, (320, 240))
+
+    def test_data_and_atlas(self):
+        self.assertEqual(self.archive.data['crop'], [4, 8, 324, 248])
+        self.assertEqual(self.archive.data['frame_count'], 6)
+        self.assertTrue(self.archive.has_atlas)
+        self.assertEqual(len(self.archive.atlas()), 6)
+
+    def test_resave_from_archive(self):
+        copy_path = os.path.join(self.directory, "copy.lynx")
+        save_lynx_file(copy_path, self.archive, dict(self.archive.data, note="copied"))
+        copy = LynxArchive(copy_path)
+        try:
+            self.assertEqual(copy.data['note'], "copied")
+            self.assertEqual([copy.record(i).kind for i in range(6)], [self.archive.record(i).kind for i in range(6)])
+            self.assertLess(mean_difference(copy[3], self.frames[3]), 6)
+        finally:
+            copy.close()
+
+
+class OlderVersionsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.frames = solid_frames(4)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def open(self, name, entries):
+        path = os.path.join(self.directory, name)
+        with zipfile.ZipFile(path, 'w') as lynx_file:
+            for entry, payload in entries.items():
+                lynx_file.writestr(entry, payload)
+        archive = LynxArchive(path)
+        self.addCleanup(archive.close)
+        return archive
+
+    def test_v2_standalone_frames(self):
+        payloads = []
+        for img in self.frames:
+            buffer = io.BytesIO()
+            img.save(buffer, format="WEBP", lossless=True)
+            payloads.append(buffer.getvalue())
+        offsets = [0]
+        for payload in payloads:
+            offsets.append(offsets[-1] + len(payload))
+        archive = self.open("v2.lynx", {
+            'frames.bin': b''.join(payloads),
+            'frames.idx': struct.pack(f'<{len(offsets)}Q', *offsets),
+            'data.json': json.dumps({'version': 2, 'pyramid': [], 'notes': 'v2'}),
+        })
+        self.assertEqual(archive.version, 2)
+        self.assertEqual(archive.data['notes'], 'v2')
+        self.assertEqual([archive.record(i).kind for i in range(4)], [KEYFRAME] * 4)
+        for original, stored in zip(self.frames, archive):
+            self.assertEqual(stored.convert("RGB").tobytes(), original.tobytes())
+        self.assertFalse(archive.can_journal(archive.file_path))
+
+    def test_v1_animation(self):
+        animation = io.BytesIO()
+        write_animated_webp(self.frames, animation)
+        archive = self.open("v1.lynx", {
+            'animation.webp': animation.getvalue(),
+            'data.json': json.dumps({'notes': 'v1'}),
+        })
+        self.assertEqual(archive.version, 1)
+        self.assertEqual(len(archive), 4)
+        self.assertEqual(archive.data['notes'], 'v1')
+        self.assertLess(mean_difference(archive[3], self.frames[3]), 3)
+        self.assertFalse(archive.has_atlas)
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "notes.lynx")
+        save_lynx_file(self.path, solid_frames(), {'notes': 0})
+        self.archive = LynxArchive(self.path)
+
+    def tearDown(self):
+        self.archive.close()
+        shutil.rmtree(self.directory)
+
+    def journaled(self, notes):
+        self.assertIsNone(save_lynx_changes(self.path, self.archive, {'notes': notes}))
+
+    def test_append_keeps_earlier_directory(self):
+        self.journaled(1)
+        size = os.path.getsize(self.path)
+        self.journaled(2)
+        with open(self.path, 'rb') as f:
+            self.assertGreater(len(f.read()), size)
+        with zipfile.ZipFile(self.path) as lynx_file:
+            self.assertIsNone(lynx_file.testzip())
+            self.assertEqual(sum(name.startswith(JOURNAL_PREFIX) for name in lynx_file.namelist()), 2)
+        self.assertEqual(read_lynx_data(self.path)['notes'], 2)
+
+    def test_full_save_folds_the_journal(self):
+        for notes in range(1, JOURNAL_LIMIT + 1):
+            self.journaled(notes)
+        self.assertFalse(self.archive.can_journal(self.path))
+
+        stats = save_lynx_changes(self.path, self.archive, {'notes': 'compacted'})
+        self.assertIsNotNone(stats)
+        self.assertEqual(self.archive.journal_length, 0)
+        with zipfile.ZipFile(self.path) as lynx_file:
+            self.assertFalse([name for name in lynx_file.namelist() if name.startswith(JOURNAL_PREFIX)])
+            self.assertEqual(json.loads(lynx_file.read('data.json'))['notes'], 'compacted')
+        self.journaled('after')
+        self.assertEqual(read_lynx_data(self.path)['notes'], 'after')
+
+    def unfinished_append(self, tail):
+        # What a crash partway through the next append leaves behind
+        self.archive.close()
+        with open(self.path, 'ab') as f:
+            f.write(tail)
+        self.archive.reopen()
+
+    def test_unfinished_append_opens_as_before(self):
+        self.journaled(1)
+        frame = self.archive[4].tobytes()
+        for tail in (b'PK\x03\x04' + os.urandom(100), os.urandom(200000), b'PK\x03\x04' + b'PK\x05\x06\0\0'):
+            with self.subTest(tail=tail[:8]):
+                self.unfinished_append(tail)
+                self.assertEqual(self.archive.data['notes'], 1)
+                self.assertEqual(self.archive.journal_length, 1)
+                self.assertEqual(read_lynx_data(self.path)['notes'], 1)
+                self.assertEqual(self.archive[4].tobytes(), frame)
+
+    def test_append_after_unfinished_append(self):
+        self.journaled(1)
+        self.unfinished_append(os.urandom(200000))
+        self.journaled(2)
+        self.assertEqual(self.archive.journal_length, 2)
+        with zipfile.ZipFile(self.path) as lynx_file:
+            self.assertIsNone(lynx_file.testzip())
+        self.assertEqual(read_lynx_data(self.path)['notes'], 2)
+
+    def test_directory_without_its_entry_is_skipped(self):
+        # The new directory reached the disk but the entry it lists didn't
+        self.journaled(1)
+        self.archive.close()
+        with open(self.path, 'rb') as f:
+            good = f.read()
+        self.archive.reopen()
+        self.journaled(2)
+        self.archive.close()
+        with open(self.path, 'r+b') as f:
+            f.seek(len(good) + 30 + len(f'{JOURNAL_PREFIX}000002.json'))
+            f.write(b'\0' * 8)
+        self.archive.reopen()
+        self.assertEqual(self.archive.data['notes'], 1)
+        self.assertEqual(self.archive.journal_length, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+
+from annotations import AnnotationStore
+from marker_layer import MarkerLayer
+
+
+class FakeCanvas:
+    # The few canvas methods MarkerLayer uses, recording item state
+
+    def __init__(self):
+        self.items = {}
+
+    def _create(self, kind, coords, options):
+        item = len(self.items) + 1
+        self.items[item] = {'kind': kind, 'coords': coords, 'state': 'normal', **options}
+        return item
+
+    def create_polygon(self, *coords, **options):
+        return self._create('polygon', coords, options)
+
+    def create_oval(self, *coords, **options):
+        return self._create('oval', coords, options)
+
+    def create_text(self, *coords, **options):
+        return self._create('text', coords, options)
+
+    def coords(self, item, *coords):
+        self.items[item]['coords'] = coords
+
+    def itemconfigure(self, item, **options):
+        self.items[item].update(options)
+
+    def visible_text(self):
+        return sorted(item['text'] for item in self.items.values()
+                      if item['kind'] == 'text' and item['state'] == 'normal')
+
+
+class MarkerLayerTest(unittest.TestCase):
+    def setUp(self):
+        self.canvas = FakeCanvas()
+        self.layer = MarkerLayer(self.canvas)
+        self.notes = AnnotationStore()
+
+    def test_apart_markers_are_drawn_alone(self):
+        self.notes.add(0, 100, 100)
+        self.notes.add(0, 200, 100)
+        self.layer.show(self.notes.in_frame(0))
+        self.assertEqual(len(self.layer), 2)
+        self.assertEqual(self.canvas.visible_text(), ["1", "2"])
+
+    def test_overlapping_markers_cluster(self):
+        for x in (100, 105, 110):
+            self.notes.add(0, x, 100)
+        self.notes.add(0, 300, 300)
+        self.layer.show(self.notes.in_frame(0))
+        self.assertEqual(len(self.layer), 2)
+        self.assertEqual(self.canvas.visible_text(), ["3", "4"])  # the badge's count and marker 4
+
+    def test_clusters_separate_when_zoomed_in(self):
+        for x in (100, 105, 110):
+            self.notes.add(0, x, 100)
+        self.layer.show(self.notes.in_frame(0))
+        self.assertEqual(len(self.layer), 1)
+        self.layer.transform = lambda x, y: (x * 10, y * 10)
+        self.layer.show(self.notes.in_frame(0))
+        self.assertEqual(len(self.layer), 3)
+        self.assertEqual(self.canvas.visible_text(), ["1", "2", "3"])
+
+    def test_hit_marker_and_badge(self):
+        self.notes.add(0, 100, 100)
+        self.notes.add(0, 300, 300)
+        self.notes.add(0, 305, 300)
+        self.layer.show(self.notes.in_frame(0))
+        # A marker's circle hangs PIN_HEIGHT below its point
+        self.assertEqual(self.layer.hit(100, 100 + MarkerLayer.PIN_HEIGHT), (1,))
+        self.assertEqual(self.layer.hit(302.5, 300), (2, 3))
+        self.assertEqual(self.layer.hit(200, 200), ())
+
+    def test_hit_prefers_nearest(self):
+        self.notes.add(0, 100, 100)
+        self.notes.add(0, 124, 100)
+        self.layer.show(self.notes.in_frame(0))
+        self.assertEqual(len(self.layer), 2)
+        y = 100 + MarkerLayer.PIN_HEIGHT
+        self.assertEqual(self.layer.hit(110, y), (1,))
+        self.assertEqual(self.layer.hit(114, y), (2,))
+
+    def test_hit_across_grid_cells(self):
+        # Hit cells are HIT_CELL wide; a glyph near a cell edge is still found
+        x = MarkerLayer.HIT_CELL * 3 - 2
+        self.notes.add(0, x, 100)
+        self.layer.show(self.notes.in_frame(0))
+        self.assertEqual(self.layer.hit(x + 8, 100 + MarkerLayer.PIN_HEIGHT), (1,))
+
+    def test_switching_frames_reuses_items(self):
+        self.notes.add(0, 100, 100)
+        self.notes.add(1, 200, 200)
+        self.layer.show(self.notes.in_frame(0))
+        created = len(self.canvas.items)
+        self.layer.show(self.notes.in_frame(1))
+        self.assertEqual(len(self.canvas.items), created)
+        self.assertEqual(self.canvas.visible_text(), ["2"])
+        self.assertEqual(self.layer.hit(100, 100 + MarkerLayer.PIN_HEIGHT), ())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image, ImageDraw
+
+from annotations import AnnotationStore
+from lynx import LynxArchive, save_lynx_file
+from revision import CaptureSet, RevisionCompareEngine, carry_notes
+
+
+def detailed_frames(directory, count=6, size=(640, 480)):
+    # Thin coloured lines and outlined shapes: the kind of detail WebP
+    # distorts most. A small shape moves between frames, so the archive
+    # stores deltas as well as keyframes.
+    rng = random.Random(1)
+    base = Image.new("RGB", size, (230, 235, 245))
+    draw = ImageDraw.Draw(base)
+    for _ in range(150):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.line((x, y, x + rng.randrange(-120, 120), y + rng.randrange(-120, 120)),
+                  fill=tuple(rng.randrange(256) for _ in range(3)), width=rng.choice((1, 2)))
+    paths = []
+    for i in range(count):
+        img = base.copy()
+        ImageDraw.Draw(img).rectangle((50 + 10 * i, 50, 80 + 10 * i, 70), fill=(200, 30, 30))
+        path = os.path.join(directory, f"frame_{i:03d}.png")
+        img.save(path)
+        paths.append(path)
+    return paths
+
+
+def capture_set(frames, notes=None):
+    return CaptureSet(frames, (0, 0), len(frames), 1, None, notes or AnnotationStore(), [])
+
+
+class RevisionCompareTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.paths = detailed_frames(cls.directory)
+        cls.lynx_path = os.path.join(cls.directory, "capture.lynx")
+        save_lynx_file(cls.lynx_path, cls.paths, {'h_frames': len(cls.paths), 'v_frames': 1})
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_lynx_matches_its_source_capture(self):
+        archive = LynxArchive(self.lynx_path)
+        try:
+            result = RevisionCompareEngine(capture_set(archive), capture_set(self.paths)).compare()
+        finally:
+            archive.close()
+        self.assertEqual(result.changed_frames(), [])
+        self.assertEqual([diff.score for diff in result.diffs], [0.0] * len(self.paths))
+
+    def test_change_flags_nearby_markers(self):
+        notes = AnnotationStore()
+        on_change = notes.add(2, 400, 300, "on the change")
+        away = notes.add(2, 100, 400, "away from it")
+        changed = []
+        for i, path in enumerate(self.paths):
+            img = Image.open(path).convert("RGB")
+            if i == 2:
+                ImageDraw.Draw(img).ellipse((385, 285, 415, 315), fill=(60, 60, 70))
+            changed.append(img)
+
+        archive = LynxArchive(self.lynx_path)
+        try:
+            result = RevisionCompareEngine(capture_set(archive, notes), capture_set(changed)).compare()
+        finally:
+            archive.close()
+        self.assertEqual(result.changed_frames(), [2])
+        self.assertEqual(result.review, [on_change.marker_id])
+        self.assertNotIn(away.marker_id, result.review)
+
+    def test_carried_notes_keep_the_new_notes(self):
+        old = AnnotationStore()
+        old.add(0, 10, 10, "old")
+        new = AnnotationStore()
+        new.add(1, 20, 20, "new")
+        result = RevisionCompareEngine(capture_set(self.paths, old), capture_set(self.paths)).compare()
+
+        review = carry_notes(result, new)
+        self.assertEqual(review, [])
+        self.assertEqual(sorted(note.text for note in new), ["new", "old"])
+        self.assertEqual(len({note.marker_id for note in new}), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+
+import bench
+
+
+class StartupTest(unittest.TestCase):
+    # Runs the viewer's startup in a fresh interpreter (see bench.STARTUP_PROBE):
+    #
+    #   python -m unittest test_startup
+
+    @classmethod
+    def setUpClass(cls):
+        # Best of a few runs, so a cold disk cache doesn't decide it
+        cls.runs = [bench.startup_probe() for _ in range(3)]
+
+    def test_within_budget(self):
+        fastest = min(bench.startup_ms(run) for run in self.runs)
+        self.assertLessEqual(fastest, bench.STARTUP_BUDGET_MS)
+
+    def test_defers_heavy_modules(self):
+        for run in self.runs:
+            self.assertEqual(run['loaded'], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+from PIL import Image, ImageDraw
+
+from trim import content_bbox, pad_bbox, union_bbox
+
+
+GREY = (128, 128, 128)
+PART = (60, 60, 200)
+
+
+def vertical_gradient(size=(640, 480)):
+    # SolidWorks's default viewport background runs top to bottom
+    return Image.linear_gradient("L").resize(size).convert("RGB")
+
+
+def with_part(img, box):
+    img = img.copy()
+    ImageDraw.Draw(img).rectangle(box, fill=PART)
+    return img
+
+
+class ContentBboxTest(unittest.TestCase):
+    def test_blank_frames(self):
+        self.assertIsNone(content_bbox(Image.new("RGB", (640, 480), GREY)))
+        self.assertIsNone(content_bbox(vertical_gradient()))
+        self.assertIsNone(content_bbox(vertical_gradient().transpose(Image.Transpose.ROTATE_90)))
+
+    def test_part_on_gradient(self):
+        self.assertEqual(content_bbox(with_part(vertical_gradient(), (200, 100, 300, 200))), (200, 100, 301, 201))
+
+    def test_part_touching_left_edge(self):
+        img = with_part(Image.new("RGB", (640, 480), GREY), (0, 150, 300, 260))
+        self.assertEqual(content_bbox(img), (0, 150, 301, 261))
+
+    def test_part_touching_right_edge(self):
+        img = with_part(Image.new("RGB", (640, 480), GREY), (340, 150, 639, 260))
+        self.assertEqual(content_bbox(img), (340, 150, 640, 261))
+
+    def test_part_in_corner_of_gradient(self):
+        img = with_part(vertical_gradient(), (500, 0, 639, 200))
+        self.assertEqual(content_bbox(img), (500, 0, 640, 201))
+
+    def test_part_touching_edge_of_horizontal_gradient(self):
+        img = with_part(vertical_gradient().transpose(Image.Transpose.ROTATE_90).resize((640, 480)), (0, 100, 100, 200))
+        self.assertEqual(content_bbox(img), (0, 100, 101, 201))
+
+
+class BboxHelpersTest(unittest.TestCase):
+    def test_union_skips_blank_frames(self):
+        self.assertEqual(union_bbox([None, (10, 20, 30, 40), (5, 25, 20, 50)]), (5, 20, 30, 50))
+        self.assertIsNone(union_bbox([None, None]))
+
+    def test_pad_stays_inside_frame(self):
+        self.assertEqual(pad_bbox((2, 100, 635, 200), (640, 480), 8), (0, 92, 640, 208))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+
+# Timing spans around the hot paths (capture, frame decode, LYNX/WebP
+# encode, PDF layout). Recording is off by default and span() then returns
+# a shared no-op context manager, so instrumented code pays for one flag
+# check. Turn it on from View > Record Trace, or for a whole run with
+#
+#   NOTEBUDDY_TRACE=trace.json python "Solidworks Note Buddy.py"
+#
+# which writes a Chrome trace (open it in chrome://tracing or Perfetto) when
+# the program exits and prints a per-span summary to stderr.
+
+TRACE_ENV = 'NOTEBUDDY_TRACE'
+DEFAULT_TRACE_PATH = 'notebuddy_trace.json'
+
+_enabled = False
+_events = []  # (name, start_ns, duration_ns, thread id, args)
+_thread_names = {}
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter_ns() - self.start
+        thread = threading.current_thread()
+        _thread_names[thread.ident] = thread.name
+        # list.append is atomic, so worker threads record without a lock
+        _events.append((self.name, self.start, duration, thread.ident, self.args))
+        return False
+
+
+def span(name, **args):
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, args)
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def clear():
+    del _events[:]
+
+
+def chrome_trace():
+    pid = os.getpid()
+    events = [
+        {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}}
+        for tid, thread_name in list(_thread_names.items())
+    ]
+    for name, start, duration, tid, args in list(_events):
+        events.append({
+            'name': name,
+            'cat': name.split('.')[0],
+            'ph': 'X',
+            'ts': start / 1000,
+            'dur': duration / 1000,
+            'pid': pid,
+            'tid': tid,
+            'args': args,
+        })
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def write_chrome_trace(path):
+    with open(path, 'w') as f:
+        json.dump(chrome_trace(), f)
+
+
+def summary():
+    # Per span name: count and total/mean/max milliseconds, slowest total first
+    durations = defaultdict(list)
+    for name, _, duration, _, _ in list(_events):
+        durations[name].append(duration / 1e6)
+    rows = [
+        {
+            'name': name,
+            'count': len(values),
+            'total_ms': sum(values),
+            'mean_ms': sum(values) / len(values),
+            'max_ms': max(values),
+        }
+        for name, values in durations.items()
+    ]
+    return sorted(rows, key=lambda row: row['total_ms'], reverse=True)
+
+
+def format_summary(rows=None):
+    rows = summary() if rows is None else rows
+    width = max([len(row['name']) for row in rows] + [4])
+    lines = [f"{'span':<{width}}  {'count':>7}  {'total ms':>10}  {'mean ms':>9}  {'max ms':>9}"]
+    for row in rows:
+        lines.append(
+            f"{row['name']:<{width}}  {row['count']:>7}  {row['total_ms']:>10.1f}"
+            f"  {row['mean_ms']:>9.2f}  {row['max_ms']:>9.2f}"
+        )
+    return '\n'.join(lines)
+
+
+def _dump_at_exit(path):
+    if not _events:
+        return
+    write_chrome_trace(path)
+    print(f"Trace written to {path}\n{format_summary()}", file=sys.stderr)
+
+
+if os.environ.get(TRACE_ENV):
+    enable()
+    _path = os.environ[TRACE_ENV]
+    atexit.register(_dump_at_exit, DEFAULT_TRACE_PATH if _path == '1' else _path)
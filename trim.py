@@ -0,0 +1,141 @@
+from PIL import Image, ImageStat
+
+from lynx import changed_bbox
+from pyramid import save_replacing
+
+
+# Captured frames are full viewport grabs, mostly uniform background. The
+# capture records where the part is in every frame, then crops the whole
+# sequence to the union of those boxes so every frame keeps the same size
+# and the same offset into the original viewport.
+
+TRIM_MARGIN = 8
+TRIM_TOLERANCE = 12
+BORDER_STRIP = 4  # edge pixels averaged into the background colour of a row
+
+
+def _close(a, b, tolerance=TRIM_TOLERANCE):
+    return max(abs(x - y) for x, y in zip(a, b)) <= tolerance
+
+
+def _colours(column):
+    # The RGB colours of a 1 pixel wide column, top to bottom
+    data = column.tobytes()
+    return [tuple(data[i:i + 3]) for i in range(0, len(data), 3)]
+
+
+def _column(colours):
+    return Image.frombytes("RGB", (1, len(colours)), bytes(value for colour in colours for value in colour))
+
+
+def _median(img, box):
+    return [int(v) for v in ImageStat.Stat(img.crop(box)).median]
+
+
+def _blend(left, right, size):
+    # Blends each row from the left column's colour to the right column's
+    blend = Image.linear_gradient("L").transpose(Image.Transpose.ROTATE_90).resize(size, Image.Resampling.BILINEAR)
+    return Image.composite(right.resize(size, Image.Resampling.NEAREST),
+                           left.resize(size, Image.Resampling.NEAREST), blend)
+
+
+def frame_columns(img, strip=BORDER_STRIP):
+    # Frame-wide background as its left and right edge columns, blended
+    # between the top and bottom strips. Each strip gives the median colour
+    # of its left and right halves, extended to the frame edges, so vertical
+    # and horizontal gradients both fit. A part rarely covers half of a
+    # half-strip, so the medians hold even where it runs off the viewport.
+    width, height = img.size
+    strip = min(strip, width, height)
+    half = max(1, width // 2)
+    corners = []
+    for top in (0, height - strip):
+        left = _median(img, (0, top, half, top + strip))
+        right = _median(img, (width - half, top, width, top + strip))
+        corners.append(([1.5 * l - 0.5 * r for l, r in zip(left, right)],
+                        [1.5 * r - 0.5 * l for l, r in zip(left, right)]))
+    columns = []
+    for side in (0, 1):
+        top, bottom = corners[0][side], corners[1][side]
+        columns.append(_column([
+            tuple(max(0, min(255, round(t + (b - t) * y / max(1, height - 1)))) for t, b in zip(top, bottom))
+            for y in range(height)
+        ]))
+    return columns
+
+
+def background(img, strip=BORDER_STRIP):
+    # Estimated background: each row blends from the colour at its left edge
+    # to the colour at its right edge, each averaged over a strip of border
+    # pixels. Exact for flat backgrounds and linear gradients, such as
+    # SolidWorks's top-to-bottom default; close for the rest. Where the two
+    # edges of a row disagree the part may touch one of them, so a side that
+    # also disagrees with frame_columns() takes its colour instead.
+    width, height = img.size
+    strip = min(strip, width)
+    left = img.crop((0, 0, strip, height)).resize((1, height), Image.Resampling.BOX)
+    right = img.crop((width - strip, 0, width, height)).resize((1, height), Image.Resampling.BOX)
+    frame_left, frame_right = (_colours(column) for column in frame_columns(img, strip))
+    left_colours, right_colours = _colours(left), _colours(right)
+    for y, (l, r) in enumerate(zip(left_colours, right_colours)):
+        if not _close(l, r):
+            if not _close(l, frame_left[y]):
+                left_colours[y] = frame_left[y]
+            if not _close(r, frame_right[y]):
+                right_colours[y] = frame_right[y]
+    return _blend(_column(left_colours), _column(right_colours), img.size)
+
+
+def content_bbox(img, tolerance=TRIM_TOLERANCE):
+    # Box around everything that differs from the background by more than
+    # tolerance; None for a blank frame. A side whose edge strip differs
+    # from the frame-wide background is never trimmed: something there
+    # runs off the viewport.
+    img = img.convert("RGB")
+    bbox = changed_bbox(background(img), img, tolerance)
+    width, height = img.size
+    strip = min(BORDER_STRIP, width, height)
+    frame = _blend(*frame_columns(img), img.size)
+    edges = (
+        (0, 0, strip, height),
+        (0, 0, width, strip),
+        (width - strip, 0, width, height),
+        (0, height - strip, width, height),
+    )
+    touching = [side for side, box in enumerate(edges) if changed_bbox(frame.crop(box), img.crop(box), tolerance)]
+    if not touching:
+        return bbox
+    bbox = list(bbox or changed_bbox(frame, img, tolerance))
+    for side in touching:
+        bbox[side] = (0, 0, width, height)[side]
+    return tuple(bbox)
+
+
+def union_bbox(boxes):
+    boxes = [box for box in boxes if box is not None]
+    if not boxes:
+        return None
+    return (
+        min(box[0] for box in boxes),
+        min(box[1] for box in boxes),
+        max(box[2] for box in boxes),
+        max(box[3] for box in boxes),
+    )
+
+
+def pad_bbox(bbox, size, margin=TRIM_MARGIN):
+    left, top, right, bottom = bbox
+    return (
+        max(0, left - margin),
+        max(0, top - margin),
+        min(size[0], right + margin),
+        min(size[1], bottom + margin),
+    )
+
+
+def crop_frame_file(frame_path, crop):
+    # Replaced atomically; the viewer may be reading the frame meanwhile
+    with Image.open(frame_path) as img:
+        cropped = img.crop(crop)
+    save_replacing(cropped, frame_path)
+    return cropped